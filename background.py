@@ -0,0 +1,62 @@
+import random
+import pygame
+
+
+class BackgroundLayer:
+    """A background drawn once into a surface and blitted every frame.
+
+    With parallax 0 the layer is fixed to the screen and costs one blit.
+    Otherwise it scrolls by parallax times the camera movement (0 < parallax
+    < 1 looks further away than the world) and wraps around, so it is tiled
+    with up to four blits. Layers above the first should have a colorkey so
+    the ones below show through.
+    """
+
+    def __init__(self, surface, parallax=0.0):
+        self.surface = surface
+        self.parallax = parallax
+
+    def draw(self, screen, camera_x=0, camera_y=0, area=None):
+        """Draw the layer over the whole screen, or only over area (a screen Rect)."""
+        if not self.parallax:
+            if area is None:
+                screen.blit(self.surface, (0, 0))
+            else:
+                screen.blit(self.surface, area, area)
+            return
+
+        clip = screen.get_clip()
+        if area is not None:
+            screen.set_clip(area)
+        width, height = self.surface.get_size()
+        screen_width, screen_height = screen.get_size()
+        start_x = -int(camera_x * self.parallax) % width - width
+        start_y = -int(camera_y * self.parallax) % height - height
+        screen.blits([(self.surface, (x, y))
+                      for y in range(start_y, screen_height, height)
+                      for x in range(start_x, screen_width, width)
+                      if x + width > 0 and y + height > 0],
+                     doreturn=False)
+        screen.set_clip(clip)
+
+
+def render_starfield(width, height, count, seed, brightness=(100, 255), radius=1, fill=None):
+    """A surface with count stars at fixed random positions.
+
+    With fill the surface is opaque (a base layer); without it the empty
+    space is transparent (colorkey black) so the layer can go on top of
+    others.
+    """
+    rng = random.Random(seed)
+    surface = pygame.Surface((width, height))
+    if fill is not None:
+        surface.fill(fill)
+    for _ in range(count):
+        x, y = rng.randint(0, width), rng.randint(0, height)
+        level = rng.randint(*brightness)
+        pygame.draw.circle(surface, (level, level, level), (x, y), radius)
+    if pygame.display.get_surface() is not None:
+        surface = surface.convert()  # Display pixel format, for fast blits
+    if fill is None:
+        surface.set_colorkey((0, 0, 0), pygame.RLEACCEL)
+    return surface
@@ -0,0 +1,184 @@
+"""Per-phase tick benchmarks for the server simulation.
+
+Each scenario fills a HeadlessSimulation with a number of players, NPCs
+and bullets, keeps those counts topped up, and times every phase of
+GameRoom.simulate_tick and broadcast (see GameRoom.PHASES) over a number
+of ticks. Results are written as JSON with a fixed layout, so they can be
+stored and compared:
+
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline bench.json   # exits 1 on a regression
+
+The default scenarios vary one of players / NPCs / bullets at a time
+around a baseline; --full runs the whole grid.
+"""
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import numpy as np
+from game_room import GameRoom
+from simulation import HeadlessSimulation, random_script
+
+SCHEMA_VERSION = 1
+
+BASELINE = (8, 50, 1000)  # players, NPCs, bullets
+PLAYER_COUNTS = [1, 8, 16, 64]
+NPC_COUNTS = [5, 50, 500, 5000]
+BULLET_COUNTS = [100, 1000, 5000, 20000]
+FULL_GRID = ([1, 8, 64], [5, 500, 5000], [100, 2000, 20000])
+
+# Phases faster than this (p50, microseconds) are too noisy to compare
+MIN_COMPARABLE_US = 20
+
+
+def default_scenarios():
+    players, npcs, bullets = BASELINE
+    scenarios = [(count, npcs, bullets) for count in PLAYER_COUNTS]
+    scenarios += [(players, count, bullets) for count in NPC_COUNTS]
+    scenarios += [(players, npcs, count) for count in BULLET_COUNTS]
+    return sorted(set(scenarios))
+
+
+def full_scenarios():
+    return list(itertools.product(*FULL_GRID))
+
+
+def scenario_name(players, npcs, bullets):
+    return f"players={players},npcs={npcs},bullets={bullets}"
+
+
+def summarize(samples):
+    """Timing statistics in microseconds."""
+    if not samples:
+        return None
+    us = np.sort(np.asarray(samples)) * 1e6
+    return {
+        'n': len(us),
+        'mean_us': round(float(us.mean()), 1),
+        'p50_us': round(float(np.percentile(us, 50)), 1),
+        'p95_us': round(float(np.percentile(us, 95)), 1),
+        'max_us': round(float(us[-1]), 1),
+    }
+
+
+def top_up(sim, npcs, bullets):
+    """Bring the NPC and bullet counts back to their targets."""
+    game_state = sim.room.game_state
+    missing_npcs = npcs - len(game_state['npcs'])
+    if missing_npcs > 0:
+        sim.add_npcs(missing_npcs)
+    missing_bullets = bullets - game_state['bullets'].count
+    if missing_bullets > 0:
+        sim.add_bullets(missing_bullets)
+
+
+def run_scenario(players, npcs, bullets, ticks, warmup, seed):
+    sim = HeadlessSimulation(seed=seed, script=random_script(seed))
+    for _ in range(players):
+        sim.add_player()
+    top_up(sim, npcs, bullets)
+
+    names = [name for name, _ in GameRoom.PHASES] + GameRoom.BROADCAST_PHASES + ['tick']
+    samples = {name: [] for name in names}
+    sim.room.phase_timer = lambda name, seconds: samples[name].append(seconds)
+
+    for tick in range(warmup + ticks):
+        if tick == warmup:
+            for values in samples.values():
+                values.clear()
+            sent = {pid: sender.bytes_sent for pid, sender in sim.senders.items()}
+            broadcasts = 0
+        top_up(sim, npcs, bullets)
+        start = time.perf_counter()
+        broadcast = sim.step()
+        # Tick time includes the broadcast, when there was one
+        samples['tick'].append(time.perf_counter() - start)
+        if tick >= warmup:
+            broadcasts += broadcast
+
+    snapshot_bytes = sum(sender.bytes_sent - sent.get(pid, 0) for pid, sender in sim.senders.items())
+    return {
+        'name': scenario_name(players, npcs, bullets),
+        'players': players,
+        'npcs': npcs,
+        'bullets': bullets,
+        'ticks': ticks,
+        'phases': {name: summarize(values) for name, values in samples.items()},
+        'snapshot_bytes_per_client': round(snapshot_bytes / max(1, broadcasts * players), 1),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Phases whose p50 grew by more than tolerance against baseline. Returns report lines."""
+    previous = {scenario['name']: scenario for scenario in baseline['scenarios']}
+    regressions = []
+    for scenario in results['scenarios']:
+        old = previous.get(scenario['name'])
+        if old is None:
+            continue
+        for phase, stats in scenario['phases'].items():
+            old_stats = old['phases'].get(phase)
+            if not stats or not old_stats or old_stats['p50_us'] < MIN_COMPARABLE_US:
+                continue
+            ratio = stats['p50_us'] / old_stats['p50_us']
+            if ratio > 1 + tolerance:
+                regressions.append(f"{scenario['name']} {phase}: p50 {old_stats['p50_us']:.1f} -> "
+                                   f"{stats['p50_us']:.1f} us ({ratio:.2f}x)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ticks', type=int, default=120, help="measured ticks per scenario")
+    parser.add_argument('--warmup', type=int, default=30, help="ticks run before measuring")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--full', action='store_true', help="run the full players x NPCs x bullets grid")
+    parser.add_argument('--scenario', action='append', metavar='P,N,B',
+                        help="run only this players,npcs,bullets scenario (repeatable)")
+    parser.add_argument('--output', help="write the JSON results here instead of stdout")
+    parser.add_argument('--baseline', help="compare against earlier results; exit 1 on regressions")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed p50 slowdown against the baseline (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.scenario:
+        scenarios = [tuple(int(v) for v in s.split(',')) for s in args.scenario]
+    else:
+        scenarios = full_scenarios() if args.full else default_scenarios()
+
+    results = {
+        'schema': SCHEMA_VERSION,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'seed': args.seed,
+        'warmup': args.warmup,
+        'scenarios': [],
+    }
+    for players, npcs, bullets in scenarios:
+        print(f"{scenario_name(players, npcs, bullets)} ...", file=sys.stderr)
+        results['scenarios'].append(run_scenario(players, npcs, bullets, args.ticks, args.warmup, args.seed))
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+import math
+import numpy as np
+from patterns import MAX_BULLET_LIFETIME, get_trajectory
+from spatial_hash import PointGrid
+
+# Owner id stored for boss bullets (player ids are always >= 0)
+BOSS_OWNER = -1
+# Bullet ids wrap around at 16 bits (the size of the id on the wire)
+BULLET_ID_MASK = 0xFFFF
+
+
+class BulletPool:
+    """Struct-of-arrays storage for every live bullet on the server.
+
+    Replaces the list of Bullet/MathBullet objects: all bullets are kept in
+    preallocated NumPy arrays and moved, offset and culled with a handful of
+    batched array operations per tick. Slots [0, count) are live; removed
+    bullets are swap-removed so the live range stays contiguous.
+
+    Every bullet has a pattern row in self.tables, the precomputed trajectory
+    table of its expression (see patterns.TrajectoryCache). Row 0 is all
+    zeros and is used by straight bullets (Bullet); other rows make the
+    bullet follow an expression perpendicular to its direction of travel
+    (MathBullet). Bullets are culled after max_lifetime ticks, the length of
+    the tables.
+    """
+    HITBOX_RADIUS = 5
+
+    FIELDS = {
+        'x': np.float64,
+        'y': np.float64,
+        'angle': np.float64,
+        'speed': np.float64,
+        'vx': np.float64,       # cos(angle) * speed
+        'vy': np.float64,       # sin(angle) * speed
+        'px': np.float64,       # Unit vector perpendicular to travel
+        'py': np.float64,
+        't': np.int32,          # Ticks alive (MathBullet's x variable)
+        'owner': np.int32,      # Player id, or BOSS_OWNER
+        'damage': np.int32,
+        'pattern': np.int32,    # Row in self.tables, 0 = straight
+        'id': np.int32,         # Spawn counter, lets clients match bullets across snapshots
+    }
+
+    def __init__(self, capacity=1024, max_lifetime=MAX_BULLET_LIFETIME):
+        self.count = 0
+        self.next_id = 0
+        self.capacity = capacity
+        for name, dtype in self.FIELDS.items():
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+        # Hit flags set during the collision pass, cleared by remove_hit()
+        self.hit = np.zeros(capacity, dtype=bool)
+
+        # Trajectory tables, one row per expression in use (row 0 = straight)
+        self.max_lifetime = max_lifetime
+        self.tables = np.zeros((1, max_lifetime + 1), dtype=np.float32)
+        self.pattern_ids = {}   # {expression: row in self.tables}
+
+        # Broad phase for overlapping(); rebuilt lazily after bullets change
+        self.grid = PointGrid()
+        self.grid_valid = False
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self):
+        """Double the capacity of every array, keeping the live bullets."""
+        new_capacity = self.capacity * 2
+        for name in list(self.FIELDS) + ['hit']:
+            old = getattr(self, name)
+            new = np.zeros(new_capacity, dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+        self.capacity = new_capacity
+
+    def _pattern_index(self, expression):
+        """Return the table row for an expression, loading it on first use.
+
+        Rows no longer referenced by any live bullet are recycled before the
+        table array is grown.
+        """
+        index = self.pattern_ids.get(expression)
+        if index is not None:
+            return index
+
+        table = get_trajectory(expression)
+        if table is None:
+            index = 0  # Invalid expression: straight line (no offset)
+        else:
+            in_use = set(np.unique(self.pattern[:self.count]).tolist())
+            free = [row for row in range(1, len(self.tables)) if row not in in_use]
+            if free:
+                index = free[0]
+                self.pattern_ids = {e: r for e, r in self.pattern_ids.items() if r != index}
+            else:
+                index = len(self.tables)
+                self.tables = np.vstack([self.tables, np.zeros_like(self.tables[:1])])
+            self.tables[index] = table[:self.max_lifetime + 1]
+        self.pattern_ids[expression] = index
+        return index
+
+    def spawn(self, x, y, angle, owner_id, speed=12, damage=10, expression=None):
+        """Add a bullet. With an expression it behaves like a MathBullet."""
+        if self.count == self.capacity:
+            self._grow()
+
+        i = self.count
+        angle_rad = math.radians(angle)
+        self.x[i] = x
+        self.y[i] = y
+        self.angle[i] = angle
+        self.speed[i] = speed
+        self.vx[i] = math.cos(angle_rad) * speed
+        self.vy[i] = math.sin(angle_rad) * speed
+        self.px[i] = -math.sin(angle_rad)  # cos(angle + 90)
+        self.py[i] = math.cos(angle_rad)   # sin(angle + 90)
+        self.t[i] = 0
+        self.owner[i] = BOSS_OWNER if owner_id == 'boss' else owner_id
+        self.damage[i] = damage
+        self.pattern[i] = 0 if expression is None else self._pattern_index(expression)
+        self.hit[i] = False
+        self.id[i] = self.next_id
+        self.next_id = (self.next_id + 1) & BULLET_ID_MASK
+        self.count += 1
+        self.grid_valid = False
+
+    def move(self):
+        """Advance every bullet by one tick."""
+        n = self.count
+        if n == 0:
+            return
+
+        self.grid_valid = False
+        self.t[:n] += 1
+        self.x[:n] += self.vx[:n]
+        self.y[:n] += self.vy[:n]
+
+        # Waveform offsets: one gather from the trajectory tables
+        t = np.minimum(self.t[:n], self.max_lifetime)
+        offsets = self.tables[self.pattern[:n], t]
+        self.x[:n] += offsets * self.px[:n]
+        self.y[:n] += offsets * self.py[:n]
+
+    def _compact(self, dead):
+        """Swap-remove every slot flagged in the boolean array dead (len == count).
+
+        Holes left below the new count are filled from live slots above it,
+        so only the tail of the pool is touched.
+        """
+        n = self.count
+        new_count = n - int(np.count_nonzero(dead))
+        if new_count == n:
+            return
+
+        holes = np.flatnonzero(dead[:new_count])
+        fillers = new_count + np.flatnonzero(~dead[new_count:n])
+        if len(holes):
+            for name in list(self.FIELDS) + ['hit']:
+                arr = getattr(self, name)
+                arr[holes] = arr[fillers]
+        self.count = new_count
+        self.grid_valid = False
+
+    def remove_out_of_bounds(self, width, height):
+        """Cull bullets that left the screen or outlived their trajectory table."""
+        n = self.count
+        x = self.x[:n]
+        y = self.y[:n]
+        out = (x < 0) | (x > width) | (y < 0) | (y > height) | (self.t[:n] > self.max_lifetime)
+        self._compact(out)
+
+    def remove_hit(self):
+        """Remove every bullet flagged during the collision pass."""
+        self._compact(self.hit[:self.count])
+
+    def overlapping(self, x, y, radius, exclude_owner=None):
+        """Indices of live, not yet hit bullets whose hitbox overlaps a circle.
+
+        Only bullets in the grid cells around the circle are tested, so a
+        query costs O(nearby bullets) instead of O(count).
+        """
+        if not self.grid_valid:
+            self.grid.build(self.x[:self.count], self.y[:self.count])
+            self.grid_valid = True
+
+        reach = radius + self.HITBOX_RADIUS
+        idx = self.grid.query(x, y, reach)
+        if len(idx) == 0:
+            return idx
+        dx = self.x[idx] - x
+        dy = self.y[idx] - y
+        mask = (dx * dx + dy * dy < reach * reach) & ~self.hit[idx]
+        if exclude_owner is not None:
+            mask &= self.owner[idx] != exclude_owner
+        return idx[mask]
+
+    def owner_id(self, i):
+        """Owner of bullet i as used elsewhere on the server ('boss' or player id)."""
+        owner = int(self.owner[i])
+        return 'boss' if owner == BOSS_OWNER else owner
+
+    def get_arrays(self):
+        """Copies of the live (x, y, angle, owner, id) arrays for binary encoding."""
+        n = self.count
+        return (self.x[:n].copy(), self.y[:n].copy(), self.angle[:n].copy(),
+                self.owner[:n].copy(), self.id[:n].copy())
+
+    def get_states(self):
+        """List of (x, y, angle, owner_id, bullet_id) tuples for broadcasting."""
+        n = self.count
+        return states_from_arrays((self.x[:n], self.y[:n], self.angle[:n], self.owner[:n],
+                                   self.id[:n]))
+
+
+def states_from_arrays(arrays):
+    """Turn (xs, ys, angles, owners, ids) arrays into (x, y, angle, owner_id, id) tuples."""
+    xs, ys, angles, owners, ids = arrays
+    owner_ids = ['boss' if o == BOSS_OWNER else o for o in owners.tolist()]
+    return list(zip(xs.tolist(), ys.tolist(), angles.tolist(), owner_ids, ids.tolist()))
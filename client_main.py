@@ -1,58 +1,310 @@
+import argparse
 import socket
 import json
 import threading
+import time
+from collections import deque
 from client_renderer import GameRenderer
+from framing import FrameReader
+from prediction import LocalPlayerPredictor
+from protocol import (FEATURE_BINARY_INPUT, FEATURE_DELTA, FEATURE_UDP, KIND_DELTA, KIND_JSON,
+                      KIND_KEYFRAME, KIND_REGISTER, KIND_STATE, MAX_SNAPSHOT_FRAME, PROTOCOL_BINARY,
+                      decode_events, decode_snapshot, decode_state, encode_input, encode_json_message,
+                      pack_frame, snapshot_ticks)
+from snapshots import SnapshotAssembler, SnapshotBuffer, to_render_state
+from udp_transport import UDP_TOKEN, make_udp_socket
 
 # Configuration
 HOST = 'localhost'
 PORT = 9999
+# Inputs are sent when the keys change, and at least this often (seconds)
+# so the server keeps getting snapshot acks
+INPUT_KEEPALIVE = 0.1
+
+# Optional UDP channel for snapshots and inputs (see udp_transport.py), used
+# with --udp if the server offers it. Loss and latency are simulated on
+# outgoing datagrams.
+USE_UDP = False
+UDP_LOSS = 0.0
+UDP_LATENCY = 0.0
+# Over UDP a lost input packet is only repaired by the next one
+UDP_INPUT_KEEPALIVE = 1 / 30
+UDP_REGISTER_INTERVAL = 0.2
+UDP_REGISTER_ATTEMPTS = 25
+
+# Redraw and present only the changed parts of the screen while the view
+# is still (see GameRenderer); helps on software-rendered displays
+DIRTY_RECTS = False
+
+SNAPSHOT_KINDS = (KIND_STATE, KIND_KEYFRAME, KIND_DELTA)
 
 # Game state (shared between threads)
-game_state = {'players': {}, 'bullets': []}
+game_state = {'players': {}, 'bullets': []}  # Newest snapshot received
 my_player_id = None
-lock = threading.Lock()
+world_size = None  # (width, height) from the server's init message
+lock = threading.Lock()  # Between the TCP and UDP receive threads
 connected = False
+assembler = SnapshotAssembler()  # Rebuilds full states from keyframes/deltas
+resync_pending = False
+# Decoded states and resets, handed from the receive threads to the render
+# loop. deque appends and pops are atomic, so neither side takes a lock.
+state_updates = deque()
+# Owned by the render loop (see apply_state_updates)
+snapshot_buffer = SnapshotBuffer()  # Recent snapshots, interpolated for drawing
+predictor = LocalPlayerPredictor()  # Our own ship, predicted from our inputs
+send_lock = threading.Lock()  # Both threads send; keeps messages whole and in order
+binary_input = False  # Whether we switched to binary input frames after our hello
+udp_socket = None
+udp_server = None     # Server's UDP (host, port), if it offered UDP
+udp_token = None
+udp_ready = False     # Server has our UDP address; inputs go over UDP
+
+
+def send_message(sock, msg):
+    """Send a JSON message in whichever upstream format is in use."""
+    with send_lock:
+        if binary_input:
+            sock.sendall(pack_frame(encode_json_message(msg)))
+        else:
+            sock.sendall((json.dumps(msg) + '\n').encode())
+
+
+def send_input(sock, inputs, seq, ack):
+    """Send one input packet (a 10-byte frame once binary input is in use)."""
+    if udp_ready:
+        udp_socket.sendto(UDP_TOKEN.pack(udp_token) + encode_input(inputs, seq, ack), udp_server)
+        return
+    with send_lock:
+        if binary_input:
+            sock.sendall(pack_frame(encode_input(inputs, seq, ack)))
+        else:
+            sock.sendall((json.dumps(dict(inputs, seq=seq, ack=ack)) + '\n').encode())
+
+
+def handle_message(sock, msg):
+    """Handle one decoded message (JSON or binary) from the server."""
+    global game_state, my_player_id, world_size, resync_pending, binary_input
+    global udp_server, udp_token, udp_ready
+
+    msg_type = msg.get('type')
+    if msg_type == 'init':
+        my_player_id = msg['id']
+        if 'world' in msg:
+            world_size = tuple(msg['world'])
+        state_updates.append(('reset', msg.get('tick_rate', 60), world_size))
+        print(f"Connected as Player {my_player_id} ({msg.get('color', 'unknown')})")
+        if USE_UDP and FEATURE_UDP in msg.get('features', []):
+            udp_server = (socket.gethostbyname(HOST), msg[FEATURE_UDP]['port'])
+            udp_token = msg[FEATURE_UDP]['token']
+        # Ask for compact binary delta snapshots if the server offers them
+        if PROTOCOL_BINARY in msg.get('protocols', []):
+            features = msg.get('features', [])
+            hello = {
+                'type': 'hello',
+                'protocol': PROTOCOL_BINARY,
+                FEATURE_DELTA: FEATURE_DELTA in features,
+                FEATURE_BINARY_INPUT: FEATURE_BINARY_INPUT in features,
+            }
+            # Everything we send after this hello uses the new format
+            with send_lock:
+                sock.sendall((json.dumps(hello) + '\n').encode())
+                binary_input = hello[FEATURE_BINARY_INPUT]
+    elif msg_type == 'state':
+        game_state = msg
+        state_updates.append(('state', msg, time.perf_counter()))
+    elif msg_type == 'error':
+        print(f"Server: {msg.get('message')}")
+    elif msg_type == 'udp':
+        udp_ready = True
+        print("Using UDP for snapshots and inputs")
+    elif msg_type in ('keyframe', 'delta'):
+        # Snapshots may come from both the TCP and the UDP receive thread
+        with lock:
+            if assembler.latest_tick is not None and msg['tick'] <= assembler.latest_tick:
+                return  # Older than what we have (reordered or late datagram)
+            state = assembler.apply(msg)
+        if state is not None:
+            game_state = to_render_state(state)
+            state_updates.append(('snapshot', state, time.perf_counter()))
+        else:
+            # Baseline unknown: ask for a keyframe (once until one arrives)
+            if not resync_pending:
+                resync_pending = True
+                send_message(sock, {'type': 'resync'})
+            return
+        if msg_type == 'keyframe':
+            resync_pending = False
+
+
+def apply_state_updates():
+    """Hand the states decoded since the last frame to the playout buffer and predictor.
+
+    Runs in the render loop, which owns snapshot_buffer and predictor, so
+    drawing never waits for a receive thread.
+    """
+    while state_updates:
+        kind, *args = state_updates.popleft()
+        if kind == 'reset':
+            tick_rate, size = args
+            snapshot_buffer.reset(tick_rate)
+            predictor.reset(tick_rate, size)
+            continue
+        state, received = args
+        snapshot_buffer.push(state, received)
+        me = state['players'].get(str(my_player_id))
+        if kind == 'snapshot' and me is not None and state.get('input_seq') is not None:
+            predictor.reconcile(me, state['input_seq'], state['input_held'], state['speed'])
+
+
+def newest_snapshots(payloads):
+    """The frames of one receive batch worth decoding, with the events of the others.
+
+    Of several snapshots that arrived together only the newest is drawn,
+    so the older ones are skipped, unless a kept delta is based on one we
+    have not assembled yet. Control messages are always kept, and so are
+    keyframes while a resync is pending, since only a keyframe clears it
+    (the newest delta may be based on a state we never got). Returns
+    (payload, skipped_events) pairs in order: the events of snapshots
+    skipped before a kept snapshot are played with it.
+    """
+    snapshots = [i for i, payload in enumerate(payloads) if payload[:1] in SNAPSHOT_KINDS]
+    if len(snapshots) <= 1:
+        return [(payload, []) for payload in payloads]
+
+    by_tick = {snapshot_ticks(payloads[i])[0]: i for i in snapshots}
+    keep = set()
+    if resync_pending:
+        keep.update(i for i in snapshots if payloads[i][:1] == KIND_KEYFRAME)
+    index = snapshots[-1]
+    while index is not None and index not in keep:
+        keep.add(index)
+        base = snapshot_ticks(payloads[index])[1]
+        index = by_tick.get(base) if base is not None and base not in assembler.states else None
+
+    selected = []
+    skipped_events = []
+    for i, payload in enumerate(payloads):
+        if payload[:1] not in SNAPSHOT_KINDS:
+            selected.append((payload, []))
+        elif i in keep:
+            selected.append((payload, skipped_events))
+            skipped_events = []
+        else:
+            skipped_events.extend(decode_events(payload))
+    return selected
 
 
 def receive_data(sock):
-    """Background thread to receive state from server."""
-    global game_state, my_player_id, connected
+    """Background thread to receive state from server.
 
-    buffer = ""
+    Messages start out as newline-terminated JSON. Once the server confirms
+    the binary protocol, the rest of the stream is length-prefixed frames.
+    """
+    global connected
+
+    reader = FrameReader(max_frame=MAX_SNAPSHOT_FRAME)
+    binary = False
     while connected:
         try:
-            data = sock.recv(4096).decode()
-            if not data:
+            if reader.recv_into(sock) == 0:
                 connected = False
                 break
 
-            buffer += data
-            while '\n' in buffer:
-                line, buffer = buffer.split('\n', 1)
+            while not binary:
+                line = reader.next_message()
+                if line is None:
+                    break
                 if line:
                     try:
                         msg = json.loads(line)
-                        if msg.get('type') == 'init':
-                            my_player_id = msg['id']
-                            print(f"Connected as Player {my_player_id} ({msg.get('color', 'unknown')})")
-                        elif msg.get('type') == 'state':
-                            with lock:
-                                game_state = msg
+                        if msg.get('type') == 'protocol':
+                            binary = reader.framed = msg.get('protocol') == PROTOCOL_BINARY
+                            if binary and udp_token is not None:
+                                start_udp(sock)
+                        else:
+                            handle_message(sock, msg)
                     except json.JSONDecodeError:
                         pass
+
+            if binary:
+                for payload, skipped_events in newest_snapshots(reader.messages()):
+                    if payload[:1] == KIND_JSON:
+                        handle_message(sock, json.loads(payload[1:]))
+                        continue
+                    if payload[:1] == KIND_STATE:
+                        msg = decode_state(payload)
+                    elif payload[:1] in (KIND_KEYFRAME, KIND_DELTA):
+                        msg = decode_snapshot(payload)
+                    else:
+                        continue
+                    if skipped_events:
+                        msg['events'] = skipped_events + msg['events']
+                    handle_message(sock, msg)
         except Exception as e:
             print(f"Receive error: {e}")
             connected = False
             break
 
 
+def start_udp(sock):
+    """Open our UDP socket and register it with the server (see udp_transport.py)."""
+    global udp_socket
+
+    udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp.settimeout(1.0)
+    udp_socket = make_udp_socket(udp, loss=UDP_LOSS, latency=UDP_LATENCY)
+    threading.Thread(target=receive_udp, args=(sock, udp_socket), daemon=True).start()
+    threading.Thread(target=register_udp, args=(udp_socket,), daemon=True).start()
+
+
+def register_udp(udp):
+    """Send registration datagrams until the server confirms over TCP."""
+    for _ in range(UDP_REGISTER_ATTEMPTS):
+        if udp_ready or not connected:
+            return
+        try:
+            udp.sendto(UDP_TOKEN.pack(udp_token) + KIND_REGISTER, udp_server)
+        except OSError:
+            return
+        time.sleep(UDP_REGISTER_INTERVAL)
+    print("No UDP reply from server, staying on TCP")
+
+
+def receive_udp(sock, udp):
+    """Background thread to receive snapshot datagrams."""
+    while connected:
+        try:
+            data, address = udp.recvfrom(65536)
+        except socket.timeout:
+            continue
+        except OSError:
+            break
+        if address != udp_server or data[:1] not in (KIND_KEYFRAME, KIND_DELTA):
+            continue
+        try:
+            handle_message(sock, decode_snapshot(data))
+        except Exception as e:
+            print(f"UDP receive error: {e}")
+
+
 def connect_to_server():
     """Create a socket connection to the server and start the receive thread.
     Returns the socket on success, or None on failure."""
-    global connected, my_player_id, game_state
+    global connected, my_player_id, game_state, resync_pending, binary_input
+    global udp_socket, udp_server, udp_token, udp_ready
 
     my_player_id = None
+    binary_input = False
+    if udp_socket is not None:
+        udp_socket.close()
+    udp_socket = udp_server = udp_token = None
+    udp_ready = False
     game_state = {'players': {}, 'bullets': []}
+    assembler.reset()
+    resync_pending = False
+    state_updates.clear()
+    snapshot_buffer.reset()
+    predictor.reset()
 
     try:
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -70,20 +322,21 @@ def connect_to_server():
 
 
 # Empty input sent while paused so the player doesn't move
-EMPTY_INPUT = json.dumps({'w': False, 's': False, 'a': False, 'd': False, 'space': False}) + '\n'
+EMPTY_INPUT = {'w': False, 's': False, 'a': False, 'd': False, 'space': False}
 
 
 def main():
     """Client Runner: Connect, loop, send actions, receive state, render."""
     global connected
 
-    renderer = GameRenderer()
+    renderer = GameRenderer(dirty_rects=DIRTY_RECTS)
     sock = connect_to_server()
     if sock is None:
         renderer.quit()
         return
 
     running = True
+    last_input_sent = 0
     while running and connected:
         action = renderer.handle_events()
         if action == 'quit':
@@ -103,24 +356,33 @@ def main():
             continue
 
         # When paused, send empty input so the player stands still
-        if renderer.paused:
+        inputs = dict(EMPTY_INPUT) if renderer.paused else renderer.get_inputs()
+        now = time.perf_counter()
+        apply_state_updates()
+        # Move our ship right away; the server confirms by seq
+        keepalive = UDP_INPUT_KEEPALIVE if udp_ready else INPUT_KEEPALIVE
+        seq = predictor.apply_input(inputs, now, force=now - last_input_sent >= keepalive)
+        if seq is not None:
             try:
-                sock.send(EMPTY_INPUT.encode())
-            except Exception:
-                running = False
-                break
-        else:
-            inputs = renderer.get_inputs()
-            try:
-                sock.send((json.dumps(inputs) + '\n').encode())
+                # ack: newest snapshot we can delta against
+                send_input(sock, inputs, seq, assembler.latest_tick)
             except Exception as e:
                 print(f"Send error: {e}")
                 running = False
                 break
+            last_input_sent = now
 
-        with lock:
-            current_state = game_state.copy()
+        # Draw the interpolated world slightly in the past (see SnapshotBuffer),
+        # except for our own ship, which is drawn where we predict it
+        current_state = snapshot_buffer.sample(time.perf_counter()) or dict(game_state)
+        players = dict(current_state.get('players', {}))
+        me = players.get(str(my_player_id))
+        if me is not None:
+            players[str(my_player_id)] = predictor.predicted_state(me)
+        current_state['players'] = players
 
+        if world_size is not None:
+            renderer.set_world_size(*world_size)
         renderer.draw(current_state, my_player_id)
 
     # Cleanup
@@ -134,4 +396,19 @@ def main():
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Multiplayer dogfight client")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--udp', action='store_true',
+                        help="receive snapshots and send inputs over UDP if the server offers it")
+    parser.add_argument('--udp-loss', type=float, default=UDP_LOSS,
+                        help="simulated loss rate for outgoing UDP datagrams (0-1)")
+    parser.add_argument('--udp-latency', type=float, default=UDP_LATENCY,
+                        help="simulated latency for outgoing UDP datagrams (seconds)")
+    parser.add_argument('--dirty-rects', action='store_true',
+                        help="update only the changed parts of the screen when the view is still")
+    args = parser.parse_args()
+    HOST, PORT = args.host, args.port
+    DIRTY_RECTS = args.dirty_rects
+    USE_UDP, UDP_LOSS, UDP_LATENCY = args.udp, args.udp_loss, args.udp_latency
     main()
@@ -1,6 +1,10 @@
 import pygame
 import math
 import random
+from background import BackgroundLayer, render_starfield
+from particles import ParticleSystem
+from ship_sprites import ShipSpriteAtlas
+from text_cache import TextCache, render_text
 
 # Screen dimensions
 SCREEN_WIDTH = 800
@@ -28,40 +32,26 @@ BOSS_BULLET_COLOR = (255, 100, 255)  # Purple bullets for boss
 HP_GREEN = (50, 255, 50)
 HP_RED = (255, 50, 50)
 HP_BG = (100, 100, 100)
+WORLD_BORDER = (60, 60, 120)
 
+# Dirty-rect mode falls back to a full redraw when last frame's drawn
+# area exceeds this fraction of the screen
+DIRTY_AREA_LIMIT = 0.5
 
-class Particle:
-    """Particle class for explosion effects."""
-
-    def __init__(self, x, y, dx, dy, lifetime, color):
-        self.x = x
-        self.y = y
-        self.dx = dx  # Velocity X
-        self.dy = dy  # Velocity Y
-        self.lifetime = lifetime  # Frames remaining
-        self.max_lifetime = lifetime
-        self.color = color
-
-    def update(self):
-        """Update particle position and lifetime."""
-        self.x += self.dx
-        self.y += self.dy
-        self.dx *= 0.95  # Friction
-        self.dy *= 0.95
-        self.lifetime -= 1
-        return self.lifetime > 0
-
-    def draw(self, screen):
-        """Draw particle with fading effect."""
-        alpha = self.lifetime / self.max_lifetime
-        size = max(1, int(3 * alpha))
-        color = tuple(int(c * alpha) for c in self.color)
-        pygame.draw.circle(screen, color, (int(self.x), int(self.y)), size)
+# Ship sizes (nose to center, in pixels)
+PLAYER_SIZE = 12
+NPC_SIZE = 10
+BOSS_SIZE = 25
 
 
 class GameRenderer:
-    def __init__(self):
-        """Init Pygame with 800x600 screen."""
+    def __init__(self, dirty_rects=False):
+        """Init Pygame with 800x600 screen.
+
+        With dirty_rects, frames where the view did not move only restore
+        and present the areas drawn in the previous and current frame
+        instead of redrawing and flipping the whole screen.
+        """
         pygame.init()
         self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
         pygame.display.set_caption("Multiplayer Dogfight - Top Gun Style")
@@ -70,48 +60,71 @@ class GameRenderer:
         self.title_font = pygame.font.Font(None, 36)
         self.score_font = pygame.font.Font(None, 32)
 
-        # Generate static star positions for background
-        random.seed(42)
-        self.stars = [
-            (random.randint(0, SCREEN_WIDTH), random.randint(0, SCREEN_HEIGHT), random.randint(100, 255))
-            for _ in range(100)
+        # Rendered text: labels and HUD values through an LRU cache, text
+        # that never changes rendered here once
+        self.text_cache = TextCache()
+        self.static_text = {
+            'title': render_text(self.title_font, "DOGFIGHT", WHITE),
+            'connecting': render_text(self.font, "Connecting...", WHITE),
+            'boss_label': render_text(self.font, "BOSS", (255, 100, 255)),
+            'boss_active': render_text(self.font, "BOSS ACTIVE!", COLORS['boss']),
+            'controls': render_text(self.font, "W/S/Arrows: Move | SPACE: Shoot | ESC: Pause", (150, 150, 150)),
+            'paused': render_text(self.title_font, "PAUSED", WHITE),
+            'pause_options': [
+                render_text(self.score_font, text, color) for text, color in [
+                    ("C :  Continue", (100, 255, 100)),
+                    ("R :  Reset", (255, 255, 100)),
+                    ("Q :  Quit", (255, 100, 100)),
+                ]
+            ],
+        }
+
+        # Background layers, drawn back to front. The starfield never
+        # changes, so it is rendered once; more layers (e.g. parallax stars
+        # with BackgroundLayer(surface, parallax=0.5)) can be appended.
+        self.background_layers = [
+            BackgroundLayer(render_starfield(SCREEN_WIDTH, SCREEN_HEIGHT, 100, seed=42, fill=DARK_BLUE)),
         ]
 
+        # Pre-rotated ship sprites; NPCs are the bulk of the ships on screen
+        self.ships = ShipSpriteAtlas()
+        self.ships.prerender(COLORS['npc'], NPC_SIZE)
+
         # Particle system for explosions
-        self.particles = []
+        self.particles = ParticleSystem()
 
         # Screen shake
         self.shake_intensity = 0
         self.shake_duration = 0
 
+        # Camera: top-left corner of the viewport in world coordinates.
+        # The world defaults to the screen size until the server says otherwise.
+        self.world_width = SCREEN_WIDTH
+        self.world_height = SCREEN_HEIGHT
+        self.camera_x = 0
+        self.camera_y = 0
+
+        # Dirty-rect mode: screen rects drawn this frame and the last one
+        # (None forces a full redraw), and where the view was last frame
+        self.dirty_rects = dirty_rects
+        self.drawn = []
+        self.previous_drawn = None
+        self.last_view = None
+
         # Pause menu state
         self.paused = False
         self.pause_snapshot = None  # Frozen HUD values while paused
         self.overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
 
     def create_explosion(self, x, y, color, count=15):
-        """Spawn particles for explosion effect."""
-        rgb_color = COLORS.get(color, WHITE)
-        for _ in range(count):
-            angle = random.uniform(0, 2 * math.pi)
-            speed = random.uniform(2, 8)
-            dx = math.cos(angle) * speed
-            dy = math.sin(angle) * speed
-            lifetime = random.randint(20, 40)
-            # Vary color slightly
-            varied_color = tuple(min(255, c + random.randint(-30, 30)) for c in rgb_color)
-            self.particles.append(Particle(x, y, dx, dy, lifetime, varied_color))
+        """Spawn particles for explosion effect (in slightly varied shades of color)."""
+        self.particles.burst(x, y, COLORS.get(color, WHITE), count, speed=(2, 8), lifetime=(20, 40))
 
     def create_big_explosion(self, x, y, color):
         """Create a larger explosion for boss death."""
         self.create_explosion(x, y, color, count=40)
         # Add extra ring of particles
-        for angle in range(0, 360, 15):
-            rad = math.radians(angle)
-            speed = random.uniform(5, 10)
-            dx = math.cos(rad) * speed
-            dy = math.sin(rad) * speed
-            self.particles.append(Particle(x, y, dx, dy, 50, COLORS.get(color, WHITE)))
+        self.particles.ring(x, y, COLORS.get(color, WHITE), step_degrees=15, speed=(5, 10), lifetime=50)
 
     def trigger_screen_shake(self, intensity=5, duration=10):
         """Trigger screen shake effect."""
@@ -133,6 +146,23 @@ class GameRenderer:
             return offset_x, offset_y
         return 0, 0
 
+    def set_world_size(self, width, height):
+        """Set the world size sent by the server (may be larger than the screen)."""
+        self.world_width = width
+        self.world_height = height
+
+    def update_camera(self, target_x, target_y):
+        """Center the camera on the target, clamped to the world edges."""
+        max_x = max(0, self.world_width - SCREEN_WIDTH)
+        max_y = max(0, self.world_height - SCREEN_HEIGHT)
+        self.camera_x = int(max(0, min(max_x, target_x - SCREEN_WIDTH // 2)))
+        self.camera_y = int(max(0, min(max_y, target_y - SCREEN_HEIGHT // 2)))
+
+    def draw_world_border(self, offset_x, offset_y):
+        """Outline the world edges so players can see where the map ends."""
+        pygame.draw.rect(self.screen, WORLD_BORDER,
+                         (offset_x, offset_y, self.world_width, self.world_height), 2)
+
     def process_events(self, events, my_x, my_y):
         """Process server events and trigger visual effects."""
         for event in events:
@@ -166,26 +196,49 @@ class GameRenderer:
 
     def update_particles(self):
         """Update and remove dead particles."""
-        self.particles = [p for p in self.particles if p.update()]
+        self.particles.update()
 
     def draw_particles(self, offset_x, offset_y):
         """Draw all particles with screen offset."""
-        for particle in self.particles:
-            # Apply screen shake offset
-            draw_x = particle.x + offset_x
-            draw_y = particle.y + offset_y
-            alpha = particle.lifetime / particle.max_lifetime
-            size = max(1, int(3 * alpha))
-            color = tuple(max(0, min(255, int(c * alpha))) for c in particle.color)
-            pygame.draw.circle(self.screen, color, (int(draw_x), int(draw_y)), size)
+        rect = self.particles.draw(self.screen, offset_x, offset_y)
+        if rect is not None:
+            self.drawn.append(rect)
 
     def draw_background(self):
-        """Clear screen and draw starfield background."""
-        self.screen.fill(DARK_BLUE)
-
-        # Draw stars
-        for star_x, star_y, brightness in self.stars:
-            pygame.draw.circle(self.screen, (brightness, brightness, brightness), (star_x, star_y), 1)
+        """Cover the screen with the background layers (starfield)."""
+        for layer in self.background_layers:
+            layer.draw(self.screen, self.camera_x, self.camera_y)
+
+    def restore_background(self, rects):
+        """Draw the background layers over just these screen rects."""
+        screen_rect = self.screen.get_rect()
+        for rect in rects:
+            rect = rect.clip(screen_rect)
+            if rect:
+                for layer in self.background_layers:
+                    layer.draw(self.screen, self.camera_x, self.camera_y, area=rect)
+
+    def blit(self, surface, position):
+        """Blit onto the screen and remember the area for dirty-rect mode."""
+        self.drawn.append(self.screen.blit(surface, position))
+
+    def needs_full_redraw(self, view):
+        """Whether this frame must redraw the whole screen rather than the dirty rects."""
+        # The pause overlay darkens the whole screen, so it must all be presented
+        if not self.dirty_rects or self.paused or self.previous_drawn is None or view != self.last_view:
+            return True
+        area = sum(rect.width * rect.height for rect in self.previous_drawn)
+        return area > DIRTY_AREA_LIMIT * SCREEN_WIDTH * SCREEN_HEIGHT
+
+    def present(self, full_redraw):
+        """Show the frame: flip the whole screen, or push only what changed."""
+        if full_redraw:
+            pygame.display.flip()
+        else:
+            # Where things were last frame (now background) and where they are now
+            pygame.display.update(self.previous_drawn + self.drawn)
+        # The pause overlay covers everything, so the next frame redraws it all
+        self.previous_drawn = None if self.paused else self.drawn
 
     def draw_health_bar(self, x, y, hp, max_hp, width=30, height=4, offset_x=0, offset_y=0):
         """Draw health bar above entity (Green line for HP, Red line for background)."""
@@ -193,7 +246,7 @@ class GameRenderer:
         bar_y = y - 18 + offset_y  # Closer to smaller entity
 
         # Background (red)
-        pygame.draw.rect(self.screen, HP_RED, (bar_x, bar_y, width, height))
+        self.drawn.append(pygame.draw.rect(self.screen, HP_RED, (bar_x, bar_y, width, height)))
 
         # HP (green)
         hp_width = int((hp / max_hp) * width) if max_hp > 0 else 0
@@ -203,41 +256,28 @@ class GameRenderer:
         # Border
         pygame.draw.rect(self.screen, WHITE, (bar_x, bar_y, width, height), 1)
 
-    def draw_player(self, x, y, angle, color, size=12, offset_x=0, offset_y=0):
-        """Draw Players using pygame.draw.polygon with screen shake offset (smaller size)."""
-        x += offset_x
-        y += offset_y
-        angle_rad = math.radians(angle)
-
-        # Calculate 3 points of triangle rotated by angle
-        nose_x = x + math.cos(angle_rad) * size
-        nose_y = y + math.sin(angle_rad) * size
-
-        left_angle = angle_rad + math.radians(140)
-        left_x = x + math.cos(left_angle) * (size * 0.8)
-        left_y = y + math.sin(left_angle) * (size * 0.8)
-
-        right_angle = angle_rad - math.radians(140)
-        right_x = x + math.cos(right_angle) * (size * 0.8)
-        right_y = y + math.sin(right_angle) * (size * 0.8)
-
-        rgb_color = COLORS.get(color, WHITE)
-        points = [(nose_x, nose_y), (left_x, left_y), (right_x, right_y)]
-        pygame.draw.polygon(self.screen, rgb_color, points)
-        pygame.draw.polygon(self.screen, WHITE, points, 2)
+    def draw_player(self, x, y, angle, color, size=PLAYER_SIZE, offset_x=0, offset_y=0):
+        """Draw a ship as its pre-rotated sprite, with screen shake offset."""
+        sprite, half = self.ships.get(COLORS.get(color, WHITE), size, angle)
+        self.blit(sprite, (int(x + offset_x) - half, int(y + offset_y) - half))
 
     def draw_npc(self, x, y, angle, hp, max_hp, offset_x=0, offset_y=0):
         """Draw NPC (Blue Color) with health bar (smaller)."""
-        self.draw_player(x, y, angle, 'npc', size=10, offset_x=offset_x, offset_y=offset_y)
+        self.draw_player(x, y, angle, 'npc', size=NPC_SIZE, offset_x=offset_x, offset_y=offset_y)
         self.draw_health_bar(x, y, hp, max_hp, width=20, height=3, offset_x=offset_x, offset_y=offset_y)
 
+    def draw_npcs(self, npcs, offset_x=0, offset_y=0):
+        """Draw all NPC ships in one batched blit, then their health bars."""
+        self.drawn += self.screen.blits(self.ships.blit_args(COLORS['npc'], NPC_SIZE, npcs, offset_x, offset_y))
+        for x, y, angle, color, hp, max_hp in npcs:
+            self.draw_health_bar(x, y, hp, max_hp, width=20, height=3, offset_x=offset_x, offset_y=offset_y)
+
     def draw_boss(self, x, y, angle, hp, max_hp, offset_x=0, offset_y=0):
         """Draw Boss (Purple Color) with health bar (smaller)."""
-        self.draw_player(x, y, angle, 'boss', size=25, offset_x=offset_x, offset_y=offset_y)
+        self.draw_player(x, y, angle, 'boss', size=BOSS_SIZE, offset_x=offset_x, offset_y=offset_y)
         self.draw_health_bar(x, y - 12, hp, max_hp, width=50, height=6, offset_x=offset_x, offset_y=offset_y)
 
-        label = self.font.render("BOSS", True, (255, 100, 255))
-        self.screen.blit(label, (x - 18 + offset_x, y - 38 + offset_y))
+        self.blit(self.static_text['boss_label'], (x - 18 + offset_x, y - 38 + offset_y))
 
     def draw_bullet(self, x, y, owner_id='player', offset_x=0, offset_y=0):
         """Draw Bullets with different colors for boss bullets."""
@@ -246,10 +286,10 @@ class GameRenderer:
 
         if owner_id == 'boss':
             # Boss bullets are purple and slightly larger
-            pygame.draw.circle(self.screen, BOSS_BULLET_COLOR, (draw_x, draw_y), 5)
+            self.drawn.append(pygame.draw.circle(self.screen, BOSS_BULLET_COLOR, (draw_x, draw_y), 5))
             pygame.draw.circle(self.screen, WHITE, (draw_x, draw_y), 3)
         else:
-            pygame.draw.circle(self.screen, BULLET_COLOR, (draw_x, draw_y), 4)
+            self.drawn.append(pygame.draw.circle(self.screen, BULLET_COLOR, (draw_x, draw_y), 4))
             pygame.draw.circle(self.screen, WHITE, (draw_x, draw_y), 2)
 
     def draw(self, game_state, my_id):
@@ -258,27 +298,39 @@ class GameRenderer:
         self.update_particles()
 
         # Get screen shake offset
-        offset_x, offset_y = self.get_shake_offset()
+        shake_x, shake_y = self.get_shake_offset()
 
         # Get player position for distance calculations
-        my_x, my_y = SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2
+        my_x, my_y = self.world_width // 2, self.world_height // 2
         players = game_state.get('players', {})
         if my_id is not None and str(my_id) in players:
             player_data = players[str(my_id)]
             my_x, my_y = player_data[0], player_data[1]
 
+        # Follow our ship; everything in world space is drawn with this offset
+        self.update_camera(my_x, my_y)
+        offset_x = shake_x - self.camera_x
+        offset_y = shake_y - self.camera_y
+
         # Process server events
         events = game_state.get('events', [])
         self.process_events(events, my_x, my_y)
 
-        # Clear screen and draw background
-        self.draw_background()
+        # Clear the screen, or in dirty-rect mode only last frame's drawings
+        # when the view (camera and shake) did not move
+        view = (offset_x, offset_y)
+        full_redraw = self.needs_full_redraw(view)
+        self.last_view = view
+        if full_redraw:
+            self.draw_background()
+        else:
+            self.restore_background(self.previous_drawn)
+        self.drawn = []
+        self.draw_world_border(offset_x, offset_y)
 
         # Draw all NPCs (Blue Color)
         npcs = game_state.get('npcs', [])
-        for npc_data in npcs:
-            x, y, angle, color, hp, max_hp = npc_data
-            self.draw_npc(x, y, angle, hp, max_hp, offset_x, offset_y)
+        self.draw_npcs(npcs, offset_x, offset_y)
 
         # Draw Boss if present
         boss_data = game_state.get('boss')
@@ -302,14 +354,14 @@ class GameRenderer:
                 my_score = score
                 my_hp = hp
                 my_max_hp = max_hp
-            label_surface = self.font.render(label, True, WHITE)
-            self.screen.blit(label_surface, (x - 15 + offset_x, y - 30 + offset_y))  # Adjusted for smaller size
+            label_surface = self.text_cache.render(self.font, label, WHITE)
+            self.blit(label_surface, (x - 15 + offset_x, y - 30 + offset_y))  # Adjusted for smaller size
 
         # Draw all bullets (with owner info for coloring)
         bullets = game_state.get('bullets', [])
         for bullet_data in bullets:
             if len(bullet_data) >= 4:
-                x, y, angle, owner_id = bullet_data
+                x, y, angle, owner_id = bullet_data[:4]
             else:
                 x, y, angle = bullet_data
                 owner_id = 'player'
@@ -338,58 +390,41 @@ class GameRenderer:
             self.draw_hud(my_id, len(players), my_score, my_hp, my_max_hp, len(npcs), boss_data is not None)
 
         # Update display
-        pygame.display.flip()
+        self.present(full_redraw)
         self.clock.tick(60)
 
     def draw_hud(self, my_id, player_count, score, hp, max_hp, npc_count, boss_alive):
         """Draw heads-up display with game info and score."""
+        text = self.text_cache.render
+
         # Title
-        title = self.title_font.render("DOGFIGHT", True, WHITE)
-        self.screen.blit(title, (SCREEN_WIDTH // 2 - 60, 10))
+        self.blit(self.static_text['title'], (SCREEN_WIDTH // 2 - 60, 10))
 
         # Player info
         if my_id is not None:
-            status = self.font.render(f"Player: {my_id}", True, WHITE)
-            self.screen.blit(status, (10, 10))
-
-            score_text = self.score_font.render(f"SCORE: {score}", True, (255, 255, 100))
-            self.screen.blit(score_text, (10, 35))
-
-            hp_text = self.font.render(f"HP: {hp}/{max_hp}", True, HP_GREEN if hp > 30 else HP_RED)
-            self.screen.blit(hp_text, (10, 65))
-
-            enemy_text = self.font.render(f"NPCs: {npc_count}", True, COLORS['npc'])
-            self.screen.blit(enemy_text, (10, 90))
+            self.blit(text(self.font, f"Player: {my_id}", WHITE), (10, 10))
+            self.blit(text(self.score_font, f"SCORE: {score}", (255, 255, 100)), (10, 35))
+            self.blit(text(self.font, f"HP: {hp}/{max_hp}", HP_GREEN if hp > 30 else HP_RED), (10, 65))
+            self.blit(text(self.font, f"NPCs: {npc_count}", COLORS['npc']), (10, 90))
 
             if boss_alive:
-                boss_text = self.font.render("BOSS ACTIVE!", True, COLORS['boss'])
-                self.screen.blit(boss_text, (SCREEN_WIDTH - 120, 10))
+                self.blit(self.static_text['boss_active'], (SCREEN_WIDTH - 120, 10))
         else:
-            status = self.font.render("Connecting...", True, WHITE)
-            self.screen.blit(status, (10, 10))
+            self.blit(self.static_text['connecting'], (10, 10))
 
-        count = self.font.render(f"Players: {player_count}", True, WHITE)
-        self.screen.blit(count, (SCREEN_WIDTH - 100, 35))
+        self.blit(text(self.font, f"Players: {player_count}", WHITE), (SCREEN_WIDTH - 100, 35))
 
-        controls = "W/S/Arrows: Move | SPACE: Shoot | ESC: Pause"
-        help_text = self.font.render(controls, True, (150, 150, 150))
-        self.screen.blit(help_text, (SCREEN_WIDTH // 2 - 200, SCREEN_HEIGHT - 25))
+        self.blit(self.static_text['controls'], (SCREEN_WIDTH // 2 - 200, SCREEN_HEIGHT - 25))
 
     def draw_pause_overlay(self):
         """Draw a semi-transparent overlay with pause menu options."""
         self.overlay.fill((0, 0, 0, 150))
         self.screen.blit(self.overlay, (0, 0))
 
-        title = self.title_font.render("PAUSED", True, WHITE)
+        title = self.static_text['paused']
         self.screen.blit(title, (SCREEN_WIDTH // 2 - title.get_width() // 2, 200))
 
-        options = [
-            ("C :  Continue", (100, 255, 100)),
-            ("R :  Reset", (255, 255, 100)),
-            ("Q :  Quit", (255, 100, 100)),
-        ]
-        for i, (text, color) in enumerate(options):
-            label = self.score_font.render(text, True, color)
+        for i, label in enumerate(self.static_text['pause_options']):
             self.screen.blit(label, (SCREEN_WIDTH // 2 - label.get_width() // 2, 270 + i * 45))
 
     def handle_events(self):
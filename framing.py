@@ -0,0 +1,126 @@
+"""Incremental message framing for the game's TCP streams.
+
+FrameReader collects received bytes in one reusable bytearray and splits
+them into messages without copying the unread data again for each one.
+It reads either legacy newline-terminated lines (the JSON protocol) or
+length-prefixed frames:
+
+    [u32 big-endian payload length][payload]
+
+and can switch from lines to frames mid-stream, as both ends do after
+the binary handshake (see protocol.py).
+"""
+import struct
+
+FRAME_HEADER = struct.Struct('!I')
+# Free space offered to each recv_into; the buffer grows past this for bigger frames
+RECV_SIZE = 65536
+# Longest frame or line accepted by default; readers facing untrusted peers pass less
+MAX_FRAME = 1 << 20
+# Most the buffer grows ahead of the bytes that actually arrived
+READ_AHEAD = 1 << 20
+
+
+class FrameTooLarge(ValueError):
+    """A frame header or line announced more than the reader's max_frame bytes."""
+
+
+class FrameReader:
+    """Splits a byte stream into lines or length-prefixed frames.
+
+    Unread bytes are buffer[start:end]. Taking a message only advances
+    start; the unread tail is moved to the front when the free space after
+    end runs low, so a byte is copied into the buffer once and moved at
+    most once per buffer's worth of data. When a frame header announces a
+    payload bigger than the free space, the buffer grows to fit the whole
+    frame, so a large snapshot takes as few recv_into calls as the kernel
+    allows.
+
+    A frame or line longer than max_frame raises FrameTooLarge; the peer
+    is broken or hostile and the connection should be dropped. Growth for
+    an announced frame is also capped at READ_AHEAD bytes beyond what has
+    arrived, so memory follows the data actually received.
+
+    Set framed to switch modes; it applies from the next message on.
+    """
+
+    def __init__(self, framed=False, recv_size=RECV_SIZE, max_frame=MAX_FRAME):
+        self.framed = framed
+        self.recv_size = recv_size
+        self.max_frame = max_frame
+        self.buffer = bytearray(recv_size)
+        self.start = 0
+        self.end = 0
+        self.line_scan = 0  # Where the search for the next newline resumes
+
+    def __len__(self):
+        """Bytes received but not returned as messages yet."""
+        return self.end - self.start
+
+    def recv_into(self, sock):
+        """Read once from sock straight into the buffer. Returns the byte count (0 at EOF)."""
+        self._reserve(self.recv_size)
+        n = sock.recv_into(memoryview(self.buffer)[self.end:])
+        self.end += n
+        return n
+
+    def feed(self, data):
+        """Append bytes read some other way (e.g. from an asyncio StreamReader)."""
+        self._reserve(len(data))
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def next_message(self):
+        """The next complete line (without the newline) or frame payload as bytes, or None."""
+        start = self.start
+        if self.framed:
+            available = self.end - start
+            if available < FRAME_HEADER.size:
+                return None
+            (length,) = FRAME_HEADER.unpack_from(self.buffer, start)
+            if length > self.max_frame:
+                raise FrameTooLarge(f"frame of {length} bytes (limit {self.max_frame})")
+            size = FRAME_HEADER.size + length
+            if available < size:
+                self._reserve(min(size - available, READ_AHEAD))
+                return None
+            message = bytes(memoryview(self.buffer)[start + FRAME_HEADER.size:start + size])
+            self.start = start + size
+        else:
+            newline = self.buffer.find(b'\n', max(self.line_scan, start), self.end)
+            if newline < 0:
+                if self.end - start > self.max_frame:
+                    raise FrameTooLarge(f"line longer than {self.max_frame} bytes")
+                self.line_scan = self.end
+                return None
+            if newline - start > self.max_frame:
+                raise FrameTooLarge(f"line longer than {self.max_frame} bytes")
+            message = bytes(memoryview(self.buffer)[start:newline])
+            self.start = newline + 1
+
+        if self.start == self.end:
+            self.start = self.end = self.line_scan = 0
+        return message
+
+    def messages(self):
+        """All complete messages in the current mode, in order."""
+        messages = []
+        message = self.next_message()
+        while message is not None:
+            messages.append(message)
+            message = self.next_message()
+        return messages
+
+    def _reserve(self, size):
+        """Make at least size bytes free after end."""
+        if len(self.buffer) - self.end >= size:
+            return
+        if self.start:
+            unread = self.end - self.start
+            self.buffer[:unread] = self.buffer[self.start:self.end]
+            self.line_scan = max(0, self.line_scan - self.start)
+            self.start = 0
+            self.end = unread
+        missing = size - (len(self.buffer) - self.end)
+        if missing > 0:
+            self.buffer.extend(bytes(missing))
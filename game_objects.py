@@ -1,5 +1,6 @@
 import math
 import random
+from patterns import get_trajectory, try_compile_expression
 
 
 class Player:
@@ -38,6 +39,11 @@ class Player:
         self.x += math.cos(angle_rad) * self.speed
         self.y += math.sin(angle_rad) * self.speed
 
+    def wrap(self, width, height):
+        """Wrap around the world edges (the server and client predictor both use this)."""
+        self.x = self.x % width
+        self.y = self.y % height
+
     def take_damage(self, damage):
         self.hp -= damage
         return self.hp <= 0
@@ -87,6 +93,8 @@ class MathBullet:
         self.owner_id = owner_id
         self.damage = damage
         self.expression = expression
+        self.pattern = try_compile_expression(expression)  # Shared compiled f(x), None if invalid
+        self.trajectory = get_trajectory(expression)  # Precomputed f(t) table, None if invalid
         self.t = 0  # Time variable for expression evaluation
 
     def move(self):
@@ -101,8 +109,13 @@ class MathBullet:
         self.y += math.sin(angle_rad) * self.speed
 
         # Calculate waveform offset and apply perpendicular to travel direction
+        if self.pattern is None:
+            return  # Invalid expression: straight line (no offset)
         try:
-            local_y = eval(self.expression, {"__builtins__": {}, "math": math, "x": self.t})
+            if self.t < len(self.trajectory):
+                local_y = float(self.trajectory[self.t])
+            else:
+                local_y = self.pattern(self.t)
             self.x += local_y * math.cos(perp_rad)
             self.y += local_y * math.sin(perp_rad)
         except Exception:
@@ -119,12 +132,12 @@ class NPC:
     """NPC class that moves automatically towards the nearest player."""
     HITBOX_RADIUS = 10  # Smaller hitbox
 
-    def __init__(self, x, y, npc_id):
+    def __init__(self, x, y, npc_id, rng=random):
         self.x = x
         self.y = y
         self.npc_id = npc_id
-        self.angle = random.uniform(0, 360)  # Random starting angle
-        self.speed = random.uniform(2.0, 4.0)  # Randomize speed so NPCs don't stack
+        self.angle = rng.uniform(0, 360)  # Random starting angle
+        self.speed = rng.uniform(2.0, 4.0)  # Randomize speed so NPCs don't stack
         self.turn_speed = 3  # Degrees per frame for smooth turning
         self.hp = 30
         self.max_hp = 30
@@ -178,8 +191,8 @@ class Boss(NPC):
     HITBOX_RADIUS = 25  # Smaller but still larger than players
     ATTACK_INTERVAL = 150  # Frames (~2.5 seconds at 60 FPS) - low fire rate
 
-    def __init__(self, x, y, boss_id, level=1):
-        super().__init__(x, y, boss_id)
+    def __init__(self, x, y, boss_id, level=1, rng=random):
+        super().__init__(x, y, boss_id, rng=rng)
         self.level = level
         base_hp = 500 * (2 ** (level - 1))  # 500 -> 1000 -> 2000 ...
         self.hp = base_hp
@@ -0,0 +1,773 @@
+import json
+import math
+import queue
+import random
+import struct
+import threading
+import time
+from collections import deque
+from game_objects import Player, NPC, Boss, check_collision, get_distance
+from bullet_pool import BulletPool, states_from_arrays
+from spatial_hash import PointGrid, SpatialHash
+from protocol import (FEATURE_BINARY_INPUT, FEATURE_DELTA, FEATURE_UDP, INPUT_KEYS, INPUT_RECORD,
+                      KIND_INPUT, KIND_REGISTER, PROTOCOL_BINARY, PROTOCOL_JSON, SUPPORTED_FEATURES,
+                      SUPPORTED_PROTOCOLS, decode_input, encode_json_message, encode_snapshot,
+                      encode_state, is_u32, pack_frame, quantize_entity)
+from snapshots import ClientView
+from tick_scheduler import TickScheduler
+
+# World size. It can be larger than the 800x600 client viewport; clients
+# follow their ship with a camera. The binary protocol carries positions up
+# to 8191 px.
+WORLD_WIDTH = 1600
+WORLD_HEIGHT = 1200
+
+# Area of interest: delta clients only receive entities within this
+# distance of their own ship (the viewport half-diagonal plus a margin).
+VIEW_RADIUS = 600
+AOI_CELL_SIZE = 256
+
+# Input packets queued per client. Clients only send one when their keys
+# change (plus a keepalive); the server applies at most one per tick and
+# keeps the last one in effect in between. A client that gets further
+# ahead loses its oldest packets (its prediction is corrected).
+MAX_QUEUED_INPUTS = 8
+
+# Spawning configuration
+MAX_NPCS = 5
+NPC_SPAWN_INTERVAL = 5  # seconds (counted in ticks)
+
+# Player colors
+COLORS = ['red', 'blue', 'green', 'yellow', 'purple', 'orange', 'cyan', 'magenta']
+
+
+class GameRoom:
+    """One match: its world, its clients and the loop that simulates it.
+
+    A process can run several rooms, each in its own game loop thread with
+    its own lock. Nothing is shared between rooms except the pattern
+    registry (read-only here) and the process's UDP endpoint, if any.
+
+    patterns provides the current bullet expression (a PatternRegistry).
+    udp is the process's UdpEndpoint (see server_main.py), or None when
+    the UDP channel is disabled. rng is used for every random decision of
+    the simulation and clock/sleep pace run(), so a room given a seeded
+    random.Random and a fake clock is deterministic (see simulation.py).
+    metrics, a TickMetrics, publishes per-phase timings of run().
+    """
+
+    def __init__(self, room_id=None, tick_rate=60, snapshot_rate=30, max_catch_up=5,
+                 patterns=None, udp=None, rng=None, clock=time.perf_counter, sleep=time.sleep,
+                 verbose=True, metrics=None):
+        self.room_id = room_id
+        self.tick_rate = tick_rate
+        self.snapshot_rate = snapshot_rate
+        self.max_catch_up = max_catch_up
+        self.patterns = patterns
+        self.udp = udp
+        self.rng = rng if rng is not None else random.Random()
+        self.clock = clock
+        self.sleep = sleep
+        self.verbose = verbose  # Print log lines (game events, joins)
+
+        # Called as phase_timer(name, seconds) after each phase of
+        # simulate_tick and broadcast when set (see PHASES, BROADCAST_PHASES)
+        self.metrics = metrics
+        self.phase_timer = metrics.add if metrics is not None else None
+        self.bytes_sent = 0  # Snapshot bytes handed to clients so far
+
+        # Game state
+        self.game_state = {
+            'players': {},  # {player_id: Player object}
+            'bullets': BulletPool(),  # All live bullets (struct-of-arrays)
+            'npcs': [],     # [NPC objects]
+            'boss': None    # Boss object or None
+        }
+        self.client_senders = {}  # {player_id: SendQueue} (SocketWriter or AsyncWriter)
+        self.client_inputs = {}   # {player_id: {w, a, s, d, space}} applied in the last tick
+        self.client_input_queues = {}  # {player_id: deque of input messages not applied yet}
+        self.client_input_seq = {}     # {player_id: seq of the last input applied}
+        self.client_input_held = {}    # {player_id: ticks that input has been applied for}
+        self.client_protocols = {}  # {player_id: snapshot encoding negotiated in the handshake}
+        self.client_views = {}      # {player_id: ClientView} for clients that asked for delta snapshots
+        self.frame_events = []      # Events to send with the next snapshot
+        self.client_messages = queue.SimpleQueue()  # (player_id, control msg) from the asyncio server
+        self.npc_grid = SpatialHash()  # Broad phase for body collisions, rebuilt each tick
+        self.udp_tokens = {}     # {token: player_id}, sent to each client in its init message
+        self.udp_addresses = {}  # {player_id: address} once the client has registered over UDP
+        self.udp_input_seq = {}  # {player_id: newest input seq received over UDP}
+        self.lock = threading.Lock()
+        self.next_player_id = 0
+        self.next_npc_id = 0
+        self.running = True
+        self.thread = None  # Game loop thread, once started
+        self.last_npc_spawn = 0  # Tick of the last NPC spawn
+        self.tick = 0  # Frames simulated since the room was created
+
+        # Boss / checkpoint progression
+        self.boss_level = 1        # Next boss is level 1 (threshold = 10*level)
+        self.checkpoint_score = 0  # Room-wide checkpoint restored on player death
+
+    def log(self, message):
+        """Print a server log line, tagged with the room when there are several."""
+        if not self.verbose:
+            return
+        if self.room_id is None:
+            print(message)
+        else:
+            print(f"[room {self.room_id}] {message}")
+
+    @property
+    def player_count(self):
+        return len(self.client_senders)
+
+    # === WORLD ===
+
+    def add_event(self, event_type, x, y, color='white'):
+        """Add an event to be sent to clients."""
+        self.frame_events.append({
+            'type': event_type,
+            'x': x,
+            'y': y,
+            'color': color
+        })
+
+    def get_total_score(self):
+        """Calculate total score of all players."""
+        return sum(p.score for p in self.game_state['players'].values())
+
+    def find_nearest_player(self, x, y):
+        """Find the nearest player to the given position."""
+        nearest = None
+        min_dist = float('inf')
+
+        for player in self.game_state['players'].values():
+            dist = get_distance(x, y, player.x, player.y)
+            if dist < min_dist:
+                min_dist = dist
+                nearest = player
+
+        return nearest
+
+    def spawn_npc(self):
+        """Spawn a new NPC at a random edge of the world."""
+        if len(self.game_state['npcs']) >= MAX_NPCS:
+            return
+
+        # Spawn at random edge
+        edge = self.rng.choice(['top', 'bottom', 'left', 'right'])
+        if edge == 'top':
+            x, y = self.rng.randint(50, WORLD_WIDTH - 50), 10
+        elif edge == 'bottom':
+            x, y = self.rng.randint(50, WORLD_WIDTH - 50), WORLD_HEIGHT - 10
+        elif edge == 'left':
+            x, y = 10, self.rng.randint(50, WORLD_HEIGHT - 50)
+        else:
+            x, y = WORLD_WIDTH - 10, self.rng.randint(50, WORLD_HEIGHT - 50)
+
+        npc = NPC(x, y, self.next_npc_id, rng=self.rng)
+        self.game_state['npcs'].append(npc)
+        self.next_npc_id += 1
+        self.log(f"NPC {npc.npc_id} spawned at ({x:.0f}, {y:.0f})")
+
+    def spawn_boss(self):
+        """Spawn the boss at the center top of the world.
+        Uses boss_level to scale HP (500 * 2^(level-1)).
+        """
+        if self.game_state['boss'] is not None:
+            return
+
+        boss = Boss(WORLD_WIDTH // 2, 50, 999, level=self.boss_level, rng=self.rng)
+        self.game_state['boss'] = boss
+        self.log("=" * 40)
+        self.log(f"  BOSS LEVEL {self.boss_level} HAS SPAWNED!  (HP: {boss.max_hp})")
+        self.log("=" * 40)
+
+    def handle_body_collisions(self):
+        """Handle Player vs Enemy body collisions (crash damage).
+
+        NPCs are bucketed into npc_grid so each player only tests the NPCs in
+        neighbouring cells.
+        """
+        game_state = self.game_state
+        self.npc_grid.build(game_state['npcs'])
+        crashed_npcs = set()
+
+        for player_id, player in game_state['players'].items():
+            # === Player vs NPC collision ===
+            reach = player.HITBOX_RADIUS + NPC.HITBOX_RADIUS
+            for npc in self.npc_grid.query(player.x, player.y, reach):
+                if npc in crashed_npcs:
+                    continue
+                if check_collision(player, npc):
+                    # Player takes 30 crash damage
+                    is_player_dead = player.take_damage(30)
+                    self.add_event('hit', player.x, player.y, player.color)
+                    self.log(f"Player {player_id} crashed into NPC! -30 HP")
+
+                    # Kill the NPC immediately
+                    self.add_event('explode', npc.x, npc.y, 'npc')
+                    crashed_npcs.add(npc)
+                    self.log(f"NPC destroyed by collision!")
+
+                    # Check if player died from crash
+                    if is_player_dead:
+                        self.add_event('explode', player.x, player.y, player.color)
+                        spawn_x = self.rng.randint(100, WORLD_WIDTH - 100)
+                        spawn_y = self.rng.randint(100, WORLD_HEIGHT - 100)
+                        player.respawn(spawn_x, spawn_y)
+                        self.log(f"Player {player_id} died from crash and respawned!")
+
+            # === Player vs Boss collision ===
+            if game_state['boss'] is not None:
+                boss = game_state['boss']
+                if check_collision(player, boss):
+                    # Player takes 50 massive crash damage
+                    is_player_dead = player.take_damage(50)
+                    self.add_event('hit', player.x, player.y, player.color)
+                    self.log(f"Player {player_id} crashed into BOSS! -50 HP")
+
+                    # Knockback player away from boss to prevent getting stuck
+                    dx = player.x - boss.x
+                    dy = player.y - boss.y
+                    dist = math.sqrt(dx * dx + dy * dy)
+                    if dist > 0:
+                        # Push player backwards
+                        knockback_strength = 50
+                        player.x += (dx / dist) * knockback_strength
+                        player.y += (dy / dist) * knockback_strength
+
+                        # Keep player inside the world
+                        player.x = max(20, min(WORLD_WIDTH - 20, player.x))
+                        player.y = max(20, min(WORLD_HEIGHT - 20, player.y))
+
+                    # Check if player died from crash
+                    if is_player_dead:
+                        self.add_event('explode', player.x, player.y, player.color)
+                        spawn_x = self.rng.randint(100, WORLD_WIDTH - 100)
+                        spawn_y = self.rng.randint(100, WORLD_HEIGHT - 100)
+                        player.respawn(spawn_x, spawn_y)
+                        self.log(f"Player {player_id} died from Boss crash and respawned!")
+
+        if crashed_npcs:
+            game_state['npcs'] = [npc for npc in game_state['npcs'] if npc not in crashed_npcs]
+
+    def handle_collisions(self):
+        """Handle all bullet collision logic with explosion events.
+
+        Each target collects the bullets overlapping it from the pool; a bullet
+        hits at most one target and is flagged, then all flagged bullets are
+        removed in one batch at the end.
+        """
+        game_state = self.game_state
+        bullets = game_state['bullets']
+
+        # Bullet vs Player collision
+        for player_id, player in game_state['players'].items():
+            # Don't hit yourself (players can't hit themselves)
+            for i in bullets.overlapping(player.x, player.y, player.HITBOX_RADIUS, exclude_owner=player_id):
+                is_dead = player.take_damage(int(bullets.damage[i]))
+                bullets.hit[i] = True
+
+                # Add hit event for screen shake
+                self.add_event('hit', player.x, player.y, player.color)
+                self.log(f"Player {player_id} hit! HP: {player.hp}")
+
+                if is_dead:
+                    # Add explosion event
+                    self.add_event('explode', player.x, player.y, player.color)
+                    # Respawn player and reset score
+                    spawn_x = self.rng.randint(100, WORLD_WIDTH - 100)
+                    spawn_y = self.rng.randint(100, WORLD_HEIGHT - 100)
+                    player.respawn(spawn_x, spawn_y)
+                    self.log(f"Player {player_id} died and respawned!")
+                    break
+
+        # Bullet vs NPC collision
+        killed_npcs = set()
+        for npc in game_state['npcs']:
+            for i in bullets.overlapping(npc.x, npc.y, npc.HITBOX_RADIUS):
+                is_dead = npc.take_damage(int(bullets.damage[i]))
+                bullets.hit[i] = True
+
+                if is_dead:
+                    # Add explosion event for NPC death
+                    self.add_event('explode', npc.x, npc.y, 'npc')
+                    killed_npcs.add(npc)
+                    # Give score to shooter if it's a player
+                    owner_id = bullets.owner_id(i)
+                    if owner_id in game_state['players']:
+                        game_state['players'][owner_id].score += 1
+                        self.log(f"Player {owner_id} killed NPC! Score: {game_state['players'][owner_id].score}")
+                    break
+
+        if killed_npcs:
+            game_state['npcs'] = [npc for npc in game_state['npcs'] if npc not in killed_npcs]
+
+        # Bullet vs Boss collision
+        boss = game_state['boss']
+        if boss is not None:
+            for i in bullets.overlapping(boss.x, boss.y, boss.HITBOX_RADIUS):
+                is_dead = boss.take_damage(int(bullets.damage[i]))
+                bullets.hit[i] = True
+
+                if is_dead:
+                    # Add big explosion event for Boss death
+                    self.add_event('explode_big', boss.x, boss.y, 'boss')
+                    # Give score to shooter
+                    owner_id = bullets.owner_id(i)
+                    if owner_id in game_state['players']:
+                        game_state['players'][owner_id].score += 5
+                        self.log(f"Player {owner_id} killed the BOSS! +5 Score!")
+                    game_state['boss'] = None
+
+                    # Advance checkpoint to the threshold we just cleared
+                    self.checkpoint_score = 10 * self.boss_level
+                    for p in game_state['players'].values():
+                        p.checkpoint_score = self.checkpoint_score
+                    self.log(f"BOSS LEVEL {self.boss_level} DEFEATED! "
+                             f"Checkpoint updated to {self.checkpoint_score}.")
+                    self.boss_level += 1
+                    break
+
+        # Remove hit bullets
+        bullets.remove_hit()
+
+    # === CLIENT MESSAGES ===
+
+    def negotiate_protocol(self, player_id, hello):
+        """Confirm the snapshot encoding and features a client asked for in its hello.
+
+        Called with the lock held. The confirmation is queued as a barrier, so
+        no snapshot encoded in the old format is sent after the client sees it.
+        """
+        requested = hello.get('protocol')
+        protocol = requested if requested in SUPPORTED_PROTOCOLS else PROTOCOL_JSON
+        delta = bool(hello.get(FEATURE_DELTA)) and FEATURE_DELTA in SUPPORTED_FEATURES
+        binary_input = bool(hello.get(FEATURE_BINARY_INPUT))
+        ack = json.dumps({'type': 'protocol', 'protocol': protocol, FEATURE_DELTA: delta,
+                          FEATURE_BINARY_INPUT: binary_input}) + '\n'
+        self.client_senders[player_id].put_control(ack.encode(), barrier=True)
+        self.client_protocols[player_id] = protocol
+        if delta:
+            self.client_views[player_id] = ClientView(view_radius=VIEW_RADIUS)
+        self.log(f"Player {player_id} uses {protocol} snapshots{' with deltas' if delta else ''}")
+
+    def apply_client_message(self, player_id, msg):
+        """Apply a control message (hello, resync) from a client. Caller must hold the lock."""
+        msg_type = msg.get('type')
+        if msg_type == 'hello':
+            self.negotiate_protocol(player_id, msg)
+        elif msg_type == 'resync':
+            view = self.client_views.get(player_id)
+            if view is not None:
+                view.request_resync()
+
+    def queue_input(self, player_id, inputs):
+        """Queue an input packet for simulate_tick.
+
+        Needs no lock: the deque append is atomic and ClientView.ack only
+        replaces an int, so readers never wait on the simulation. JSON inputs
+        are whatever the client sent: a seq that is not a u32 drops the
+        packet (it goes into every snapshot header), an ack that is not one
+        is ignored, and only the INPUT_KEYS are kept, as bools.
+        """
+        seq = inputs.get('seq')
+        if seq is not None and not is_u32(seq):
+            return
+        ack = inputs.get('ack')
+        inputs = {key: bool(inputs.get(key)) for key in INPUT_KEYS}
+        inputs['seq'] = seq
+
+        view = self.client_views.get(player_id)
+        if view is not None and is_u32(ack):
+            view.ack(ack)
+
+        pending = self.client_input_queues.get(player_id)
+        if pending is not None:
+            pending.append(inputs)
+
+    def apply_next_input(self, player_id, player):
+        """Take the player's next queued input for this tick. Caller must hold the lock.
+
+        Without a new input the previous one stays in effect. Shooting happens
+        on the key press only.
+        """
+        pending = self.client_input_queues.get(player_id)
+        if not pending:
+            self.client_input_held[player_id] = self.client_input_held.get(player_id, 0) + 1
+            return self.client_inputs.get(player_id, {})
+
+        inputs = pending.popleft()
+        was_shooting = self.client_inputs.get(player_id, {}).get('space', False)
+        self.client_inputs[player_id] = inputs
+        if inputs.get('seq') is not None:
+            self.client_input_seq[player_id] = inputs['seq']
+        self.client_input_held[player_id] = 1
+
+        # Handle Space input to spawn MathBullet
+        if inputs.get('space', False) and not was_shooting:
+            self.game_state['bullets'].spawn(
+                player.x, player.y, player.angle,
+                owner_id=player_id,
+                expression=self.patterns.expression
+            )
+        return inputs
+
+    def drain_client_messages(self):
+        """Apply messages queued by the asyncio server. Caller must hold the lock."""
+        while True:
+            try:
+                player_id, msg = self.client_messages.get_nowait()
+            except queue.Empty:
+                return
+            if player_id in self.client_senders:
+                self.apply_client_message(player_id, msg)
+
+    def handle_datagram(self, player_id, payload, address):
+        """A UDP registration or input packet from one of our players.
+
+        Inputs are queued without the lock, like TCP ones; datagrams older
+        than the newest input already received are dropped.
+        """
+        if payload[:1] == KIND_REGISTER:
+            if self.udp_addresses.get(player_id) != address:
+                self.udp_addresses[player_id] = address
+                self.log(f"Player {player_id} registered UDP address {address}")
+            sender = self.client_senders.get(player_id)
+            if sender is not None:
+                sender.put_control(pack_frame(encode_json_message({'type': 'udp'})))
+        elif (payload[:1] == KIND_INPUT and len(payload) == INPUT_RECORD.size
+              and self.udp_addresses.get(player_id) == address):
+            inputs = decode_input(payload)
+            if inputs['seq'] <= self.udp_input_seq.get(player_id, 0):
+                return  # Late or duplicate
+            self.udp_input_seq[player_id] = inputs['seq']
+            self.queue_input(player_id, inputs)
+
+    # === PLAYERS ===
+
+    def init_message(self, player_id, udp_token=None):
+        """The 'init' line sent to a client right after it connects."""
+        init_msg = {
+            'type': 'init',
+            'id': player_id,
+            'color': COLORS[player_id % len(COLORS)],
+            'protocols': SUPPORTED_PROTOCOLS,
+            'features': SUPPORTED_FEATURES,
+            'world': [WORLD_WIDTH, WORLD_HEIGHT],
+            'tick_rate': self.tick_rate,
+            'snapshot_rate': self.snapshot_rate
+        }
+        if udp_token is not None:
+            init_msg['features'] = SUPPORTED_FEATURES + [FEATURE_UDP]
+            init_msg[FEATURE_UDP] = {'port': self.udp.port, 'token': udp_token}
+        return json.dumps(init_msg).encode() + b'\n'
+
+    def add_player(self, sender, address):
+        """Create a Player for a new connection and register it. Returns the player id.
+
+        The init message is queued on sender before the player becomes visible
+        to the game loop, so it is always the first thing the client receives.
+        """
+        with self.lock:
+            player_id = self.next_player_id
+            self.next_player_id += 1
+            udp_token = None
+            if self.udp is not None:
+                udp_token = self.udp.new_token(self, player_id)
+                self.udp_tokens[udp_token] = player_id
+            sender.put_control(self.init_message(player_id, udp_token))
+
+            # Create player with spawn position
+            spawn_x = 100 + (player_id * 150) % (WORLD_WIDTH - 200)
+            spawn_y = 100 + (player_id * 100) % (WORLD_HEIGHT - 200)
+            color = COLORS[player_id % len(COLORS)]
+
+            player = Player(spawn_x, spawn_y, color)
+            player.checkpoint_score = self.checkpoint_score
+            player.score = self.checkpoint_score
+            self.game_state['players'][player_id] = player
+            self.client_senders[player_id] = sender
+            self.client_inputs[player_id] = {}
+            self.client_input_queues[player_id] = deque(maxlen=MAX_QUEUED_INPUTS)
+            self.client_input_seq[player_id] = 0
+            self.client_input_held[player_id] = 0
+            self.client_protocols[player_id] = PROTOCOL_JSON
+
+        self.log(f"Player {player_id} ({color}) joined from {address}")
+        return player_id
+
+    def remove_player(self, player_id):
+        """Forget everything about a disconnected player."""
+        with self.lock:
+            self.game_state['players'].pop(player_id, None)
+            sender = self.client_senders.pop(player_id, None)
+            self.client_inputs.pop(player_id, None)
+            self.client_input_queues.pop(player_id, None)
+            self.client_input_seq.pop(player_id, None)
+            self.client_input_held.pop(player_id, None)
+            for token in [t for t, pid in self.udp_tokens.items() if pid == player_id]:
+                del self.udp_tokens[token]
+                self.udp.forget_token(token)
+            self.udp_addresses.pop(player_id, None)
+            self.udp_input_seq.pop(player_id, None)
+            self.client_protocols.pop(player_id, None)
+            self.client_views.pop(player_id, None)
+
+        if sender is not None:
+            sender.close()
+        self.log(f"Player {player_id} disconnected")
+
+    # === SNAPSHOTS ===
+
+    def capture_world(self):
+        """Snapshot the world for this tick: entities keyed by id, quantized.
+
+        'inputs' holds each player's (last applied input seq, ticks it has been
+        applied for, speed), which delta clients need to reconcile their
+        predicted ship.
+
+        Also builds the spatial indexes used for per-client area of interest:
+        'index' holds (kind, key) entries for players, NPCs and the boss, and
+        'bullet_grid' indexes the bullet arrays.
+        """
+        game_state = self.game_state
+        boss = game_state['boss']
+        players = {
+            str(pid): quantize_entity(p.get_state()) for pid, p in game_state['players'].items()
+        }
+        npcs = {
+            str(npc.npc_id): quantize_entity(npc.get_state()) for npc in game_state['npcs']
+        }
+        boss_state = quantize_entity(boss.get_state()) if boss else None
+        bullets = game_state['bullets'].get_arrays()
+
+        index = SpatialHash(cell_size=AOI_CELL_SIZE)
+        for key, state in players.items():
+            index.insert_at(('players', key), state[0], state[1])
+        for key, state in npcs.items():
+            index.insert_at(('npcs', key), state[0], state[1])
+        if boss_state is not None:
+            index.insert_at(('boss', None), boss_state[0], boss_state[1])
+        bullet_grid = PointGrid(cell_size=AOI_CELL_SIZE)
+        bullet_grid.build(bullets[0], bullets[1])
+
+        return {
+            'tick': self.tick,
+            'players': players,
+            'npcs': npcs,
+            'boss': boss_state,
+            'bullets': bullets,
+            'events': self.frame_events,
+            'inputs': {pid: (self.client_input_seq.get(pid, 0), self.client_input_held.get(pid, 0), p.speed)
+                       for pid, p in game_state['players'].items()},
+            'index': index,
+            'bullet_grid': bullet_grid,
+        }
+
+    def encode_for_client(self, player_id, world, cache):
+        """Encode this tick's snapshot for one client.
+
+        Delta clients get their own keyframe/delta message, limited to their
+        area of interest. Everyone else gets the full 'state' snapshot, which is
+        encoded once per protocol and shared through cache. Runs outside the
+        lock: world is a copy, the result is an immutable bytes buffer and
+        ClientView guards the resync flag that receive threads set.
+        """
+        protocol = self.client_protocols.get(player_id, PROTOCOL_JSON)
+
+        view = self.client_views.get(player_id)
+        if view is not None:
+            me = world['players'].get(str(player_id))
+            msg, bullet_idx = view.build_message(world, center=me[:2] if me else None)
+            msg['input_seq'], msg['input_held'], msg['speed'] = world['inputs'].get(player_id, (0, 0, 0.0))
+            bullets = world['bullets']
+            if bullet_idx is not None:
+                bullets = tuple(arr[bullet_idx] for arr in bullets)
+            if protocol == PROTOCOL_BINARY:
+                return pack_frame(encode_snapshot(msg, bullets))
+            return (json.dumps(dict(msg, bullets=states_from_arrays(bullets))) + '\n').encode()
+
+        if protocol not in cache:
+            state = {
+                'type': 'state',
+                'tick': world['tick'],
+                'players': world['players'],
+                'npcs': list(world['npcs'].values()),
+                'boss': world['boss'],
+                'events': world['events'],
+            }
+            if protocol == PROTOCOL_BINARY:
+                cache[protocol] = pack_frame(encode_state(state, world['bullets']))
+            else:
+                bullets = states_from_arrays(world['bullets'])
+                cache[protocol] = (json.dumps(dict(state, bullets=bullets)) + '\n').encode()
+        return cache[protocol]
+
+    # === GAME LOOP ===
+
+    # Phases of simulate_tick, in order: (name, method)
+    PHASES = [
+        ('spawning', 'update_spawning'),
+        ('players', 'update_players'),
+        ('npcs', 'update_npcs'),
+        ('boss', 'update_boss'),
+        ('bullets', 'update_bullets'),
+        ('collisions', 'handle_collisions'),            # Bullet collisions
+        ('body_collisions', 'handle_body_collisions'),  # Player vs Enemy body collisions
+    ]
+    # Phases of broadcast: 'capture' (under the lock) and 'encode'
+    BROADCAST_PHASES = ['capture', 'encode']
+
+    def timed(self, name, phase, *args):
+        """Run phase(*args), reporting how long it took to phase_timer if one is set."""
+        timer = self.phase_timer
+        if timer is None:
+            return phase(*args)
+        start = time.perf_counter()
+        result = phase(*args)
+        timer(name, time.perf_counter() - start)
+        return result
+
+    def simulate_tick(self):
+        """Advance the world by one fixed timestep. Caller must hold the lock."""
+        self.tick += 1
+
+        # Input received by the asyncio server since the last tick
+        self.drain_client_messages()
+
+        for name, method in self.PHASES:
+            self.timed(name, getattr(self, method))
+
+    def update_spawning(self):
+        """Spawn the boss at score thresholds, NPCs at intervals while it is away."""
+        game_state = self.game_state
+        if len(game_state['players']) > 0:
+            total = self.get_total_score()
+            boss_threshold = 10 * self.boss_level  # 10, 20, 30, ...
+
+            if total >= boss_threshold and game_state['boss'] is None:
+                self.spawn_boss()
+
+            # Solo Boss: only spawn NPCs when boss is NOT active
+            if game_state['boss'] is None:
+                if self.tick - self.last_npc_spawn > NPC_SPAWN_INTERVAL * self.tick_rate:
+                    self.spawn_npc()
+                    self.last_npc_spawn = self.tick
+
+    def update_players(self):
+        for player_id, player in self.game_state['players'].items():
+            inputs = self.apply_next_input(player_id, player)
+            player.move(inputs)
+
+            # Wrap around world edges
+            player.wrap(WORLD_WIDTH, WORLD_HEIGHT)
+
+    def update_npcs(self):
+        """Move NPCs towards the nearest player."""
+        for npc in self.game_state['npcs']:
+            nearest = self.find_nearest_player(npc.x, npc.y)
+            if nearest:
+                npc.move_towards_target(nearest.x, nearest.y)
+
+            # Keep NPCs inside the world
+            npc.x = max(10, min(WORLD_WIDTH - 10, npc.x))
+            npc.y = max(10, min(WORLD_HEIGHT - 10, npc.y))
+
+    def update_boss(self):
+        game_state = self.game_state
+        if game_state['boss'] is None:
+            return
+
+        boss = game_state['boss']
+        nearest = self.find_nearest_player(boss.x, boss.y)
+        if nearest:
+            boss.move_towards_target(nearest.x, nearest.y)
+
+        # Keep Boss inside the world
+        boss.x = max(50, min(WORLD_WIDTH - 50, boss.x))
+        boss.y = max(50, min(WORLD_HEIGHT - 50, boss.y))
+
+        # === BOSS ATTACK: Fire 8 bullets every 2 seconds ===
+        if boss.update_attack():
+            bullet_data_list = boss.get_attack_bullets()
+            for bdata in bullet_data_list:
+                game_state['bullets'].spawn(
+                    bdata['x'], bdata['y'], bdata['angle'],
+                    owner_id=bdata['owner_id'],
+                    speed=bdata['speed'],
+                    damage=bdata['damage']
+                )
+            # Add boss attack event
+            self.add_event('boss_attack', boss.x, boss.y, 'boss')
+            self.log("Boss fired!")
+
+    def update_bullets(self):
+        """Move all bullets (batched) and drop the ones that left the world."""
+        self.game_state['bullets'].move()
+        self.game_state['bullets'].remove_out_of_bounds(WORLD_WIDTH, WORLD_HEIGHT)
+
+    def broadcast(self):
+        """Send a snapshot of the current world to every client.
+
+        Only capturing the world happens under the lock. Snapshots are encoded
+        outside it and handed to the per-client send queues; the writers do the
+        actual sends, so a slow client never delays a tick. Clients registered
+        for UDP get their snapshots as datagrams instead when they fit.
+        """
+        with self.lock:
+            world = self.timed('capture', self.capture_world)
+            self.frame_events = []  # Sent with this snapshot
+            receivers = [(player_id, sender, sender.epoch, self.udp_addresses.get(player_id))
+                         for player_id, sender in self.client_senders.items()]
+
+        self.timed('encode', self.send_snapshots, world, receivers)
+
+    def send_snapshots(self, world, receivers):
+        """Encode world for each receiver and hand it to the client's send queue or UDP."""
+        cache = {}
+        for player_id, sender, epoch, udp_address in receivers:
+            if sender.closed:
+                continue
+            try:
+                data = self.encode_for_client(player_id, world, cache)
+            except (struct.error, ValueError, TypeError, OverflowError) as e:
+                # One client's bad state must not stop the room's loop
+                self.log(f"Dropping player {player_id}: cannot encode snapshot: {e}")
+                sender.disconnect()
+                continue
+            self.bytes_sent += len(data)
+            if udp_address is None or not self.udp.send_snapshot(data, udp_address):
+                sender.put_snapshot(data, epoch)
+
+    def run(self):
+        """Run the simulation at tick_rate and send snapshots at snapshot_rate until stopped.
+
+        With metrics set, one record is published per loop iteration.
+        """
+        scheduler = TickScheduler(self.tick_rate, self.snapshot_rate, max_catch_up=self.max_catch_up,
+                                  clock=self.clock, sleep=self.sleep)
+
+        while self.running:
+            ticks = scheduler.wait()
+            start = time.perf_counter()
+            for _ in range(ticks):
+                with self.lock:
+                    self.simulate_tick()
+            if scheduler.snapshot_due(self.tick):
+                self.broadcast()
+            if self.metrics is not None:
+                self.metrics.commit(self, ticks, time.perf_counter() - start, scheduler)
+
+        if self.metrics is not None:
+            self.metrics.close()
+
+    def start(self):
+        """Run the game loop in a daemon thread."""
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        self.running = False
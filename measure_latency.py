@@ -0,0 +1,116 @@
+"""Measure input-to-snapshot latency over loopback, over TCP or UDP.
+
+Runs a server and a headless client in this process. The client changes
+its keys every few frames; the latency of an input is the time from
+sending it until the first snapshot that says the server applied it.
+Snapshot gaps show how long the client went without any new snapshot.
+
+Loss and latency are simulated on UDP datagrams in both directions (see
+udp_transport.LossySocket). TCP is not affected by them; use it as the
+lossless baseline.
+
+    python measure_latency.py --udp --loss 0.05 --latency 0.03
+"""
+import argparse
+import threading
+import time
+import client_main
+import server_main
+
+FRAME_TIME = 1 / 60
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return "no samples"
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))] * 1000
+    return (f"p50 {pick(0.5):6.1f} ms  p95 {pick(0.95):6.1f} ms  "
+            f"p99 {pick(0.99):6.1f} ms  max {values[-1] * 1000:6.1f} ms  (n={len(values)})")
+
+
+def run(use_udp, loss, latency, seconds, port):
+    server_main.PORT = port
+    server_main.UDP_ENABLED = use_udp
+    server_main.UDP_LOSS = loss
+    server_main.UDP_LATENCY = latency
+    threading.Thread(target=server_main.start_server, daemon=True).start()
+    time.sleep(0.5)
+
+    client_main.PORT = port
+    client_main.USE_UDP = use_udp
+    client_main.UDP_LOSS = loss
+    client_main.UDP_LATENCY = latency
+
+    sent = {}        # {seq: send time}
+    latencies = []
+    arrivals = []
+    predictor = client_main.predictor
+    reconcile = predictor.reconcile
+
+    def timed_reconcile(state, input_seq, input_held, speed):
+        now = time.perf_counter()
+        arrivals.append(now)
+        for seq in [s for s in sent if s <= input_seq]:
+            latencies.append(now - sent.pop(seq))
+        reconcile(state, input_seq, input_held, speed)
+
+    predictor.reconcile = timed_reconcile
+
+    sock = client_main.connect_to_server()
+    deadline = time.perf_counter() + 5
+    while time.perf_counter() < deadline:
+        if client_main.my_player_id is not None and (client_main.udp_ready or not use_udp):
+            break
+        time.sleep(0.05)
+    else:
+        print("Client did not finish connecting")
+        return
+    time.sleep(0.5)
+    latencies.clear()
+    arrivals.clear()
+
+    frame = 0
+    last_sent = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        inputs = {'w': True, 'a': (frame // 10) % 2 == 0, 's': False, 'd': False, 'space': False}
+        keepalive = (client_main.UDP_INPUT_KEEPALIVE if client_main.udp_ready
+                     else client_main.INPUT_KEEPALIVE)
+        # Snapshots reach the predictor here, as in the client's render loop
+        client_main.apply_state_updates()
+        seq = predictor.apply_input(inputs, start, force=start - last_sent >= keepalive)
+        if seq is not None:
+            sent[seq] = start
+            client_main.send_input(sock, inputs, seq, client_main.assembler.latest_tick)
+            last_sent = start
+        frame += 1
+        time.sleep(max(0, FRAME_TIME - (time.perf_counter() - start)))
+
+    gaps = [b - a for a, b in zip(arrivals, arrivals[1:])]
+    transport = "UDP" if client_main.udp_ready else "TCP"
+    print()
+    print(f"{transport}, {loss:.0%} loss, {latency * 1000:.0f} ms latency, {seconds} s")
+    print(f"  input -> snapshot: {percentiles(latencies)}")
+    print(f"  snapshot gaps:     {percentiles(gaps)}")
+
+    client_main.connected = False
+    server_main.running = False
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--udp', action='store_true', help="use the UDP channel")
+    parser.add_argument('--loss', type=float, default=0.0, help="simulated UDP loss rate (0-1)")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="simulated one-way UDP latency (seconds)")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--port', type=int, default=9998)
+    args = parser.parse_args()
+    run(args.udp, args.loss, args.latency, args.seconds, args.port)
+
+
+if __name__ == '__main__':
+    main()
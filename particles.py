@@ -0,0 +1,164 @@
+import math
+import numpy as np
+import pygame
+
+# Particles alive at once; bursts beyond this are cut short
+MAX_PARTICLES = 4096
+FRICTION = 0.95
+# Pre-rendered brightness steps between full color and faded out
+FADE_LEVELS = 16
+MAX_RADIUS = 3
+SPRITE_SIZE = 2 * MAX_RADIUS + 1
+# Random shades of each color, like the old per-particle color jitter
+SHADES = 4
+SHADE_JITTER = 30
+
+
+class ParticleSystem:
+    """Struct-of-arrays storage for the client's explosion particles.
+
+    Replaces the list of Particle objects: positions, velocities and
+    lifetimes live in fixed-capacity NumPy arrays and are integrated, faded
+    and culled with a few array operations per frame. Slots [0, count) are
+    live and stay contiguous.
+
+    Each particle has a palette entry (a shade of the explosion color).
+    Drawing picks one of FADE_LEVELS pre-rendered sprites per palette entry
+    (dimmer and smaller as the particle fades) and blits them all in one
+    Surface.blits call.
+    """
+
+    def __init__(self, capacity=MAX_PARTICLES, seed=None):
+        self.capacity = capacity
+        self.count = 0
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.dx = np.zeros(capacity)
+        self.dy = np.zeros(capacity)
+        self.lifetime = np.zeros(capacity, dtype=np.int32)      # Frames remaining
+        self.max_lifetime = np.ones(capacity, dtype=np.int32)
+        self.palette_index = np.zeros(capacity, dtype=np.int32)
+        self.rng = np.random.default_rng(seed)
+
+        self.palette = []      # [rgb], SHADES consecutive entries per color
+        self.palette_ids = {}  # {base rgb: index of its first shade}
+        self.sprites = []      # FADE_LEVELS sprites per palette entry, dimmest first
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.count = 0
+
+    def _shades(self, rgb):
+        """Index of the first of SHADES palette entries for this color."""
+        index = self.palette_ids.get(rgb)
+        if index is None:
+            index = len(self.palette)
+            self.palette_ids[rgb] = index
+            self.palette.append(rgb)  # Shade 0 is the color itself
+            for _ in range(SHADES - 1):
+                jitter = self.rng.integers(-SHADE_JITTER, SHADE_JITTER + 1, size=3)
+                self.palette.append(tuple(int(v) for v in np.clip(np.array(rgb) + jitter, 0, 255)))
+        return index
+
+    def _reserve(self, n):
+        """Slots for up to n new particles (fewer when nearly full)."""
+        n = min(n, self.capacity - self.count)
+        start = self.count
+        self.count += n
+        return slice(start, start + n), n
+
+    def burst(self, x, y, rgb, count, speed=(2, 8), lifetime=(20, 40), shaded=True):
+        """Spawn count particles flying out of (x, y) in random directions.
+
+        speed is a (low, high) range; lifetime is an inclusive range of frames.
+        """
+        slots, n = self._reserve(count)
+        if n == 0:
+            return
+        angle = self.rng.uniform(0, 2 * math.pi, n)
+        velocity = self.rng.uniform(speed[0], speed[1], n)
+        self._spawn(slots, n, x, y, angle, velocity, self.rng.integers(lifetime[0], lifetime[1] + 1, n),
+                    self._shades(rgb), shaded)
+
+    def ring(self, x, y, rgb, step_degrees=15, speed=(5, 10), lifetime=50):
+        """Spawn an evenly spaced ring of particles, each at a random speed."""
+        angle = np.radians(np.arange(0, 360, step_degrees))
+        slots, n = self._reserve(len(angle))
+        if n == 0:
+            return
+        self._spawn(slots, n, x, y, angle[:n], self.rng.uniform(speed[0], speed[1], n),
+                    np.full(n, lifetime), self._shades(rgb), False)
+
+    def _spawn(self, slots, n, x, y, angle, velocity, lifetime, palette_index, shaded):
+        self.x[slots] = x
+        self.y[slots] = y
+        self.dx[slots] = np.cos(angle) * velocity
+        self.dy[slots] = np.sin(angle) * velocity
+        self.lifetime[slots] = lifetime
+        self.max_lifetime[slots] = lifetime
+        if shaded:
+            self.palette_index[slots] = palette_index + self.rng.integers(0, SHADES, n)
+        else:
+            self.palette_index[slots] = palette_index
+
+    def update(self):
+        """Move every particle one frame, slow it down and drop the dead ones."""
+        n = self.count
+        if n == 0:
+            return
+        self.x[:n] += self.dx[:n]
+        self.y[:n] += self.dy[:n]
+        self.dx[:n] *= FRICTION
+        self.dy[:n] *= FRICTION
+        self.lifetime[:n] -= 1
+
+        alive = self.lifetime[:n] > 0
+        if alive.all():
+            return
+        keep = np.flatnonzero(alive)
+        for arr in (self.x, self.y, self.dx, self.dy, self.lifetime, self.max_lifetime, self.palette_index):
+            arr[:len(keep)] = arr[keep]
+        self.count = len(keep)
+
+    def _build_sprites(self):
+        """Render the FADE_LEVELS sprites of palette entries added since the last draw."""
+        while len(self.sprites) < len(self.palette) * FADE_LEVELS:
+            rgb = self.palette[len(self.sprites) // FADE_LEVELS]
+            alpha = (len(self.sprites) % FADE_LEVELS + 1) / FADE_LEVELS
+            sprite = pygame.Surface((SPRITE_SIZE, SPRITE_SIZE))
+            sprite.set_colorkey((0, 0, 0), pygame.RLEACCEL)
+            # Never pure black, which is the colorkey
+            color = tuple(max(1, int(c * alpha)) for c in rgb)
+            radius = max(1, int(MAX_RADIUS * alpha))
+            pygame.draw.circle(sprite, color, (MAX_RADIUS, MAX_RADIUS), radius)
+            self.sprites.append(sprite)
+
+    def draw(self, screen, offset_x, offset_y):
+        """Blit every on-screen particle, shifted by the camera/shake offset.
+
+        Returns the screen Rect bounding them, or None if none was drawn.
+        """
+        n = self.count
+        if n == 0:
+            return None
+        width, height = screen.get_size()
+        x = (self.x[:n] + offset_x).astype(np.int32) - MAX_RADIUS
+        y = (self.y[:n] + offset_y).astype(np.int32) - MAX_RADIUS
+        visible = (x > -SPRITE_SIZE) & (x < width) & (y > -SPRITE_SIZE) & (y < height)
+        if not visible.any():
+            return None
+
+        alpha = self.lifetime[:n][visible] / self.max_lifetime[:n][visible]
+        level = np.clip(np.ceil(alpha * FADE_LEVELS).astype(np.int32) - 1, 0, FADE_LEVELS - 1)
+        sprite_ids = self.palette_index[:n][visible] * FADE_LEVELS + level
+
+        self._build_sprites()
+        sprites = self.sprites
+        x = x[visible]
+        y = y[visible]
+        screen.blits([(sprites[i], (px, py)) for i, px, py in zip(sprite_ids.tolist(), x.tolist(), y.tolist())],
+                     doreturn=False)
+        left, top = int(x.min()), int(y.min())
+        return pygame.Rect(left, top, int(x.max()) - left + SPRITE_SIZE, int(y.max()) - top + SPRITE_SIZE)
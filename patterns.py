@@ -0,0 +1,293 @@
+import ast
+import json
+import math
+import operator
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+
+# Only these node types may appear in a bullet pattern expression.
+# Anything else (comprehensions, subscripts, lambdas, ...) is rejected.
+ALLOWED_BINOPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: math.pow,
+}
+ALLOWED_UNARYOPS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+# Exact integer arithmetic holds the GIL for as long as it takes, so a
+# pattern like "x ** 9 ** 9" or "math.factorial(10 ** 6)" would freeze
+# every room while its trajectory is built. Every ** is therefore
+# evaluated in floating point with math.pow, which raises OverflowError
+# instead of building a huge int, and a constant exponent may be at most
+# MAX_EXPONENT. The combinatorics functions grow just as fast and are not
+# allowed at all.
+MAX_EXPONENT = 100
+UNSAFE_MATH_NAMES = frozenset({'factorial', 'comb', 'perm'})
+MATH_NAMES = frozenset(name for name in dir(math) if not name.startswith('_')) - UNSAFE_MATH_NAMES
+
+# Pattern used until pattern.json provides a valid one
+DEFAULT_EXPRESSION = "50 * math.sin(x / 10)"
+
+# Bullets live at most this many ticks (6 seconds at 60 FPS), which is also
+# the length of every precomputed trajectory table.
+MAX_BULLET_LIFETIME = 360
+
+
+class PatternError(ValueError):
+    """Raised when a pattern expression is not a safe math expression of x."""
+
+
+def _check_node(node):
+    """Recursively verify that node only uses x, numbers, arithmetic and math.*."""
+    if isinstance(node, ast.Expression):
+        _check_node(node.body)
+    elif isinstance(node, ast.BinOp):
+        if type(node.op) not in ALLOWED_BINOPS:
+            raise PatternError(f"operator {type(node.op).__name__} is not allowed")
+        _check_node(node.left)
+        _check_node(node.right)
+    elif isinstance(node, ast.UnaryOp):
+        if type(node.op) not in ALLOWED_UNARYOPS:
+            raise PatternError(f"operator {type(node.op).__name__} is not allowed")
+        _check_node(node.operand)
+    elif isinstance(node, ast.Constant):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise PatternError(f"constant {node.value!r} is not a number")
+    elif isinstance(node, ast.Name):
+        if node.id != 'x':
+            raise PatternError(f"name '{node.id}' is not allowed (only x)")
+    elif isinstance(node, ast.Attribute):
+        if node.attr in UNSAFE_MATH_NAMES:
+            raise PatternError(f"math.{node.attr} is not allowed")
+        if not (isinstance(node.value, ast.Name) and node.value.id == 'math'
+                and node.attr in MATH_NAMES):
+            raise PatternError("only math.* attributes are allowed")
+    elif isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Attribute) or node.keywords:
+            raise PatternError("only positional math.* calls are allowed")
+        _check_node(node.func)
+        for arg in node.args:
+            _check_node(arg)
+    else:
+        raise PatternError(f"{type(node).__name__} is not allowed in a pattern")
+
+
+class _ConstantFolder(ast.NodeTransformer):
+    """Fold sub-expressions that do not depend on x into plain constants.
+
+    Powers that cannot be folded become math.pow calls (see MAX_EXPONENT).
+    """
+
+    def _fold(self, node, value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return node
+        return ast.copy_location(ast.Constant(value), node)
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        is_pow = isinstance(node.op, ast.Pow)
+        if is_pow and isinstance(node.right, ast.Constant) and abs(node.right.value) > MAX_EXPONENT:
+            raise PatternError(f"exponent {node.right.value} is too large (at most {MAX_EXPONENT})")
+        if isinstance(node.left, ast.Constant) and isinstance(node.right, ast.Constant):
+            try:
+                value = ALLOWED_BINOPS[type(node.op)](node.left.value, node.right.value)
+            except (ArithmeticError, ValueError):
+                value = None  # Leave it for runtime, where move() falls back
+            if value is not None:
+                return self._fold(node, value)
+        if is_pow:
+            pow_call = ast.Call(func=ast.Attribute(value=ast.Name(id='math', ctx=ast.Load()),
+                                                   attr='pow', ctx=ast.Load()),
+                                args=[node.left, node.right], keywords=[])
+            return ast.copy_location(pow_call, node)
+        return node
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.operand, ast.Constant):
+            return self._fold(node, ALLOWED_UNARYOPS[type(node.op)](node.operand.value))
+        return node
+
+    def visit_Attribute(self, node):
+        # math.pi, math.e, math.tau, ...
+        value = getattr(math, node.attr)
+        if isinstance(value, float):
+            return self._fold(node, value)
+        return node
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if all(isinstance(arg, ast.Constant) for arg in node.args):
+            try:
+                value = getattr(math, node.func.attr)(*(arg.value for arg in node.args))
+            except (ArithmeticError, ValueError, TypeError):
+                return node
+            return self._fold(node, value)
+        return node
+
+
+def parse_expression(expression):
+    """Parse, validate and constant-fold an expression. Returns the folded AST.
+
+    Raises PatternError if the expression is not a safe function of x.
+    """
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as e:
+        raise PatternError(f"invalid syntax: {e.msg}") from None
+    _check_node(tree)
+    tree = ast.fix_missing_locations(_ConstantFolder().visit(tree))
+    return tree
+
+
+@lru_cache(maxsize=128)
+def compile_expression(expression):
+    """Compile a pattern expression into a callable f(x) -> float offset.
+
+    The result is cached per expression string, so every bullet fired with
+    the same pattern shares one function. Raises PatternError on bad input.
+    """
+    tree = parse_expression(expression)
+    func_def = ast.Expression(
+        body=ast.Lambda(
+            args=ast.arguments(
+                posonlyargs=[], args=[ast.arg(arg='x')], vararg=None,
+                kwonlyargs=[], kw_defaults=[], kwarg=None, defaults=[]
+            ),
+            body=tree.body,
+        )
+    )
+    ast.fix_missing_locations(func_def)
+    code = compile(func_def, f'<pattern {expression!r}>', 'eval')
+    return eval(code, {"__builtins__": {}, "math": math})
+
+
+def try_compile_expression(expression):
+    """Like compile_expression, but returns None for invalid expressions."""
+    try:
+        return compile_expression(expression)
+    except PatternError:
+        return None
+
+
+class TrajectoryCache:
+    """LRU cache of precomputed trajectory tables, keyed by expression.
+
+    A table holds the perpendicular offset f(t) for t = 0..max_lifetime
+    (index 0 is unused and always 0), so a bullet's offset on tick t is a
+    plain table[t] lookup. Evaluation errors give a 0 offset, matching the
+    straight-line fallback of MathBullet.
+    """
+
+    def __init__(self, max_lifetime=MAX_BULLET_LIFETIME, max_entries=32):
+        self.max_lifetime = max_lifetime
+        self.max_entries = max_entries
+        self._tables = OrderedDict()  # {expression: table}
+        self._lock = threading.Lock()
+
+    def _build(self, expression):
+        pattern = try_compile_expression(expression)
+        if pattern is None:
+            return None
+        table = np.zeros(self.max_lifetime + 1, dtype=np.float32)
+        for t in range(1, self.max_lifetime + 1):
+            try:
+                table[t] = pattern(t)
+            except Exception:
+                pass  # Fallback: straight line (no offset)
+        table[~np.isfinite(table)] = 0.0
+        table.flags.writeable = False  # Shared between bullets and threads
+        return table
+
+    def get(self, expression):
+        """Return the read-only table for expression, or None if it is invalid."""
+        with self._lock:
+            if expression in self._tables:
+                self._tables.move_to_end(expression)
+                return self._tables[expression]
+
+        table = self._build(expression)
+
+        with self._lock:
+            self._tables[expression] = table
+            self._tables.move_to_end(expression)
+            while len(self._tables) > self.max_entries:
+                self._tables.popitem(last=False)
+        return table
+
+
+trajectory_cache = TrajectoryCache()
+
+
+def get_trajectory(expression):
+    """Shared trajectory table for expression (see TrajectoryCache.get)."""
+    return trajectory_cache.get(expression)
+
+
+class PatternRegistry:
+    """In-memory current bullet pattern, kept in sync with pattern.json.
+
+    A background watcher thread polls the file's mtime. When it changes, the
+    new expression is validated, compiled and its trajectory table built
+    before it is swapped in with a single attribute assignment. Readers just
+    use registry.expression: no lock, no file I/O on the shooting path.
+    Invalid expressions are rejected and the previous pattern stays active.
+    """
+
+    def __init__(self, path, default_expression, poll_interval=0.5):
+        self.path = path
+        self.default_expression = default_expression
+        self.poll_interval = poll_interval
+        self.expression = default_expression
+        self._mtime = None
+        self._stop = threading.Event()
+        self._thread = None
+        get_trajectory(default_expression)
+
+    def start(self):
+        """Load the file once, then keep watching it in a daemon thread."""
+        self.refresh()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            self.refresh()
+
+    def refresh(self):
+        """Reload pattern.json if it changed since the last check."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            expr = data.get('expression', self.default_expression)
+            if not isinstance(expr, str):
+                raise PatternError("expression must be a string")
+            compile_expression(expr)
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"Error loading {self.path}: {e}")
+            return
+
+        if expr != self.expression:
+            get_trajectory(expr)  # Warm the table before bullets use it
+            self.expression = expr
+            print(f"Loaded new bullet pattern: {data.get('name', '?')} -> {expr}")
@@ -0,0 +1,107 @@
+from collections import deque
+from game_objects import Player
+
+# Input packets kept for replay; more than this unacknowledged means the
+# server is not applying them (e.g. we are disconnected), so the oldest go.
+MAX_PENDING_INPUTS = 120
+# Ticks predicted at most per call; after a longer stall the rest is dropped
+# (as the server's TickScheduler drops its backlog) and reconcile() catches up
+MAX_CATCH_UP = 5
+
+
+class LocalPlayerPredictor:
+    """Client-side prediction for the local ship.
+
+    Input packets are only sent when the keys change (or as a keepalive),
+    and both sides keep applying the last input once per tick until the
+    next one. apply_input() runs the ticks of that due since its last call
+    locally with the same Player.move the server uses, so the ship reacts
+    without waiting a round trip, and returns a new sequence number when a
+    packet should be sent.
+
+    Ticks are counted on a fixed step of 1 / tick_rate against a running
+    deadline, like the server's TickScheduler, so the predicted ship moves
+    at the server's speed whatever the client's frame rate: a frame may
+    run no tick or several.
+
+    Snapshots say which packet the server applied last and for how many
+    ticks; reconcile() then restarts from the authoritative position and
+    replays whatever the server has not simulated yet.
+    """
+
+    def __init__(self, tick_rate=60):
+        self.pending = deque(maxlen=MAX_PENDING_INPUTS)  # [[seq, inputs, ticks applied]]
+        self.tick_interval = 1 / tick_rate
+        self.reset()
+
+    def reset(self, tick_rate=None, world_size=None):
+        if tick_rate is not None:
+            self.tick_interval = 1 / tick_rate
+        self.world_size = world_size
+        self.player = None
+        self.pending.clear()
+        self.next_seq = 1
+        self.last_inputs = None
+        self.next_tick = None
+
+    def due_ticks(self, now):
+        """How many ticks have come due by now (a perf_counter time)."""
+        if self.next_tick is None:
+            self.next_tick = now + self.tick_interval
+            return 0
+        if now < self.next_tick:
+            return 0
+        due = int((now - self.next_tick) / self.tick_interval) + 1
+        if due > MAX_CATCH_UP:
+            due = MAX_CATCH_UP
+            self.next_tick = now + self.tick_interval
+        else:
+            self.next_tick += due * self.tick_interval
+        return due
+
+    def apply_input(self, inputs, now, force=False):
+        """Predict the ticks of inputs due by now (a perf_counter time).
+
+        Returns the seq to send them with if they differ from the previous
+        inputs (or force is set), else None.
+        """
+        seq = None
+        if force or inputs != self.last_inputs or not self.pending:
+            seq = self.next_seq
+            self.next_seq += 1
+            self.pending.append([seq, inputs, 0])
+            self.last_inputs = inputs
+        ticks = self.due_ticks(now)
+        self.pending[-1][2] += ticks
+        if self.player is not None:
+            for _ in range(ticks):
+                self._move(inputs)
+        return seq
+
+    def reconcile(self, state, input_seq, input_held, speed):
+        """Restart from our authoritative state tuple and replay what the server hasn't run.
+
+        input_seq is the last packet the server applied and input_held the
+        number of ticks it has applied it for.
+        """
+        while self.pending and self.pending[0][0] < input_seq:
+            self.pending.popleft()
+
+        x, y, angle = state[:3]
+        self.player = Player(x, y, state[3], angle=angle, speed=speed)
+        for seq, inputs, ticks in self.pending:
+            if seq == input_seq:
+                ticks -= input_held
+            for _ in range(ticks):
+                self._move(inputs)
+
+    def _move(self, inputs):
+        self.player.move(inputs)
+        if self.world_size is not None:
+            self.player.wrap(*self.world_size)
+
+    def predicted_state(self, state):
+        """Our state tuple with the predicted position and angle, or state if unknown."""
+        if self.player is None:
+            return state
+        return (self.player.x, self.player.y, self.player.angle) + tuple(state[3:])
@@ -0,0 +1,430 @@
+"""Wire formats for server -> client messages.
+
+Two encodings exist for snapshots:
+
+- json:   the original newline-terminated JSON dicts (always available).
+- binary: fixed-layout little-endian records with quantized positions and
+          angles, sent as length-prefixed frames.
+
+The client picks one during the init handshake. The server advertises the
+encodings (and optional features such as 'delta') it supports in the
+'init' message, the client answers with {'type': 'hello', 'protocol': ...,
+'delta': ...} and the server confirms with a final newline JSON
+{'type': 'protocol', ...} line. Everything the server sends after a
+'binary' confirmation is a frame:
+
+    [u32 big-endian payload length][payload]
+
+where the first payload byte says what it holds: b'S' for a full 'state'
+snapshot, b'K' / b'D' for a keyframe / delta snapshot (see snapshots.py)
+and b'J' for a JSON message. framing.FrameReader splits the stream back
+into lines and frames.
+
+Client -> server messages are newline JSON, unless the server offers the
+'binary_input' feature and the client's hello asks for it: everything the
+client sends after that hello is a frame, b'I' for a compact input packet
+(see encode_input) or b'J' for a JSON message. InputStream splits either
+form back into messages.
+
+With the optional 'udp' feature, snapshots and input packets can also go
+over UDP (see udp_transport.py). TCP stays in use for everything else.
+"""
+import json
+import struct
+import numpy as np
+from bullet_pool import BOSS_OWNER
+from framing import FRAME_HEADER, FrameReader
+
+PROTOCOL_JSON = 'json'
+PROTOCOL_BINARY = 'binary'
+SUPPORTED_PROTOCOLS = [PROTOCOL_BINARY, PROTOCOL_JSON]
+FEATURE_DELTA = 'delta'
+FEATURE_BINARY_INPUT = 'binary_input'
+FEATURE_UDP = 'udp'
+SUPPORTED_FEATURES = [FEATURE_DELTA, FEATURE_BINARY_INPUT]
+
+KIND_STATE = b'S'
+KIND_KEYFRAME = b'K'
+KIND_DELTA = b'D'
+KIND_JSON = b'J'
+KIND_INPUT = b'I'
+KIND_REGISTER = b'R'
+
+# Quantization: positions in 1/4 pixel (int16 covers +-8191 px), angles in
+# 1/65536 of a turn.
+POS_SCALE = 4
+POS_LIMIT = 32767
+ANGLE_SCALE = 65536 / 360
+
+# Colours and event types are sent as indices into these tables
+COLOR_NAMES = ['red', 'blue', 'green', 'yellow', 'purple', 'orange', 'cyan', 'magenta',
+               'white', 'npc', 'boss']
+EVENT_TYPES = ['hit', 'explode', 'explode_big', 'boss_attack']
+
+# Header: kind, tick, events, players, npcs, has_boss, bullets.
+# Events come straight after the header so a reader can pull them out of a
+# snapshot without decoding the entity records.
+STATE_HEADER = struct.Struct('<cIHHHBI')
+# Keyframe/delta header: kind, tick, events, base tick, players, removed
+# players, npcs, removed npcs, boss flag, bullets, then for the receiving
+# client: last input seq applied, ticks it has been applied for, speed.
+SNAPSHOT_HEADER = struct.Struct('<cIHIHHHHBIIHf')
+EVENT_RECORD = struct.Struct('<BhhB')            # type, x, y, color
+# Player ids only ever grow while a server runs, so they (and bullet owners)
+# get 32 bits rather than 16
+PLAYER_RECORD = struct.Struct('<IhhHBiii')       # id, x, y, angle, color, hp, max_hp, score
+NPC_RECORD = struct.Struct('<hhHii')             # x, y, angle, hp, max_hp
+NPC_ID_RECORD = struct.Struct('<IhhHii')         # npc_id, x, y, angle, hp, max_hp
+PLAYER_ID = struct.Struct('<I')
+NPC_ID = struct.Struct('<I')
+BULLET_DTYPE = np.dtype([('x', '<i2'), ('y', '<i2'), ('angle', '<u2'), ('owner', '<i4'),
+                         ('id', '<u2')])
+
+# Input packet: kind, seq, key bitmask, acked snapshot tick
+INPUT_RECORD = struct.Struct('<cIBI')
+INPUT_KEYS = ['w', 'a', 's', 'd', 'space']  # Bit i of the mask is INPUT_KEYS[i]
+NO_ACK = 0xFFFFFFFF
+MAX_SEQ = 0xFFFFFFFF  # seq and ack travel as u32, in input packets and snapshot headers
+
+# Longest message a client may send (inputs are 10 bytes, control messages
+# a few hundred); anything longer drops the connection
+MAX_INPUT_FRAME = 4096
+# Longest server message the client accepts (a keyframe with every bullet)
+MAX_SNAPSHOT_FRAME = 16 << 20
+
+# Boss flag in keyframe/delta snapshots
+BOSS_UNCHANGED = 0
+BOSS_NONE = 1
+BOSS_PRESENT = 2
+
+
+def _pos(value):
+    return max(-POS_LIMIT, min(POS_LIMIT, int(round(value * POS_SCALE))))
+
+
+def _angle(value):
+    return int(round((value % 360) * ANGLE_SCALE)) & 0xFFFF
+
+
+def _color(name):
+    try:
+        return COLOR_NAMES.index(name)
+    except ValueError:
+        return COLOR_NAMES.index('white')
+
+
+def quantize_entity(state):
+    """Round an entity's (x, y, angle, ...) tuple to the wire precision.
+
+    Snapshots are quantized before they are compared or encoded, so both
+    encodings carry the same values and sub-quarter-pixel jitter does not
+    make an entity look changed to the delta encoder.
+    """
+    x, y, angle = state[:3]
+    return (round(x * POS_SCALE) / POS_SCALE, round(y * POS_SCALE) / POS_SCALE,
+            (round(angle * ANGLE_SCALE) & 0xFFFF) / ANGLE_SCALE) + tuple(state[3:])
+
+
+def pack_frame(payload):
+    """Prefix a payload with its length."""
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def encode_json_message(msg):
+    """Payload for a JSON control message sent inside a binary frame."""
+    return KIND_JSON + json.dumps(msg).encode()
+
+
+def _encode_events(events):
+    return [EVENT_RECORD.pack(EVENT_TYPES.index(event['type']), _pos(event['x']), _pos(event['y']),
+                              _color(event['color']))
+            for event in events]
+
+
+def _encode_bullets(bullets):
+    xs, ys, angles, owners, ids = bullets
+    records = np.empty(len(xs), dtype=BULLET_DTYPE)
+    records['x'] = np.clip(np.rint(xs * POS_SCALE), -POS_LIMIT, POS_LIMIT)
+    records['y'] = np.clip(np.rint(ys * POS_SCALE), -POS_LIMIT, POS_LIMIT)
+    records['angle'] = np.rint(np.mod(angles, 360) * ANGLE_SCALE).astype(np.int64) & 0xFFFF
+    records['owner'] = owners
+    records['id'] = ids
+    return records.tobytes()
+
+
+def _decode_bullets(payload, offset, count):
+    records = np.frombuffer(payload, dtype=BULLET_DTYPE, count=count, offset=offset)
+    owners = ['boss' if o == BOSS_OWNER else o for o in records['owner'].tolist()]
+    return list(zip((records['x'] / POS_SCALE).tolist(), (records['y'] / POS_SCALE).tolist(),
+                    (records['angle'] / ANGLE_SCALE).tolist(), owners, records['id'].tolist()))
+
+
+def _encode_player(player_id, state):
+    x, y, angle, color, hp, max_hp, score = state
+    return PLAYER_RECORD.pack(int(player_id), _pos(x), _pos(y), _angle(angle), _color(color),
+                              hp, max_hp, score)
+
+
+def _decode_player(payload, offset):
+    player_id, x, y, angle, color, hp, max_hp, score = PLAYER_RECORD.unpack_from(payload, offset)
+    return str(player_id), (x / POS_SCALE, y / POS_SCALE, angle / ANGLE_SCALE,
+                            COLOR_NAMES[color], hp, max_hp, score)
+
+
+def _decode_npc(payload, offset, color):
+    x, y, angle, hp, max_hp = NPC_RECORD.unpack_from(payload, offset)
+    return (x / POS_SCALE, y / POS_SCALE, angle / ANGLE_SCALE, color, hp, max_hp)
+
+
+def encode_state(state, bullets):
+    """Encode a state snapshot as a binary payload.
+
+    state has the same players/npcs/boss/events/tick fields as the JSON
+    snapshot; bullets is an (xs, ys, angles, owners, ids) tuple of NumPy arrays
+    as returned by BulletPool.get_arrays().
+    """
+    players = state['players']
+    npcs = state['npcs']
+    boss = state['boss']
+    events = state['events']
+
+    parts = [STATE_HEADER.pack(KIND_STATE, state.get('tick', 0), len(events), len(players),
+                               len(npcs), boss is not None, len(bullets[0]))]
+    parts.extend(_encode_events(events))
+    for player_id, player_state in players.items():
+        parts.append(_encode_player(player_id, player_state))
+    for x, y, angle, _color_name, hp, max_hp in npcs:
+        parts.append(NPC_RECORD.pack(_pos(x), _pos(y), _angle(angle), hp, max_hp))
+    if boss is not None:
+        x, y, angle, _color_name, hp, max_hp = boss
+        parts.append(NPC_RECORD.pack(_pos(x), _pos(y), _angle(angle), hp, max_hp))
+
+    parts.append(_encode_bullets(bullets))
+    return b''.join(parts)
+
+
+def decode_events(payload):
+    """Decode only the header and event table of a binary snapshot payload."""
+    header = STATE_HEADER if payload[:1] == KIND_STATE else SNAPSHOT_HEADER
+    n_events = header.unpack_from(payload, 0)[2]
+    events = []
+    offset = header.size
+    for _ in range(n_events):
+        type_index, x, y, color = EVENT_RECORD.unpack_from(payload, offset)
+        offset += EVENT_RECORD.size
+        events.append({
+            'type': EVENT_TYPES[type_index],
+            'x': x / POS_SCALE,
+            'y': y / POS_SCALE,
+            'color': COLOR_NAMES[color],
+        })
+    return events
+
+
+def snapshot_ticks(payload):
+    """(tick, base tick) from the header of a binary snapshot payload; base is None unless it is a delta."""
+    if payload[:1] == KIND_STATE:
+        return STATE_HEADER.unpack_from(payload, 0)[1], None
+    kind, tick, _n_events, base = SNAPSHOT_HEADER.unpack_from(payload, 0)[:4]
+    return tick, (base if kind == KIND_DELTA else None)
+
+
+def decode_state(payload):
+    """Decode a binary state payload into the same dict shape as the JSON snapshot."""
+    _kind, tick, n_events, n_players, n_npcs, has_boss, n_bullets = STATE_HEADER.unpack_from(payload, 0)
+    events = decode_events(payload)
+    offset = STATE_HEADER.size + n_events * EVENT_RECORD.size
+
+    players = {}
+    for _ in range(n_players):
+        player_id, player_state = _decode_player(payload, offset)
+        offset += PLAYER_RECORD.size
+        players[player_id] = player_state
+
+    npcs = []
+    for _ in range(n_npcs):
+        npcs.append(_decode_npc(payload, offset, 'npc'))
+        offset += NPC_RECORD.size
+
+    boss = None
+    if has_boss:
+        boss = _decode_npc(payload, offset, 'boss')
+        offset += NPC_RECORD.size
+
+    bullets = _decode_bullets(payload, offset, n_bullets)
+
+    return {
+        'type': 'state',
+        'tick': tick,
+        'players': players,
+        'bullets': bullets,
+        'npcs': npcs,
+        'boss': boss,
+        'events': events,
+    }
+
+
+def encode_snapshot(msg, bullets):
+    """Encode a 'keyframe' or 'delta' message (see snapshots.ClientView)."""
+    is_delta = msg['type'] == 'delta'
+    players = msg['players']
+    npcs = msg['npcs']
+    removed_players = msg.get('removed_players', [])
+    removed_npcs = msg.get('removed_npcs', [])
+
+    if is_delta and 'boss' not in msg:
+        boss_flag = BOSS_UNCHANGED
+    elif msg['boss'] is None:
+        boss_flag = BOSS_NONE
+    else:
+        boss_flag = BOSS_PRESENT
+
+    parts = [SNAPSHOT_HEADER.pack(KIND_DELTA if is_delta else KIND_KEYFRAME, msg['tick'],
+                                  len(msg['events']), msg.get('base', 0), len(players),
+                                  len(removed_players), len(npcs), len(removed_npcs),
+                                  boss_flag, len(bullets[0]), msg.get('input_seq', 0),
+                                  min(msg.get('input_held', 0), 0xFFFF), msg.get('speed', 0.0))]
+    parts.extend(_encode_events(msg['events']))
+    for player_id, player_state in players.items():
+        parts.append(_encode_player(player_id, player_state))
+    for player_id in removed_players:
+        parts.append(PLAYER_ID.pack(int(player_id)))
+    for npc_id, (x, y, angle, _color_name, hp, max_hp) in npcs.items():
+        parts.append(NPC_ID_RECORD.pack(int(npc_id), _pos(x), _pos(y), _angle(angle), hp, max_hp))
+    for npc_id in removed_npcs:
+        parts.append(NPC_ID.pack(int(npc_id)))
+    if boss_flag == BOSS_PRESENT:
+        x, y, angle, _color_name, hp, max_hp = msg['boss']
+        parts.append(NPC_RECORD.pack(_pos(x), _pos(y), _angle(angle), hp, max_hp))
+    parts.append(_encode_bullets(bullets))
+    return b''.join(parts)
+
+
+def decode_snapshot(payload):
+    """Decode a binary keyframe/delta payload back into its message dict."""
+    (kind, tick, n_events, base, n_players, n_removed_players, n_npcs, n_removed_npcs,
+     boss_flag, n_bullets, input_seq, input_held, speed) = SNAPSHOT_HEADER.unpack_from(payload, 0)
+    msg = {
+        'type': 'delta' if kind == KIND_DELTA else 'keyframe',
+        'tick': tick,
+        'events': decode_events(payload),
+        'input_seq': input_seq,
+        'input_held': input_held,
+        'speed': speed,
+    }
+    offset = SNAPSHOT_HEADER.size + n_events * EVENT_RECORD.size
+
+    players = {}
+    for _ in range(n_players):
+        player_id, player_state = _decode_player(payload, offset)
+        offset += PLAYER_RECORD.size
+        players[player_id] = player_state
+    removed_players = []
+    for _ in range(n_removed_players):
+        removed_players.append(str(PLAYER_ID.unpack_from(payload, offset)[0]))
+        offset += PLAYER_ID.size
+
+    npcs = {}
+    for _ in range(n_npcs):
+        npc_id, x, y, angle, hp, max_hp = NPC_ID_RECORD.unpack_from(payload, offset)
+        offset += NPC_ID_RECORD.size
+        npcs[str(npc_id)] = (x / POS_SCALE, y / POS_SCALE, angle / ANGLE_SCALE, 'npc', hp, max_hp)
+    removed_npcs = []
+    for _ in range(n_removed_npcs):
+        removed_npcs.append(str(NPC_ID.unpack_from(payload, offset)[0]))
+        offset += NPC_ID.size
+
+    if boss_flag == BOSS_PRESENT:
+        msg['boss'] = _decode_npc(payload, offset, 'boss')
+        offset += NPC_RECORD.size
+    elif boss_flag == BOSS_NONE:
+        msg['boss'] = None
+
+    msg['players'] = players
+    msg['npcs'] = npcs
+    if kind == KIND_DELTA:
+        msg['base'] = base
+        msg['removed_players'] = removed_players
+        msg['removed_npcs'] = removed_npcs
+    msg['bullets'] = _decode_bullets(payload, offset, n_bullets)
+    return msg
+
+
+def encode_input(inputs, seq, ack=None):
+    """Payload for one input packet: the INPUT_KEYS held in inputs, seq and ack tick."""
+    mask = 0
+    for bit, key in enumerate(INPUT_KEYS):
+        if inputs.get(key):
+            mask |= 1 << bit
+    return INPUT_RECORD.pack(KIND_INPUT, seq, mask, NO_ACK if ack is None else ack)
+
+
+def is_u32(value):
+    """Whether value is an int that fits a u32 field (bools are not)."""
+    return type(value) is int and 0 <= value <= MAX_SEQ
+
+
+def decode_input(payload):
+    """Decode an input packet into the same dict shape as a JSON input message."""
+    _kind, seq, mask, ack = INPUT_RECORD.unpack_from(payload, 0)
+    inputs = {key: bool(mask & (1 << bit)) for bit, key in enumerate(INPUT_KEYS)}
+    inputs['seq'] = seq
+    inputs['ack'] = None if ack == NO_ACK else ack
+    return inputs
+
+
+class InputStream:
+    """Splits the bytes a client sends into decoded messages.
+
+    Starts out reading newline JSON and switches to frames after a hello
+    that asks for binary input (the client switches right after sending
+    it). Invalid JSON, JSON that is not an object and unknown frames are
+    skipped; a message longer than MAX_INPUT_FRAME raises
+    framing.FrameTooLarge.
+    """
+
+    def __init__(self):
+        self.reader = FrameReader(max_frame=MAX_INPUT_FRAME)
+        self.binary = False
+
+    def recv(self, sock):
+        """Read once from sock. Returns the complete messages, or None when the peer closed."""
+        if self.reader.recv_into(sock) == 0:
+            return None
+        return self._messages()
+
+    def feed(self, data):
+        """Add received bytes. Returns the complete messages, in order."""
+        self.reader.feed(data)
+        return self._messages()
+
+    def _messages(self):
+        messages = []
+        while not self.binary:
+            line = self.reader.next_message()
+            if line is None:
+                break
+            if not line.strip():
+                continue
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(msg, dict):
+                continue
+            if msg.get('type') == 'hello' and msg.get(FEATURE_BINARY_INPUT):
+                self.binary = self.reader.framed = True
+            messages.append(msg)
+
+        if self.binary:
+            for payload in self.reader.messages():
+                if payload[:1] == KIND_INPUT:
+                    messages.append(decode_input(payload))
+                elif payload[:1] == KIND_JSON:
+                    try:
+                        msg = json.loads(payload[1:])
+                    except ValueError:
+                        continue
+                    if isinstance(msg, dict):
+                        messages.append(msg)
+        return messages
@@ -0,0 +1,159 @@
+import asyncio
+import socket
+import threading
+from collections import deque
+
+# A client with this many control messages waiting is not reading at all
+MAX_CONTROL_MESSAGES = 64
+
+
+class SendQueue:
+    """Outgoing data for one client, filled by the game loop.
+
+    Control messages (init, protocol ack, ...) are kept in order. Snapshots
+    are not queued: only the newest one is kept, replacing any snapshot the
+    client has not been sent yet, so a slow client receives fewer snapshots
+    instead of older ones. Delta snapshots are built against acknowledged
+    baselines, so skipping some is always safe.
+
+    put_control(barrier=True) marks a change of snapshot encoding: the
+    pending snapshot is dropped and snapshots encoded before the change
+    (with an older epoch) are refused.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.control = deque()
+        self.snapshot = None
+        self.epoch = 0
+        self.closed = False
+        self.dropped = 0  # Snapshots replaced before they were sent
+
+    def put_control(self, data, barrier=False):
+        with self.cond:
+            if self.closed:
+                return
+            overflow = len(self.control) >= MAX_CONTROL_MESSAGES
+            if not overflow:
+                self.control.append(data)
+                if barrier:
+                    self.epoch += 1
+                    self.snapshot = None
+        if overflow:
+            # Not reading at all: drop the connection so the player is removed
+            self.disconnect()
+        else:
+            self._wake()
+
+    def put_snapshot(self, data, epoch):
+        """Make data the next snapshot sent, unless it was encoded before a barrier."""
+        with self.cond:
+            if self.closed or epoch != self.epoch:
+                return
+            if self.snapshot is not None:
+                self.dropped += 1
+            self.snapshot = data
+        self._wake()
+
+    def take(self):
+        """Everything waiting to be written as one buffer (b'' if nothing)."""
+        with self.cond:
+            chunks = list(self.control)
+            self.control.clear()
+            if self.snapshot is not None:
+                chunks.append(self.snapshot)
+                self.snapshot = None
+        return b''.join(chunks)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+        self._wake()
+
+    def disconnect(self):
+        """Close the queue and the connection, so the client's handler removes the player."""
+        self.close()
+        self._drop_connection()
+
+    def _drop_connection(self):
+        pass
+
+    def _wake(self):
+        with self.cond:
+            self.cond.notify()
+
+
+class SocketWriter(SendQueue):
+    """SendQueue drained by its own thread with blocking sendall() calls.
+
+    A stalled client only ever blocks its writer thread; the game loop just
+    replaces the pending snapshot.
+    """
+
+    def __init__(self, sock):
+        super().__init__()
+        self.sock = sock
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.closed and not self.control and self.snapshot is None:
+                    self.cond.wait()
+                if self.closed:
+                    return
+            data = self.take()
+            if not data:
+                continue
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                self.close()
+                return
+
+    def _drop_connection(self):
+        # Wakes the handler's recv() with EOF; the handler closes the socket
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class AsyncWriter(SendQueue):
+    """SendQueue drained by a task on an asyncio event loop.
+
+    The game loop thread wakes the task with call_soon_threadsafe; the task
+    waits for the transport to drain before taking the next snapshot, so at
+    most one snapshot is buffered in asyncio for a slow client.
+    """
+
+    def __init__(self, loop, writer):
+        super().__init__()
+        self.loop = loop
+        self.writer = writer
+        self.ready = asyncio.Event()
+
+    def _wake(self):
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.ready.set)
+
+    def _drop_connection(self):
+        # abort() rather than close(): the client may not be reading at all
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.writer.transport.abort)
+
+    async def run(self):
+        try:
+            while not self.closed:
+                await self.ready.wait()
+                self.ready.clear()
+                data = self.take()
+                if data:
+                    self.writer.write(data)
+                    await self.writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.closed = True
+            self.writer.close()
@@ -1,525 +1,629 @@
-import socket
-import threading
+import argparse
+import asyncio
 import json
-import time
-import random
+import multiprocessing
 import os
-from game_objects import Player, Bullet, MathBullet, NPC, Boss, check_collision, get_distance
+import random
+import socket
+import threading
+from multiprocessing import reduction
+from game_room import (GameRoom, MAX_NPCS, NPC_SPAWN_INTERVAL, VIEW_RADIUS, WORLD_HEIGHT,
+                       WORLD_WIDTH)
+from framing import RECV_SIZE, FrameTooLarge
+from patterns import DEFAULT_EXPRESSION, PatternRegistry
+from protocol import FRAME_HEADER, KIND_DELTA, KIND_KEYFRAME, InputStream
+from send_queue import AsyncWriter, SocketWriter
+from tick_metrics import TickMetrics, metrics_path
+from udp_transport import MAX_DATAGRAM, UDP_TOKEN, make_udp_socket
 
 # Server configuration
 HOST = '0.0.0.0'
 PORT = 9999
-FPS = 60
-FRAME_TIME = 1 / FPS
-SCREEN_WIDTH = 800
-SCREEN_HEIGHT = 600
-
-# Spawning configuration
-MAX_NPCS = 5
-NPC_SPAWN_INTERVAL = 5  # seconds
-
-# Game state
-game_state = {
-    'players': {},  # {player_id: Player object}
-    'bullets': [],  # [Bullet objects]
-    'npcs': [],     # [NPC objects]
-    'boss': None    # Boss object or None
-}
-client_sockets = {}  # {player_id: socket}
-client_inputs = {}   # {player_id: {w, a, s, d, space}}
-frame_events = []    # Events to send to clients this frame
-lock = threading.Lock()
-next_player_id = 0
-next_npc_id = 0
-running = True
-last_npc_spawn = 0
-
-# Boss / checkpoint progression
-boss_level = 1          # Next boss is level 1 (threshold = 10*level)
-checkpoint_score = 0    # Server-wide checkpoint restored on player death
+TICK_RATE = 60       # Simulation ticks per second (fixed timestep)
+SNAPSHOT_RATE = 30   # Snapshots sent to clients per second
+MAX_CATCH_UP_TICKS = 5  # Ticks run back to back after a stall before dropping the backlog
+WRITER_CLOSE_TIMEOUT = 2.0  # Seconds a leaving client gets to take its last snapshot
+
+# Optional UDP channel for snapshots and inputs (see udp_transport.py),
+# enabled with --udp. Loss and latency are simulated on outgoing datagrams.
+UDP_ENABLED = False
+UDP_LOSS = 0.0
+UDP_LATENCY = 0.0
+
+# Sharding (--workers): a lobby process accepts connections and hands them
+# to rooms of at most ROOM_SIZE players, run by WORKERS worker processes.
+# With WORKERS = 0 everyone plays in a single room in this process.
+WORKERS = 0
+ROOM_SIZE = 8
+
+# Publish per-phase tick timings for the admin web app (see tick_metrics.py)
+METRICS_ENABLED = True
 
 # Bullet pattern configuration
 PATTERN_FILE = "pattern.json"
-DEFAULT_EXPRESSION = "50 * math.sin(x / 10)"
-current_expression = DEFAULT_EXPRESSION
-
-# Player colors
-COLORS = ['red', 'blue', 'green', 'yellow', 'purple', 'orange', 'cyan', 'magenta']
-
+pattern_registry = PatternRegistry(PATTERN_FILE, DEFAULT_EXPRESSION)  # Watched in the background
 
-def add_event(event_type, x, y, color='white'):
-    """Add an event to be sent to clients."""
-    frame_events.append({
-        'type': event_type,
-        'x': x,
-        'y': y,
-        'color': color
-    })
-
-
-def get_total_score():
-    """Calculate total score of all players."""
-    return sum(p.score for p in game_state['players'].values())
-
-
-def find_nearest_player(x, y):
-    """Find the nearest player to the given position."""
-    nearest = None
-    min_dist = float('inf')
-
-    for player in game_state['players'].values():
-        dist = get_distance(x, y, player.x, player.y)
-        if dist < min_dist:
-            min_dist = dist
-            nearest = player
-
-    return nearest
-
-
-def load_pattern():
-    """Load bullet pattern expression from pattern.json (written by web app)."""
-    global current_expression
-    try:
-        if os.path.exists(PATTERN_FILE):
-            with open(PATTERN_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            expr = data.get('expression', DEFAULT_EXPRESSION)
-            if expr != current_expression:
-                current_expression = expr
-                print(f"Loaded new bullet pattern: {data.get('name', '?')} -> {expr}")
-    except Exception as e:
-        print(f"Error loading pattern.json: {e}")
-
-
-def spawn_npc():
-    """Spawn a new NPC at a random edge of the screen."""
-    global next_npc_id
-
-    if len(game_state['npcs']) >= MAX_NPCS:
-        return
-
-    # Spawn at random edge
-    edge = random.choice(['top', 'bottom', 'left', 'right'])
-    if edge == 'top':
-        x, y = random.randint(50, SCREEN_WIDTH - 50), 10
-    elif edge == 'bottom':
-        x, y = random.randint(50, SCREEN_WIDTH - 50), SCREEN_HEIGHT - 10
-    elif edge == 'left':
-        x, y = 10, random.randint(50, SCREEN_HEIGHT - 50)
-    else:
-        x, y = SCREEN_WIDTH - 10, random.randint(50, SCREEN_HEIGHT - 50)
+running = True
+room = None  # The GameRoom when not sharding
 
-    npc = NPC(x, y, next_npc_id)
-    game_state['npcs'].append(npc)
-    next_npc_id += 1
-    print(f"NPC {npc.npc_id} spawned at ({x:.0f}, {y:.0f})")
 
+def new_room(room_id=None, udp=None):
+    """A GameRoom using the server configuration."""
+    metrics = None
+    if METRICS_ENABLED:
+        phases = [name for name, _ in GameRoom.PHASES] + GameRoom.BROADCAST_PHASES
+        # Rooms of a sharded server come and go; their files go with them
+        metrics = TickMetrics(metrics_path(room_id), phases, TICK_RATE,
+                              remove_on_close=room_id is not None)
+    return GameRoom(room_id, tick_rate=TICK_RATE, snapshot_rate=SNAPSHOT_RATE,
+                    max_catch_up=MAX_CATCH_UP_TICKS, patterns=pattern_registry, udp=udp,
+                    metrics=metrics)
 
-def spawn_boss():
-    """Spawn the boss at the center top of the screen.
-    Uses boss_level to scale HP (500 * 2^(level-1)).
-    """
-    if game_state['boss'] is not None:
-        return
 
-    boss = Boss(SCREEN_WIDTH // 2, 50, 999, level=boss_level)
-    game_state['boss'] = boss
-    print("=" * 40)
-    print(f"  BOSS LEVEL {boss_level} HAS SPAWNED!  (HP: {boss.max_hp})")
-    print("=" * 40)
-
-
-def handle_body_collisions():
-    """Handle Player vs Enemy body collisions (crash damage)."""
-    import math
-
-    for player_id, player in game_state['players'].items():
-        # === Player vs NPC collision ===
-        for npc in game_state['npcs'][:]:
-            if check_collision(player, npc):
-                # Player takes 30 crash damage
-                is_player_dead = player.take_damage(30)
-                add_event('hit', player.x, player.y, player.color)
-                print(f"Player {player_id} crashed into NPC! -30 HP")
-
-                # Kill the NPC immediately
-                add_event('explode', npc.x, npc.y, 'npc')
-                game_state['npcs'].remove(npc)
-                print(f"NPC destroyed by collision!")
-
-                # Check if player died from crash
-                if is_player_dead:
-                    add_event('explode', player.x, player.y, player.color)
-                    spawn_x = random.randint(100, SCREEN_WIDTH - 100)
-                    spawn_y = random.randint(100, SCREEN_HEIGHT - 100)
-                    player.respawn(spawn_x, spawn_y)
-                    print(f"Player {player_id} died from crash and respawned!")
-
-        # === Player vs Boss collision ===
-        if game_state['boss'] is not None:
-            boss = game_state['boss']
-            if check_collision(player, boss):
-                # Player takes 50 massive crash damage
-                is_player_dead = player.take_damage(50)
-                add_event('hit', player.x, player.y, player.color)
-                print(f"Player {player_id} crashed into BOSS! -50 HP")
-
-                # Knockback player away from boss to prevent getting stuck
-                dx = player.x - boss.x
-                dy = player.y - boss.y
-                dist = math.sqrt(dx * dx + dy * dy)
-                if dist > 0:
-                    # Push player backwards
-                    knockback_strength = 50
-                    player.x += (dx / dist) * knockback_strength
-                    player.y += (dy / dist) * knockback_strength
-
-                    # Keep player on screen
-                    player.x = max(20, min(SCREEN_WIDTH - 20, player.x))
-                    player.y = max(20, min(SCREEN_HEIGHT - 20, player.y))
-
-                # Check if player died from crash
-                if is_player_dead:
-                    add_event('explode', player.x, player.y, player.color)
-                    spawn_x = random.randint(100, SCREEN_WIDTH - 100)
-                    spawn_y = random.randint(100, SCREEN_HEIGHT - 100)
-                    player.respawn(spawn_x, spawn_y)
-                    print(f"Player {player_id} died from Boss crash and respawned!")
-
-
-def handle_collisions():
-    """Handle all bullet collision logic with explosion events."""
-    global boss_level, checkpoint_score
-    bullets_to_remove = []
-
-    for bullet in game_state['bullets']:
-        # Bullet vs Player collision
-        for player_id, player in game_state['players'].items():
-            # Don't hit yourself (players can't hit themselves)
-            if bullet.owner_id == player_id:
-                continue
-            if check_collision(bullet, player):
-                is_dead = player.take_damage(bullet.damage)
-                bullets_to_remove.append(bullet)
-
-                # Add hit event for screen shake
-                add_event('hit', player.x, player.y, player.color)
-                print(f"Player {player_id} hit! HP: {player.hp}")
-
-                if is_dead:
-                    # Add explosion event
-                    add_event('explode', player.x, player.y, player.color)
-                    # Respawn player and reset score
-                    spawn_x = random.randint(100, SCREEN_WIDTH - 100)
-                    spawn_y = random.randint(100, SCREEN_HEIGHT - 100)
-                    player.respawn(spawn_x, spawn_y)
-                    print(f"Player {player_id} died and respawned!")
-                break
+def is_control_message(msg):
+    """Whether a client message needs the room's lock (anything but an input packet)."""
+    return msg.get('type') is not None
 
-        # Bullet vs NPC collision
-        for npc in game_state['npcs'][:]:
-            if bullet in bullets_to_remove:
-                break
-            if check_collision(bullet, npc):
-                is_dead = npc.take_damage(bullet.damage)
-                bullets_to_remove.append(bullet)
-
-                if is_dead:
-                    # Add explosion event for NPC death
-                    add_event('explode', npc.x, npc.y, 'npc')
-                    game_state['npcs'].remove(npc)
-                    # Give score to shooter if it's a player
-                    if bullet.owner_id in game_state['players']:
-                        game_state['players'][bullet.owner_id].score += 1
-                        print(f"Player {bullet.owner_id} killed NPC! Score: {game_state['players'][bullet.owner_id].score}")
-                break
 
-        # Bullet vs Boss collision
-        if game_state['boss'] is not None and bullet not in bullets_to_remove:
-            if check_collision(bullet, game_state['boss']):
-                is_dead = game_state['boss'].take_damage(bullet.damage)
-                bullets_to_remove.append(bullet)
-
-                if is_dead:
-                    # Add big explosion event for Boss death
-                    add_event('explode_big', game_state['boss'].x, game_state['boss'].y, 'boss')
-                    # Give score to shooter
-                    if bullet.owner_id in game_state['players']:
-                        game_state['players'][bullet.owner_id].score += 5
-                        print(f"Player {bullet.owner_id} killed the BOSS! +5 Score!")
-                    game_state['boss'] = None
-
-                    # Advance checkpoint to the threshold we just cleared
-                    checkpoint_score = 10 * boss_level
-                    for p in game_state['players'].values():
-                        p.checkpoint_score = checkpoint_score
-                    print(f"BOSS LEVEL {boss_level} DEFEATED! Checkpoint updated to {checkpoint_score}.")
-                    boss_level += 1
-
-    # Remove hit bullets
-    for bullet in bullets_to_remove:
-        if bullet in game_state['bullets']:
-            game_state['bullets'].remove(bullet)
-
-
-def handle_client(client_socket, player_id):
+def handle_client(room, client_socket, player_id):
     """Handle individual client connection using threading."""
-    global running
+    room.log(f"Player {player_id} connected")
 
-    print(f"Player {player_id} connected")
+    stream = InputStream()
 
-    # Send player their ID and color
-    try:
-        init_msg = json.dumps({
-            'type': 'init',
-            'id': player_id,
-            'color': COLORS[player_id % len(COLORS)]
-        })
-        client_socket.send(init_msg.encode() + b'\n')
-    except Exception as e:
-        print(f"Error sending init to player {player_id}: {e}")
-        return
-
-    buffer = ""
-    last_shoot = False
-
-    while running:
+    while running and room.running:
         try:
-            data = client_socket.recv(1024).decode()
-            if not data:
+            messages = stream.recv(client_socket)
+            if messages is None:
                 break
 
-            buffer += data
-            while '\n' in buffer:
-                line, buffer = buffer.split('\n', 1)
-                if line:
-                    try:
-                        inputs = json.loads(line)
-                        with lock:
-                            client_inputs[player_id] = inputs
-
-                            # Handle Space input to spawn MathBullet
-                            shoot_now = inputs.get('space', False)
-                            if shoot_now and not last_shoot and player_id in game_state['players']:
-                                player = game_state['players'][player_id]
-                                load_pattern()
-                                bullet = MathBullet(
-                                    player.x, player.y, player.angle,
-                                    owner_id=player_id,
-                                    expression=current_expression
-                                )
-                                game_state['bullets'].append(bullet)
-                            last_shoot = shoot_now
-                    except json.JSONDecodeError:
-                        pass
+            for msg in messages:
+                if is_control_message(msg):
+                    with room.lock:
+                        room.apply_client_message(player_id, msg)
+                else:
+                    room.queue_input(player_id, msg)
         except ConnectionResetError:
             break
+        except FrameTooLarge as e:
+            room.log(f"Dropping player {player_id}: {e}")
+            break
         except Exception as e:
-            print(f"Error receiving from player {player_id}: {e}")
+            room.log(f"Error receiving from player {player_id}: {e}")
             break
 
     # Cleanup on disconnect
-    with lock:
-        if player_id in game_state['players']:
-            del game_state['players'][player_id]
-        if player_id in client_sockets:
-            del client_sockets[player_id]
-        if player_id in client_inputs:
-            del client_inputs[player_id]
+    room.remove_player(player_id)
 
     try:
         client_socket.close()
     except:
         pass
 
-    print(f"Player {player_id} disconnected")
-
-
-def game_loop():
-    """Game Loop running at 60 FPS with spawning and collision logic."""
-    global last_npc_spawn, frame_events
-
-    while running:
-        start_time = time.time()
-
-        with lock:
-            # Clear events from previous frame
-            frame_events = []
-
-            # === SPAWNING LOGIC ===
-            if len(game_state['players']) > 0:
-                total = get_total_score()
-                boss_threshold = 10 * boss_level  # 10, 20, 30, ...
-
-                if total >= boss_threshold and game_state['boss'] is None:
-                    spawn_boss()
-
-                # Solo Boss: only spawn NPCs when boss is NOT active
-                if game_state['boss'] is None:
-                    if time.time() - last_npc_spawn > NPC_SPAWN_INTERVAL:
-                        spawn_npc()
-                        last_npc_spawn = time.time()
-
-            # === UPDATE PLAYERS ===
-            for player_id, player in game_state['players'].items():
-                inputs = client_inputs.get(player_id, {})
-                player.move(inputs)
-
-                # Wrap around screen edges
-                player.x = player.x % SCREEN_WIDTH
-                player.y = player.y % SCREEN_HEIGHT
-
-            # === UPDATE NPCs (move towards nearest player) ===
-            for npc in game_state['npcs']:
-                nearest = find_nearest_player(npc.x, npc.y)
-                if nearest:
-                    npc.move_towards_target(nearest.x, nearest.y)
-
-                # Keep NPCs on screen
-                npc.x = max(10, min(SCREEN_WIDTH - 10, npc.x))
-                npc.y = max(10, min(SCREEN_HEIGHT - 10, npc.y))
-
-            # === UPDATE BOSS ===
-            if game_state['boss'] is not None:
-                boss = game_state['boss']
-                nearest = find_nearest_player(boss.x, boss.y)
-                if nearest:
-                    boss.move_towards_target(nearest.x, nearest.y)
-
-                # Keep Boss on screen
-                boss.x = max(50, min(SCREEN_WIDTH - 50, boss.x))
-                boss.y = max(50, min(SCREEN_HEIGHT - 50, boss.y))
-
-                # === BOSS ATTACK: Fire 8 bullets every 2 seconds ===
-                if boss.update_attack():
-                    bullet_data_list = boss.get_attack_bullets()
-                    for bdata in bullet_data_list:
-                        bullet = Bullet(
-                            bdata['x'], bdata['y'], bdata['angle'],
-                            owner_id=bdata['owner_id'],
-                            speed=bdata['speed'],
-                            damage=bdata['damage']
-                        )
-                        game_state['bullets'].append(bullet)
-                    # Add boss attack event
-                    add_event('boss_attack', boss.x, boss.y, 'boss')
-                    print("Boss fired!")
-
-            # === UPDATE BULLETS ===
-            for bullet in game_state['bullets']:
-                bullet.move()
-
-            # Remove out-of-bounds bullets
-            game_state['bullets'] = [
-                b for b in game_state['bullets']
-                if not b.is_out_of_bounds(SCREEN_WIDTH, SCREEN_HEIGHT)
-            ]
-
-            # === COLLISION LOGIC ===
-            handle_collisions()        # Bullet collisions
-            handle_body_collisions()   # Player vs Enemy body collisions
-
-            # === PREPARE BROADCAST STATE ===
-            broadcast_state = {
-                'type': 'state',
-                'players': {
-                    str(pid): p.get_state() for pid, p in game_state['players'].items()
-                },
-                'bullets': [
-                    (b.x, b.y, b.angle, b.owner_id) for b in game_state['bullets']
-                ],
-                'npcs': [
-                    npc.get_state() for npc in game_state['npcs']
-                ],
-                'boss': game_state['boss'].get_state() if game_state['boss'] else None,
-                'events': frame_events  # Send events to clients
-            }
-
-            # Broadcast to all clients
-            state_json = json.dumps(broadcast_state) + '\n'
-            disconnected = []
-            for player_id, sock in client_sockets.items():
-                try:
-                    sock.send(state_json.encode())
-                except:
-                    disconnected.append(player_id)
 
-            for player_id in disconnected:
-                if player_id in client_sockets:
-                    del client_sockets[player_id]
+async def handle_client_async(room, reader, writer):
+    """Handle one client on the asyncio event loop.
 
-        # Maintain 60 FPS
-        elapsed = time.time() - start_time
-        sleep_time = FRAME_TIME - elapsed
-        if sleep_time > 0:
-            time.sleep(sleep_time)
+    Input packets are queued directly; control messages are queued for the
+    game loop, which applies them at the start of its next tick, so the
+    event loop never waits on the world lock.
+    """
+    sender = AsyncWriter(asyncio.get_running_loop(), writer)
+    writer_task = asyncio.create_task(sender.run())
+    player_id = room.add_player(sender, writer.get_extra_info('peername'))
+    stream = InputStream()
 
+    try:
+        while running:
+            data = await reader.read(RECV_SIZE)
+            if not data:
+                break
+            for msg in stream.feed(data):
+                if is_control_message(msg):
+                    room.client_messages.put((player_id, msg))
+                else:
+                    room.queue_input(player_id, msg)
+    except ConnectionError as e:
+        room.log(f"Error receiving from player {player_id}: {e}")
+    except FrameTooLarge as e:
+        room.log(f"Dropping player {player_id}: {e}")
+    finally:
+        room.remove_player(player_id)
+        try:
+            await asyncio.wait_for(writer_task, WRITER_CLOSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Stuck in drain() on a client that stopped reading: drop what is buffered
+            writer.transport.abort()
 
-def start_server():
-    """Setup TCP Socket server."""
-    global next_player_id, running, last_npc_spawn
 
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind((HOST, PORT))
-    server_socket.listen(8)
-    server_socket.settimeout(1.0)
+# === UDP ===
+
+class UdpEndpoint:
+    """The UDP socket shared by every room in this process (see udp_transport.py).
+
+    Datagrams start with the token the client got in its init message; the
+    token says which room and player they belong to.
+    """
+
+    def __init__(self, sock, port):
+        self.sock = sock
+        self.port = port
+        self.tokens = {}  # {token: (room, player_id)}
+
+    def new_token(self, room, player_id):
+        token = random.getrandbits(32)
+        while token in self.tokens:
+            token = random.getrandbits(32)
+        self.tokens[token] = (room, player_id)
+        return token
 
-    last_npc_spawn = time.time()
+    def forget_token(self, token):
+        self.tokens.pop(token, None)
 
+    def run(self):
+        """Receive registrations and input packets and pass them to their room."""
+        while running:
+            try:
+                data, address = self.sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+
+            if len(data) <= UDP_TOKEN.size:
+                continue
+            owner = self.tokens.get(UDP_TOKEN.unpack_from(data, 0)[0])
+            if owner is not None:
+                owner[0].handle_datagram(owner[1], data[UDP_TOKEN.size:], address)
+
+    def send_snapshot(self, data, address):
+        """Send a framed keyframe/delta over UDP. Returns False if it has to go over TCP."""
+        payload = data[FRAME_HEADER.size:]
+        if len(payload) > MAX_DATAGRAM or payload[:1] not in (KIND_KEYFRAME, KIND_DELTA):
+            return False
+        try:
+            self.sock.sendto(payload, address)
+        except OSError:
+            return False
+        return True
+
+    def close(self):
+        self.sock.close()
+
+
+def start_udp(port):
+    """Open a UDP socket on port and start receiving on it. Returns the UdpEndpoint."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((HOST, port))
+    sock.settimeout(1.0)
+    udp = UdpEndpoint(make_udp_socket(sock, loss=UDP_LOSS, latency=UDP_LATENCY), port)
+    threading.Thread(target=udp.run, daemon=True).start()
+    print(f"UDP snapshots enabled on port {port}"
+          + (f" (simulating {UDP_LOSS:.0%} loss, {UDP_LATENCY * 1000:.0f} ms latency)"
+             if UDP_LOSS or UDP_LATENCY else ""))
+    return udp
+
+
+def print_banner():
     print("=" * 40)
     print("  MULTIPLAYER DOGFIGHT SERVER")
     print("  With NPCs, Boss Attacks & Effects!")
     print("=" * 40)
     print(f"Server started on {HOST}:{PORT}")
+    print(f"World size: {WORLD_WIDTH}x{WORLD_HEIGHT} (view radius {VIEW_RADIUS})")
+    print(f"Simulation: {TICK_RATE} ticks/s, snapshots: {SNAPSHOT_RATE}/s")
     print(f"NPC spawn interval: {NPC_SPAWN_INTERVAL}s (max {MAX_NPCS})")
     print(f"Boss spawns at total score thresholds: 10, 20, 30, ...")
+    if WORKERS:
+        print(f"Rooms of up to {ROOM_SIZE} players on {WORKERS} worker processes")
     print("Waiting for players...")
     print()
 
+
+def start_server():
+    """Setup TCP Socket server."""
+    global running, room
+
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind((HOST, PORT))
+    server_socket.listen(8)
+    server_socket.settimeout(1.0)
+
+    pattern_registry.start()
+    print_banner()
+    udp = start_udp(PORT) if UDP_ENABLED else None
+
     # Start game loop in separate thread
-    game_thread = threading.Thread(target=game_loop, daemon=True)
-    game_thread.start()
+    room = new_room(udp=udp)
+    room.start()
 
     try:
         while running:
             try:
                 client_socket, address = server_socket.accept()
-                player_id = next_player_id
-                next_player_id += 1
-
-                # Create player with spawn position
-                spawn_x = 100 + (player_id * 150) % (SCREEN_WIDTH - 200)
-                spawn_y = 100 + (player_id * 100) % (SCREEN_HEIGHT - 200)
-                color = COLORS[player_id % len(COLORS)]
-
-                with lock:
-                    player = Player(spawn_x, spawn_y, color)
-                    player.checkpoint_score = checkpoint_score
-                    player.score = checkpoint_score
-                    game_state['players'][player_id] = player
-                    client_sockets[player_id] = client_socket
-                    client_inputs[player_id] = {}
+                player_id = room.add_player(SocketWriter(client_socket), address)
 
                 # Handle client in new thread
                 client_thread = threading.Thread(
                     target=handle_client,
-                    args=(client_socket, player_id),
+                    args=(room, client_socket, player_id),
                     daemon=True
                 )
                 client_thread.start()
 
-                print(f"Player {player_id} ({color}) joined from {address}")
+            except socket.timeout:
+                continue
+    except KeyboardInterrupt:
+        print("\nShutting down server...")
+        running = False
+    finally:
+        room.stop()
+        pattern_registry.stop()
+        server_socket.close()
+        if udp is not None:
+            udp.close()
+        print("Server closed.")
+
+
+def start_async_server():
+    """Serve all clients from one asyncio event loop instead of a thread each.
+
+    The simulation still runs in its own thread (GameRoom.run); client input
+    is handed to it through the room's client_messages queue and snapshots
+    are handed back through each client's AsyncWriter. The wire protocol is
+    unchanged.
+    """
+    global running, room
+
+    pattern_registry.start()
+
+    async def serve():
+        server = await asyncio.start_server(lambda reader, writer: handle_client_async(room, reader, writer),
+                                            HOST, PORT, reuse_address=True, backlog=256)
+        print_banner()
+        print("Using asyncio networking")
+        async with server:
+            while running:
+                await asyncio.sleep(0.5)
+
+    udp = start_udp(PORT) if UDP_ENABLED else None
+    room = new_room(udp=udp)
+    room.start()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print("\nShutting down server...")
+    finally:
+        running = False
+        room.stop()
+        pattern_registry.stop()
+        if udp is not None:
+            udp.close()
+        print("Server closed.")
+
+
+# === SHARDING ===
+
+def worker_main(worker_index, conn, settings):
+    """Entry point of a worker process: run the rooms the lobby assigns to it.
+
+    The lobby sends ('join', room_id, address) followed by the client's
+    socket (see multiprocessing.reduction.send_handle), ('close', room_id)
+    once a room is empty, and ('stop',) on shutdown. The worker answers
+    ('left', room_id) whenever a client disconnects.
+    """
+    global running, TICK_RATE, SNAPSHOT_RATE, UDP_ENABLED, UDP_LOSS, UDP_LATENCY, METRICS_ENABLED
+
+    TICK_RATE = settings['tick_rate']
+    SNAPSHOT_RATE = settings['snapshot_rate']
+    UDP_ENABLED = settings['udp']
+    UDP_LOSS = settings['udp_loss']
+    UDP_LATENCY = settings['udp_latency']
+    METRICS_ENABLED = settings['metrics']
+
+    pattern_registry.start()
+    udp = start_udp(settings['udp_port']) if UDP_ENABLED else None
+    rooms = {}  # {room_id: GameRoom}
+    send_lock = threading.Lock()
+
+    def serve(room, client_socket, player_id):
+        handle_client(room, client_socket, player_id)
+        try:
+            with send_lock:
+                conn.send(('left', room.room_id))
+        except OSError:
+            pass
+
+    try:
+        while running:
+            msg = conn.recv()
+            if msg[0] == 'join':
+                _, room_id, address = msg
+                client_socket = socket.socket(fileno=reduction.recv_handle(conn))
+                room = rooms.get(room_id)
+                if room is None:
+                    room = rooms[room_id] = new_room(room_id, udp)
+                    room.start()
+                    print(f"Worker {worker_index}: opened room {room_id}")
+                player_id = room.add_player(SocketWriter(client_socket), address)
+                threading.Thread(target=serve, args=(room, client_socket, player_id),
+                                 daemon=True).start()
+            elif msg[0] == 'close':
+                room = rooms.pop(msg[1], None)
+                if room is not None:
+                    room.stop()
+                    print(f"Worker {worker_index}: closed room {msg[1]}")
+            elif msg[0] == 'stop':
+                break
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        running = False
+        for room in rooms.values():
+            room.stop()
+        for room in rooms.values():
+            room.thread.join(timeout=1)  # Lets it close its metrics file
+        pattern_registry.stop()
+        if udp is not None:
+            udp.close()
+
+
+class Lobby:
+    """Assigns connections to rooms and hands them to the worker processes.
+
+    A new connection joins the fullest room that still has space, so
+    matches fill up; when every room is full, a new one is opened on the
+    worker with the fewest players. Rooms never move between workers and
+    share nothing, so the number of matches scales with the number of
+    workers (one per core).
+
+    A worker that dies takes its rooms with it: they are forgotten and a
+    new process is started in its place. Until then no connection is
+    assigned to it.
+    """
+
+    def __init__(self, workers, room_size):
+        self.room_size = room_size
+        self.workers = [None] * workers   # [(Process, Connection)]
+        self.alive = [False] * workers
+        self.worker_players = [0] * workers
+        self.rooms = {}          # {room_id: [worker index, players]}
+        self.next_room_id = 0
+        self.stopping = False
+        self.lock = threading.Lock()  # Guards the counts and sends to the workers
+
+    def start(self):
+        for index in range(len(self.workers)):
+            self._spawn(index)
+
+    def _spawn(self, index):
+        """Start (or restart) worker process index and the thread reading its messages.
+
+        Called without the lock: starting a process takes a while and
+        hand_off must not wait for it.
+        """
+        conn, child_conn = multiprocessing.Pipe()
+        settings = {
+            'tick_rate': TICK_RATE,
+            'snapshot_rate': SNAPSHOT_RATE,
+            'udp': UDP_ENABLED,
+            'udp_loss': UDP_LOSS,
+            'udp_latency': UDP_LATENCY,
+            'udp_port': PORT + index,  # The lobby itself has no UDP socket
+            'metrics': METRICS_ENABLED,
+        }
+        process = multiprocessing.Process(target=worker_main, args=(index, child_conn, settings),
+                                          daemon=True)
+        process.start()
+        child_conn.close()
+        with self.lock:
+            self.workers[index] = (process, conn)
+            self.alive[index] = True
+            if self.stopping:  # stop() came while this process was starting
+                try:
+                    conn.send(('stop',))
+                except OSError:
+                    pass
+        threading.Thread(target=self._read_worker, args=(index, conn), daemon=True).start()
+
+    def assign(self):
+        """Pick a room for a new player on a live worker.
+
+        Returns (room_id, worker index), or None if no worker is alive.
+        Caller must hold the lock.
+        """
+        open_rooms = [(players, room_id) for room_id, (index, players) in self.rooms.items()
+                      if players < self.room_size and self.alive[index]]
+        if open_rooms:
+            room_id = max(open_rooms)[1]
+        else:
+            live = [(players, index) for index, players in enumerate(self.worker_players)
+                    if self.alive[index]]
+            if not live:
+                return None
+            room_id = self.next_room_id
+            self.next_room_id += 1
+            self.rooms[room_id] = [min(live)[1], 0]
+        self.rooms[room_id][1] += 1
+        index = self.rooms[room_id][0]
+        self.worker_players[index] += 1
+        return room_id, index
+
+    def hand_off(self, client_socket, address):
+        """Send a new connection to its room's worker. The lobby's copy of the socket is closed.
+
+        If the worker cannot be reached, the connection is tried on another
+        one; if none is left, the client is told to try again later.
+        """
+        with self.lock:
+            placement = self.assign()
+            while placement is not None:
+                room_id, index = placement
+                process, conn = self.workers[index]
+                try:
+                    conn.send(('join', room_id, address))
+                    reduction.send_handle(conn, client_socket.fileno(), process.pid)
+                    print(f"Connection from {address} -> room {room_id} (worker {index})")
+                    break
+                except OSError as e:
+                    print(f"Worker {index} unavailable: {e}")
+                    self.alive[index] = False  # Its reader thread restarts it
+                    self.rooms[room_id][1] -= 1
+                    self.worker_players[index] -= 1
+                    placement = self.assign()
+            else:
+                print(f"Connection from {address} refused: no worker available")
+                refuse(client_socket, "No game room available, try again shortly")
+        client_socket.close()
+
+    def _worker_died(self, index, conn):
+        """Forget a dead worker's rooms and start a new process in its place.
+
+        Only the bookkeeping happens under the lock; once the worker is
+        marked dead no connection is sent to it, so the cleanup and the
+        restart run while hand_off carries on with the other workers.
+        """
+        with self.lock:
+            if self.stopping or self.workers[index][1] is not conn:
+                return
+            process = self.workers[index][0]
+            lost = [room_id for room_id, (worker, _) in self.rooms.items() if worker == index]
+            for room_id in lost:
+                del self.rooms[room_id]
+            self.worker_players[index] = 0
+            self.alive[index] = False
+
+        process.join(timeout=1)
+        conn.close()
+        if METRICS_ENABLED:
+            for room_id in lost:
+                try:
+                    os.remove(metrics_path(room_id))
+                except OSError:
+                    pass
+        print(f"Worker {index} died (exit code {process.exitcode}), rooms lost: {lost}; restarting it")
+        self._spawn(index)
+
+    def _read_worker(self, index, conn):
+        """Track departures reported by a worker; tell it to close rooms that empty."""
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                self._worker_died(index, conn)
+                return
+            if msg[0] != 'left':
+                continue
+            with self.lock:
+                self.worker_players[index] -= 1
+                entry = self.rooms.get(msg[1])
+                if entry is None:
+                    continue
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.rooms[msg[1]]
+                    try:
+                        conn.send(('close', msg[1]))
+                    except OSError:
+                        pass  # Worker gone; the next recv notices
+
+    def stop(self):
+        with self.lock:
+            self.stopping = True
+            for process, conn in self.workers:
+                try:
+                    conn.send(('stop',))
+                except OSError:
+                    pass
+        for process, conn in self.workers:
+            process.join(timeout=2)
+            if process.is_alive():
+                process.terminate()
+
+
+def refuse(client_socket, reason):
+    """Tell a client we cannot take it (an 'error' message in the initial newline JSON)."""
+    try:
+        client_socket.sendall((json.dumps({'type': 'error', 'message': reason}) + '\n').encode())
+    except OSError:
+        pass
+
+
+def start_lobby():
+    """Accept connections and distribute them over rooms in WORKERS processes."""
+    global running
+
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind((HOST, PORT))
+    server_socket.listen(64)
+    server_socket.settimeout(1.0)
+
+    print_banner()
+    lobby = Lobby(WORKERS, ROOM_SIZE)
+    lobby.start()
 
+    try:
+        while running:
+            try:
+                client_socket, address = server_socket.accept()
+                lobby.hand_off(client_socket, address)
             except socket.timeout:
                 continue
     except KeyboardInterrupt:
         print("\nShutting down server...")
         running = False
     finally:
+        lobby.stop()
         server_socket.close()
         print("Server closed.")
 
 
+def main():
+    global TICK_RATE, SNAPSHOT_RATE, UDP_ENABLED, UDP_LOSS, UDP_LATENCY, WORKERS, ROOM_SIZE
+    global METRICS_ENABLED
+
+    parser = argparse.ArgumentParser(description="Multiplayer dogfight server")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="serve clients from an asyncio event loop instead of one thread each")
+    parser.add_argument('--tick-rate', type=int, default=TICK_RATE,
+                        help="simulation ticks per second (default: %(default)s)")
+    parser.add_argument('--snapshot-rate', type=int, default=SNAPSHOT_RATE,
+                        help="snapshots sent to clients per second (default: %(default)s)")
+    parser.add_argument('--udp', action='store_true',
+                        help="offer clients a UDP channel for snapshots and inputs")
+    parser.add_argument('--udp-loss', type=float, default=UDP_LOSS,
+                        help="simulated loss rate for outgoing UDP datagrams (0-1)")
+    parser.add_argument('--udp-latency', type=float, default=UDP_LATENCY,
+                        help="simulated latency for outgoing UDP datagrams (seconds)")
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help="run rooms in this many worker processes behind a lobby "
+                             "(0: a single room in this process)")
+    parser.add_argument('--room-size', type=int, default=ROOM_SIZE,
+                        help="players per room when using workers (default: %(default)s)")
+    parser.add_argument('--no-metrics', dest='metrics', action='store_false',
+                        help="do not publish tick timings for the admin web app")
+    args = parser.parse_args()
+    if args.use_async and args.workers:
+        parser.error("--async cannot be combined with --workers")
+    TICK_RATE = args.tick_rate
+    SNAPSHOT_RATE = args.snapshot_rate
+    UDP_ENABLED = args.udp
+    UDP_LOSS = args.udp_loss
+    UDP_LATENCY = args.udp_latency
+    WORKERS = args.workers
+    ROOM_SIZE = args.room_size
+    METRICS_ENABLED = args.metrics
+
+    if WORKERS:
+        start_lobby()
+    elif args.use_async:
+        start_async_server()
+    else:
+        start_server()
+
+
 if __name__ == '__main__':
-    start_server()
+    main()
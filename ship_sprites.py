@@ -0,0 +1,85 @@
+import math
+import pygame
+
+# Rotations rendered per ship, 3 degrees apart. Players turn in 5 degree
+# steps, but NPCs and interpolated angles can take any value.
+ANGLE_STEPS = 120
+# Ships are drawn this many times larger and scaled down, for antialiasing
+SUPERSAMPLE = 4
+OUTLINE_WIDTH = 2
+WING_ANGLE = 140    # Degrees from the nose to each wing tip
+WING_LENGTH = 0.8   # Relative to the nose
+
+
+def ship_points(x, y, angle, size):
+    """The nose and wing tips of a ship at (x, y) facing angle degrees."""
+    angle_rad = math.radians(angle)
+    wing = math.radians(WING_ANGLE)
+    return [
+        (x + math.cos(angle_rad) * size, y + math.sin(angle_rad) * size),
+        (x + math.cos(angle_rad + wing) * size * WING_LENGTH, y + math.sin(angle_rad + wing) * size * WING_LENGTH),
+        (x + math.cos(angle_rad - wing) * size * WING_LENGTH, y + math.sin(angle_rad - wing) * size * WING_LENGTH),
+    ]
+
+
+class ShipSpriteAtlas:
+    """Pre-rotated, antialiased ship sprites per (color, size, angle step).
+
+    Replaces the per-frame triangle math and polygon fills: a ship is one
+    blit of the sprite nearest to its angle. Sprites are rendered the
+    first time they are needed and kept, at most ANGLE_STEPS per color and
+    size (a few KB each).
+    """
+
+    def __init__(self, angle_steps=ANGLE_STEPS):
+        self.angle_steps = angle_steps
+        self.step_degrees = 360 / angle_steps
+        self.ships = {}  # {(rgb, size): (half, [sprite or None per angle step])}
+
+    def __len__(self):
+        return sum(1 for _, rotations in self.ships.values() for sprite in rotations if sprite is not None)
+
+    def _rotations(self, rgb, size):
+        ship = self.ships.get((rgb, size))
+        if ship is None:
+            ship = self.ships[(rgb, size)] = (math.ceil(size) + OUTLINE_WIDTH, [None] * self.angle_steps)
+        return ship
+
+    def get(self, rgb, size, angle):
+        """The sprite nearest to angle, and the offset from the ship's center to its corner."""
+        half, rotations = self._rotations(rgb, size)
+        step = round(angle / self.step_degrees) % self.angle_steps
+        sprite = rotations[step]
+        if sprite is None:
+            sprite = rotations[step] = self._render(rgb, size, half, step * self.step_degrees)
+        return sprite, half
+
+    def prerender(self, rgb, size):
+        """Render every rotation of a ship now rather than on first use."""
+        for step in range(self.angle_steps):
+            self.get(rgb, size, step * self.step_degrees)
+
+    def blit_args(self, rgb, size, ships, offset_x=0, offset_y=0):
+        """(sprite, position) pairs for Surface.blits from (x, y, angle, ...) ships of one color and size."""
+        half, rotations = self._rotations(rgb, size)
+        step_degrees = self.step_degrees
+        steps = self.angle_steps
+        offset_x -= half
+        offset_y -= half
+        args = []
+        for x, y, angle, *_ in ships:
+            sprite = rotations[round(angle / step_degrees) % steps]
+            if sprite is None:
+                sprite = self.get(rgb, size, angle)[0]
+            args.append((sprite, (int(x + offset_x), int(y + offset_y))))
+        return args
+
+    def _render(self, rgb, size, half, angle):
+        big = pygame.Surface((2 * half * SUPERSAMPLE, 2 * half * SUPERSAMPLE), pygame.SRCALPHA)
+        points = ship_points(half * SUPERSAMPLE, half * SUPERSAMPLE, angle, size * SUPERSAMPLE)
+        pygame.draw.polygon(big, rgb, points)
+        pygame.draw.polygon(big, (255, 255, 255), points, OUTLINE_WIDTH * SUPERSAMPLE)
+        sprite = pygame.transform.smoothscale(big, (2 * half, 2 * half))
+        if pygame.display.get_surface() is not None:
+            sprite = sprite.convert_alpha()
+        return sprite
@@ -0,0 +1,211 @@
+"""Headless, deterministic simulation of a GameRoom.
+
+Drives the server's simulation tick by tick without sockets, threads or
+the wall clock: everything random comes from one random.Random(seed) and
+the tick scheduler runs on a ManualClock. The same seed, script and calls
+always produce the same world, which digest() summarizes.
+
+    sim = HeadlessSimulation(seed=1, script=random_script(1))
+    for _ in range(4):
+        sim.add_player()
+    sim.add_npcs(50)
+    sim.step(600)
+    print(sim.room.tick, sim.digest())
+
+Used by benchmark.py; also handy for reproducing a game situation.
+"""
+import hashlib
+import random
+from game_objects import NPC
+from game_room import WORLD_HEIGHT, WORLD_WIDTH, GameRoom
+from patterns import DEFAULT_EXPRESSION, PatternRegistry
+from protocol import FEATURE_BINARY_INPUT, FEATURE_DELTA, INPUT_KEYS, PROTOCOL_BINARY
+from tick_scheduler import TickScheduler
+
+# Ticks between input packets when the keys do not change (the client's keepalive)
+INPUT_KEEPALIVE_TICKS = 6
+
+
+class ManualClock:
+    """A clock for TickScheduler that only moves when slept on or advanced."""
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(0.0, seconds)
+
+    advance = sleep
+
+
+class RecordingSender:
+    """Stands in for a client's SendQueue: keeps the newest snapshot and counts bytes."""
+
+    def __init__(self):
+        self.epoch = 0
+        self.closed = False
+        self.control = []          # Control messages, in order
+        self.last_snapshot = None
+        self.snapshots = 0
+        self.bytes_sent = 0
+
+    def put_control(self, data, barrier=False):
+        self.control.append(data)
+        self.bytes_sent += len(data)
+        if barrier:
+            self.epoch += 1
+
+    def put_snapshot(self, data, epoch):
+        if epoch != self.epoch:
+            return
+        self.last_snapshot = data
+        self.snapshots += 1
+        self.bytes_sent += len(data)
+
+    def close(self):
+        self.closed = True
+
+
+def random_script(seed, change_every=30, fire_chance=0.3):
+    """A script where each player picks new random keys every change_every ticks."""
+    def script(tick, player_id):
+        if tick % change_every != player_id % change_every:
+            return None
+        rng = random.Random(f"{seed}:{player_id}:{tick}")
+        inputs = {key: rng.random() < 0.5 for key in INPUT_KEYS}
+        inputs['space'] = rng.random() < fire_chance
+        return inputs
+    return script
+
+
+class HeadlessSimulation:
+    """A GameRoom stepped by hand, with scripted inputs, a seeded RNG and a fake clock.
+
+    script(tick, player_id) returns the keys a player holds from that tick
+    on (a dict of w/a/s/d/space), or None to keep the previous ones. Inputs
+    are queued as input packets, like a client sends them: when the keys
+    change and as a keepalive, acknowledging the newest snapshot.
+
+    Players negotiate binary delta snapshots by default, so broadcast()
+    does the same encoding work as it does for real clients; their
+    RecordingSender holds what they would have received.
+    """
+
+    def __init__(self, seed=0, script=None, tick_rate=60, snapshot_rate=30,
+                 expression=DEFAULT_EXPRESSION, verbose=False):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.clock = ManualClock()
+        # Never started, so the expression never changes
+        self.patterns = PatternRegistry(None, expression)
+        self.room = GameRoom(tick_rate=tick_rate, snapshot_rate=snapshot_rate,
+                             patterns=self.patterns, rng=self.rng,
+                             clock=self.clock, sleep=self.clock.sleep, verbose=verbose)
+        self.scheduler = TickScheduler(tick_rate, snapshot_rate,
+                                       clock=self.clock, sleep=self.clock.sleep)
+        self.script = script
+        self.senders = {}      # {player_id: RecordingSender}
+        self.inputs = {}       # {player_id: keys currently held}
+        self.input_seq = {}    # {player_id: seq of the last input packet}
+        self.last_input = {}   # {player_id: tick the last input packet was queued}
+        self.acked_tick = None  # Newest snapshot broadcast so far
+
+    def add_player(self, protocol=PROTOCOL_BINARY, delta=True):
+        """Connect a scripted player. Returns its player id."""
+        sender = RecordingSender()
+        player_id = self.room.add_player(sender, ('headless', len(self.senders)))
+        with self.room.lock:
+            self.room.apply_client_message(player_id, {
+                'type': 'hello', 'protocol': protocol,
+                FEATURE_DELTA: delta, FEATURE_BINARY_INPUT: True
+            })
+        self.senders[player_id] = sender
+        self.inputs[player_id] = {key: False for key in INPUT_KEYS}
+        self.input_seq[player_id] = 0
+        self.last_input[player_id] = None
+        return player_id
+
+    def remove_player(self, player_id):
+        self.room.remove_player(player_id)
+        for table in (self.senders, self.inputs, self.input_seq, self.last_input):
+            table.pop(player_id, None)
+
+    def add_npcs(self, count):
+        """Add count NPCs at random positions (the room itself spawns at most MAX_NPCS)."""
+        room = self.room
+        with room.lock:
+            for _ in range(count):
+                x = self.rng.uniform(10, WORLD_WIDTH - 10)
+                y = self.rng.uniform(10, WORLD_HEIGHT - 10)
+                room.game_state['npcs'].append(NPC(x, y, room.next_npc_id, rng=self.rng))
+                room.next_npc_id += 1
+
+    def add_bullets(self, count, pattern_share=0.5):
+        """Spawn count bullets at random positions and headings.
+
+        A pattern_share of them follow the pattern expression; owners are
+        picked among the players (or the boss when there are none).
+        """
+        room = self.room
+        owners = list(self.senders) or ['boss']
+        with room.lock:
+            bullets = room.game_state['bullets']
+            for _ in range(count):
+                expression = self.patterns.expression if self.rng.random() < pattern_share else None
+                bullets.spawn(self.rng.uniform(0, WORLD_WIDTH), self.rng.uniform(0, WORLD_HEIGHT),
+                              self.rng.uniform(0, 360), owner_id=self.rng.choice(owners),
+                              expression=expression)
+
+    def queue_scripted_inputs(self):
+        """Queue the input packets the players send before the next tick."""
+        tick = self.room.tick + 1
+        for player_id in self.senders:
+            keys = self.script(tick, player_id) if self.script is not None else None
+            changed = keys is not None and keys != self.inputs[player_id]
+            last = self.last_input[player_id]
+            if not changed and last is not None and tick - last < INPUT_KEEPALIVE_TICKS:
+                continue
+            if keys is not None:
+                self.inputs[player_id] = keys
+            self.input_seq[player_id] += 1
+            self.last_input[player_id] = tick
+            self.room.queue_input(player_id, dict(self.inputs[player_id],
+                                                  seq=self.input_seq[player_id],
+                                                  ack=self.acked_tick))
+
+    def step(self, ticks=1):
+        """Advance the room by ticks, broadcasting snapshots when they are due.
+
+        Returns the number of snapshots broadcast.
+        """
+        room = self.room
+        snapshots = 0
+        for _ in range(ticks):
+            self.scheduler.wait()  # Moves the manual clock to the next tick
+            self.queue_scripted_inputs()
+            with room.lock:
+                room.simulate_tick()
+            if self.scheduler.snapshot_due(room.tick):
+                room.broadcast()
+                self.acked_tick = room.tick
+                snapshots += 1
+        return snapshots
+
+    def digest(self):
+        """A hash of the world state (not of the snapshots sent)."""
+        room = self.room
+        game_state = room.game_state
+        h = hashlib.sha256()
+        h.update(repr((room.tick, room.boss_level, room.checkpoint_score)).encode())
+        for player_id, player in sorted(game_state['players'].items()):
+            h.update(repr((player_id, player.get_state(), player.score)).encode())
+        for npc in game_state['npcs']:
+            h.update(repr((npc.npc_id, npc.get_state())).encode())
+        if game_state['boss'] is not None:
+            h.update(repr(game_state['boss'].get_state()).encode())
+        for arr in game_state['bullets'].get_arrays():
+            h.update(arr.tobytes())
+        return h.hexdigest()
@@ -0,0 +1,325 @@
+import threading
+from collections import OrderedDict, deque
+
+# A full keyframe is sent at least this often (ticks), even without loss
+KEYFRAME_INTERVAL = 60
+# Snapshots remembered per client as possible delta baselines (~1 s)
+HISTORY_SIZE = 64
+
+# Client playout delay (seconds): entities are drawn this far behind the
+# newest snapshot, so there is usually a snapshot on each side to
+# interpolate between even at 20-30 snapshots/s with some jitter.
+INTERPOLATION_DELAY = 0.1
+# How quickly the estimated server clock offset follows increased latency
+OFFSET_SMOOTHING = 0.02
+# Moves longer than this between two snapshots (wrapping around the world,
+# respawning) are drawn as a jump instead of being interpolated
+SNAP_DISTANCE = 200
+
+
+def interest_filter(world, x, y, radius):
+    """Entities of world within radius of (x, y).
+
+    Candidates come from the world's spatial indexes ('index' for players,
+    NPCs and the boss, 'bullet_grid' for bullets) and are then checked by
+    exact distance. Returns (players, npcs, boss, bullet_indices).
+    """
+    r2 = radius * radius
+    players = {}
+    npcs = {}
+    boss = None
+    for kind, key in world['index'].query(x, y, radius):
+        state = world['boss'] if kind == 'boss' else world[kind][key]
+        dx = state[0] - x
+        dy = state[1] - y
+        if dx * dx + dy * dy > r2:
+            continue
+        if kind == 'players':
+            players[key] = state
+        elif kind == 'npcs':
+            npcs[key] = state
+        else:
+            boss = state
+
+    xs, ys = world['bullets'][:2]
+    idx = world['bullet_grid'].query(x, y, radius)
+    dx = xs[idx] - x
+    dy = ys[idx] - y
+    return players, npcs, boss, idx[dx * dx + dy * dy <= r2]
+
+
+class ClientView:
+    """Server-side delta encoder state for one client.
+
+    Entity state is keyed by id: players by player id, NPCs by npc_id (both
+    as strings, so the maps survive JSON). Every snapshot sent to the client
+    is remembered for HISTORY_SIZE ticks. Deltas are computed against the
+    newest snapshot the client has acknowledged, so a snapshot lost or
+    skipped on the way never corrupts the client's view; if the baseline is
+    gone (or the client asked for a resync) a keyframe is sent instead.
+
+    With a view centre, only entities within view_radius are included
+    (area of interest); entities leaving it show up as removed.
+
+    build_message runs outside the room lock while acks and resync requests
+    arrive from other threads; resync_lock makes taking a resync request
+    and sending its keyframe one step, so no request is lost in between.
+    """
+
+    def __init__(self, view_radius=None):
+        self.view_radius = view_radius
+        self.history = OrderedDict()  # {tick: (players, npcs, boss)}
+        self.acked_tick = None
+        self.last_keyframe = None
+        self.resync_requested = True
+        self.resync_lock = threading.Lock()
+
+    def ack(self, tick):
+        """Record that the client has assembled the snapshot for tick."""
+        if tick in self.history and (self.acked_tick is None or tick > self.acked_tick):
+            self.acked_tick = tick
+
+    def request_resync(self):
+        with self.resync_lock:
+            self.resync_requested = True
+
+    def build_message(self, world, center=None):
+        """Return (message, bullet_indices) for this client.
+
+        world is the snapshot captured by the server for this tick (see
+        server_main.capture_world). The message is a 'keyframe' or 'delta';
+        bullets are not part of the delta, the caller attaches the bullets
+        at bullet_indices (None means all of them).
+        """
+        tick = world['tick']
+        if center is not None and self.view_radius is not None:
+            players, npcs, boss, bullet_idx = interest_filter(world, center[0], center[1],
+                                                              self.view_radius)
+        else:
+            players, npcs, boss, bullet_idx = world['players'], world['npcs'], world['boss'], None
+
+        # Read once: acks may arrive from another thread while this runs
+        acked_tick = self.acked_tick
+        base = self.history.get(acked_tick)
+        with self.resync_lock:
+            keyframe = (base is None or self.resync_requested
+                        or tick - self.last_keyframe >= KEYFRAME_INTERVAL)
+            if keyframe:
+                self.resync_requested = False
+
+        self.history[tick] = (players, npcs, boss)
+        while len(self.history) > HISTORY_SIZE:
+            self.history.popitem(last=False)
+
+        if keyframe:
+            self.last_keyframe = tick
+            return {
+                'type': 'keyframe',
+                'tick': tick,
+                'players': players,
+                'npcs': npcs,
+                'boss': boss,
+                'events': world['events'],
+            }, bullet_idx
+
+        base_players, base_npcs, base_boss = base
+        msg = {
+            'type': 'delta',
+            'tick': tick,
+            'base': acked_tick,
+            'players': {k: v for k, v in players.items() if base_players.get(k) != v},
+            'removed_players': [k for k in base_players if k not in players],
+            'npcs': {k: v for k, v in npcs.items() if base_npcs.get(k) != v},
+            'removed_npcs': [k for k in base_npcs if k not in npcs],
+            'events': world['events'],
+        }
+        if boss != base_boss:
+            msg['boss'] = boss  # None means the boss is gone
+        return msg, bullet_idx
+
+
+class SnapshotAssembler:
+    """Client-side counterpart of ClientView.
+
+    Applies keyframes and deltas onto stored snapshots and returns the full
+    keyed state for each message. The newest assembled tick is what the
+    client acknowledges back to the server.
+    """
+
+    def __init__(self, history_size=HISTORY_SIZE * 2):
+        self.history_size = history_size
+        self.states = OrderedDict()  # {tick: keyed state}
+        self.latest_tick = None
+
+    def apply(self, msg):
+        """Assemble a keyframe or delta. Returns None if its baseline is unknown."""
+        if msg['type'] == 'keyframe':
+            state = {
+                'players': dict(msg['players']),
+                'npcs': dict(msg['npcs']),
+                'boss': msg['boss'],
+            }
+        else:
+            base = self.states.get(msg['base'])
+            if base is None:
+                return None
+            players = dict(base['players'])
+            players.update(msg['players'])
+            for key in msg['removed_players']:
+                players.pop(key, None)
+            npcs = dict(base['npcs'])
+            npcs.update(msg['npcs'])
+            for key in msg['removed_npcs']:
+                npcs.pop(key, None)
+            state = {
+                'players': players,
+                'npcs': npcs,
+                'boss': msg['boss'] if 'boss' in msg else base['boss'],
+            }
+
+        state['tick'] = msg['tick']
+        state['bullets'] = msg['bullets']
+        state['events'] = msg['events']
+        state['input_seq'] = msg.get('input_seq')
+        state['input_held'] = msg.get('input_held')
+        state['speed'] = msg.get('speed')
+
+        self.states[msg['tick']] = state
+        while len(self.states) > self.history_size:
+            self.states.popitem(last=False)
+        if self.latest_tick is None or msg['tick'] > self.latest_tick:
+            self.latest_tick = msg['tick']
+        return state
+
+    def reset(self):
+        self.states.clear()
+        self.latest_tick = None
+
+
+def to_render_state(state):
+    """Flatten a keyed state into the dict shape GameRenderer.draw expects."""
+    return {
+        'type': 'state',
+        'tick': state['tick'],
+        'players': state['players'],
+        'npcs': list(state['npcs'].values()),
+        'boss': state['boss'],
+        'bullets': state['bullets'],
+        'events': state['events'],
+    }
+
+
+def _lerp_angle(a, b, alpha):
+    """Interpolate between two angles in degrees along the shorter arc."""
+    diff = (b - a + 180) % 360 - 180
+    return (a + diff * alpha) % 360
+
+
+def _lerp_entity(old, new, alpha):
+    """Interpolate the (x, y, angle) of an entity tuple; other fields come from new."""
+    if old is None:
+        return new
+    dx = new[0] - old[0]
+    dy = new[1] - old[1]
+    if dx * dx + dy * dy > SNAP_DISTANCE * SNAP_DISTANCE:
+        return new
+    return (old[0] + dx * alpha, old[1] + dy * alpha,
+            _lerp_angle(old[2], new[2], alpha)) + tuple(new[3:])
+
+
+class SnapshotBuffer:
+    """Client-side playout buffer that smooths out uneven snapshot arrival.
+
+    Snapshots are stored with their server time (tick / tick_rate). The
+    offset between the local clock and the server clock is taken from the
+    least-delayed snapshot seen, and sample() renders the world as it was
+    delay seconds before the newest snapshot, interpolating players, NPCs,
+    the boss and bullets between the two snapshots around that time. If no
+    newer snapshot has arrived yet, the newest one is held.
+
+    States are keyed states as built by SnapshotAssembler (NPCs keyed by
+    id) or plain 'state' messages (NPC list, drawn without interpolation).
+    Bullets are matched by their id (the fifth field).
+    """
+
+    def __init__(self, tick_rate=60, delay=INTERPOLATION_DELAY, size=32):
+        self.delay = delay
+        self.snapshots = deque(maxlen=size)  # [(server_time, state, bullets_by_id)]
+        self.reset(tick_rate)
+
+    def reset(self, tick_rate=None):
+        if tick_rate is not None:
+            self.tick_interval = 1 / tick_rate
+        self.snapshots.clear()
+        self.clock_offset = None  # local time - server time
+        self.played_tick = None   # Newest tick whose events were handed out
+
+    def push(self, state, now):
+        """Add a snapshot received at local time now (older or duplicate ticks are ignored)."""
+        if self.snapshots and state['tick'] <= self.snapshots[-1][1]['tick']:
+            return
+        server_time = state['tick'] * self.tick_interval
+        offset = now - server_time
+        if self.clock_offset is None or offset < self.clock_offset:
+            self.clock_offset = offset
+        else:
+            self.clock_offset += (offset - self.clock_offset) * OFFSET_SMOOTHING
+        bullets = {bullet[4]: bullet for bullet in state['bullets'] if len(bullet) > 4}
+        self.snapshots.append((server_time, state, bullets))
+
+    def sample(self, now):
+        """Render state for local time now, or None before the first snapshot."""
+        if not self.snapshots:
+            return None
+        render_time = now - self.clock_offset - self.delay
+
+        older = newer = None
+        for entry in self.snapshots:
+            if entry[0] <= render_time:
+                older = entry
+            else:
+                newer = entry
+                break
+
+        events = []
+        for server_time, state, _bullets in self.snapshots:
+            if server_time > render_time:
+                break
+            if self.played_tick is None or state['tick'] > self.played_tick:
+                events.extend(state['events'])
+                self.played_tick = state['tick']
+
+        if older is None or newer is None:
+            _server_time, state, _bullets = older or newer
+            return self._render_state(state, state['players'], state['npcs'], state['boss'],
+                                      state['bullets'], events)
+
+        alpha = (render_time - older[0]) / (newer[0] - older[0])
+        old_state, old_bullets = older[1], older[2]
+        new_state = newer[1]
+
+        players = {key: _lerp_entity(old_state['players'].get(key), value, alpha)
+                   for key, value in new_state['players'].items()}
+        npcs = new_state['npcs']
+        if isinstance(npcs, dict) and isinstance(old_state['npcs'], dict):
+            npcs = {key: _lerp_entity(old_state['npcs'].get(key), value, alpha)
+                    for key, value in npcs.items()}
+        boss = new_state['boss']
+        if boss is not None:
+            boss = _lerp_entity(old_state['boss'], boss, alpha)
+        bullets = [_lerp_entity(old_bullets.get(bullet[4]), bullet, alpha) if len(bullet) > 4
+                   else bullet
+                   for bullet in new_state['bullets']]
+        return self._render_state(new_state, players, npcs, boss, bullets, events)
+
+    @staticmethod
+    def _render_state(state, players, npcs, boss, bullets, events):
+        return {
+            'type': 'state',
+            'tick': state['tick'],
+            'players': players,
+            'npcs': list(npcs.values()) if isinstance(npcs, dict) else npcs,
+            'boss': boss,
+            'bullets': bullets,
+            'events': events,
+        }
@@ -0,0 +1,96 @@
+import math
+from collections import defaultdict
+import numpy as np
+
+# Default cell size in pixels. Must be comfortably larger than the biggest
+# hitbox diameter so a query only ever touches a handful of cells.
+CELL_SIZE = 64
+
+
+class SpatialHash:
+    """Uniform grid over game objects that have x/y attributes.
+
+    Rebuilt once per tick with build(); query() returns the objects in every
+    cell overlapped by a circle's bounding box, so callers only run the
+    exact check_collision test on nearby objects. insert_at() stores plain
+    items (such as snapshot keys) at a given position instead.
+    """
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)  # {(cx, cy): [objects]}
+
+    def _cell(self, x, y):
+        return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+    def build(self, objects):
+        """Clear the grid and insert every object."""
+        self.cells.clear()
+        for obj in objects:
+            self.insert(obj)
+
+    def insert(self, obj):
+        self.cells[self._cell(obj.x, obj.y)].append(obj)
+
+    def insert_at(self, item, x, y):
+        """Insert an arbitrary item (e.g. an entity key) at an explicit position."""
+        self.cells[self._cell(x, y)].append(item)
+
+    def query(self, x, y, radius):
+        """Objects whose cell overlaps the square around (x, y) of half-size radius."""
+        min_cx, min_cy = self._cell(x - radius, y - radius)
+        max_cx, max_cy = self._cell(x + radius, y + radius)
+        found = []
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                cell = self.cells.get((cx, cy))
+                if cell:
+                    found.extend(cell)
+        return found
+
+
+class PointGrid:
+    """Uniform grid over NumPy point arrays (used for the bullet pool).
+
+    Points are bucketed by sorting their cell keys, so a build is one argsort
+    and a query is a binary search per overlapped cell. Queries return point
+    indices in ascending order.
+    """
+    # Cell coordinates are offset so keys stay non-negative for any position
+    # within +-KEY_SPAN/2 cells of the origin.
+    KEY_SPAN = 1 << 20
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.order = np.zeros(0, dtype=np.intp)
+        self.sorted_keys = np.zeros(0, dtype=np.int64)
+
+    def _keys(self, cx, cy):
+        half = self.KEY_SPAN // 2
+        return (cx + half) * self.KEY_SPAN + (cy + half)
+
+    def build(self, xs, ys):
+        """Index the points (xs[i], ys[i])."""
+        cx = np.floor(xs / self.cell_size).astype(np.int64)
+        cy = np.floor(ys / self.cell_size).astype(np.int64)
+        keys = self._keys(cx, cy)
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.order]
+
+    def query(self, x, y, radius):
+        """Indices of points whose cell overlaps the square around (x, y)."""
+        min_cx = math.floor((x - radius) / self.cell_size)
+        max_cx = math.floor((x + radius) / self.cell_size)
+        min_cy = math.floor((y - radius) / self.cell_size)
+        max_cy = math.floor((y + radius) / self.cell_size)
+
+        # Each column of cells is one contiguous key range
+        chunks = []
+        for cx in range(min_cx, max_cx + 1):
+            lo = np.searchsorted(self.sorted_keys, self._keys(cx, min_cy), side='left')
+            hi = np.searchsorted(self.sorted_keys, self._keys(cx, max_cy), side='right')
+            if hi > lo:
+                chunks.append(self.order[lo:hi])
+        if not chunks:
+            return np.zeros(0, dtype=np.intp)
+        return np.sort(np.concatenate(chunks))
@@ -0,0 +1,104 @@
+import json
+import random
+import socket
+import threading
+import pytest
+from framing import FRAME_HEADER, READ_AHEAD, FrameReader, FrameTooLarge
+from protocol import (MAX_INPUT_FRAME, InputStream, encode_input, encode_json_message,
+                      pack_frame)
+
+
+def test_lines_then_frames_in_random_chunks():
+    rng = random.Random(1)
+    lines = [json.dumps({'type': 'x', 'i': i, 's': 'ü€' * rng.randint(0, 50)}).encode()
+             for i in range(50)]
+    frames = [bytes(rng.getrandbits(8) for _ in range(rng.choice([0, 1, 10, 5000, 70000])))
+              for _ in range(30)]
+    stream = b''.join(line + b'\n' for line in lines) + b''.join(pack_frame(f) for f in frames)
+
+    for _ in range(10):
+        reader = FrameReader(recv_size=rng.choice([16, 1024, 65536]))
+        got_lines, got_frames = [], []
+        pos = 0
+        while pos < len(stream):
+            n = rng.randint(1, 20000)
+            reader.feed(stream[pos:pos + n])
+            pos += n
+            while not reader.framed:
+                line = reader.next_message()
+                if line is None:
+                    break
+                got_lines.append(line)
+                # Switch mid-stream, as after the binary handshake
+                reader.framed = len(got_lines) == len(lines)
+            if reader.framed:
+                got_frames += reader.messages()
+        assert got_lines == lines
+        assert got_frames == frames
+        assert len(reader) == 0
+
+
+def test_recv_into_reads_large_frames():
+    a, b = socket.socketpair()
+    try:
+        payloads = [bytes([i]) * 300000 for i in range(3)]
+        sender = threading.Thread(target=a.sendall, args=(b''.join(pack_frame(p) for p in payloads),))
+        sender.start()
+        reader = FrameReader(framed=True)
+        got = []
+        while len(got) < len(payloads):
+            assert reader.recv_into(b) > 0
+            got += reader.messages()
+        assert got == payloads
+        sender.join()
+    finally:
+        a.close()
+        b.close()
+
+
+def test_oversized_frame_header_is_rejected_before_buffering():
+    reader = FrameReader(framed=True, max_frame=1000)
+    reader.feed(b'\xff\xff\xff\xf0')
+    with pytest.raises(FrameTooLarge):
+        reader.next_message()
+    assert len(reader.buffer) < 1 << 20
+
+
+def test_buffer_grows_only_read_ahead_beyond_received_data():
+    reader = FrameReader(framed=True, max_frame=1 << 30)
+    reader.feed(FRAME_HEADER.pack((1 << 30) - 1))
+    assert reader.next_message() is None
+    assert len(reader.buffer) <= FRAME_HEADER.size + READ_AHEAD
+
+
+def test_oversized_line_is_rejected():
+    reader = FrameReader(max_frame=100)
+    reader.feed(b'x' * 101)
+    with pytest.raises(FrameTooLarge):
+        reader.next_message()
+    reader = FrameReader(max_frame=100)
+    reader.feed(b'x' * 101 + b'\n')
+    with pytest.raises(FrameTooLarge):
+        reader.next_message()
+
+
+def test_input_stream_switches_to_frames_and_limits_size():
+    stream = InputStream()
+    data = (json.dumps({'type': 'hello', 'binary_input': True}).encode() + b'\n'
+            + pack_frame(encode_input({'w': True}, 5, 7))
+            + pack_frame(encode_json_message({'type': 'resync'})))
+    messages = []
+    for i in range(len(data)):
+        messages += stream.feed(data[i:i + 1])
+    assert [m.get('type') for m in messages] == ['hello', None, 'resync']
+    assert messages[1]['w'] and messages[1]['seq'] == 5 and messages[1]['ack'] == 7
+
+    with pytest.raises(FrameTooLarge):
+        stream.feed(FRAME_HEADER.pack(MAX_INPUT_FRAME + 1))
+
+
+def test_input_stream_skips_json_that_is_not_an_object():
+    stream = InputStream()
+    data = (b'[]\n1\n' + json.dumps({'type': 'hello', 'binary_input': True}).encode() + b'\n'
+            + pack_frame(b'J[]') + pack_frame(b'J1') + pack_frame(encode_json_message({'type': 'resync'})))
+    assert [m.get('type') for m in stream.feed(data)] == ['hello', 'resync']
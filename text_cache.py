@@ -0,0 +1,51 @@
+from collections import OrderedDict
+import pygame
+
+# Distinct (font, text, color) surfaces kept; labels and HUD lines need far fewer
+DEFAULT_MAX_ENTRIES = 256
+
+
+class TextCache:
+    """LRU cache of rendered text surfaces keyed by (font, text, color).
+
+    Font rasterization is one of the most expensive calls in a frame, and
+    most of the text on screen (player labels, HUD values) is the same as
+    in the previous frame. Text that changes (score, HP) gets a new entry,
+    and the least recently used ones are dropped past max_entries.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.surfaces)
+
+    def clear(self):
+        self.surfaces.clear()
+
+    def render(self, font, text, color):
+        """The antialiased surface of text in color, rendered on first use."""
+        key = (font, text, tuple(color))
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        surface = render_text(font, text, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_entries:
+            self.surfaces.popitem(last=False)
+        return surface
+
+
+def render_text(font, text, color):
+    """Render text once, converted for fast blits when a display exists."""
+    surface = font.render(text, True, color)
+    if pygame.display.get_surface() is not None:
+        surface = surface.convert_alpha()
+    return surface
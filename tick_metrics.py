@@ -0,0 +1,196 @@
+"""Tick instrumentation shared between the game server and the admin web app.
+
+The server's game loop writes one record per loop iteration (normally one
+tick) into a ring buffer in an mmap'ed file; webapp.py maps the same file
+read-only and summarizes the newest records. There is one writer per file
+and no locking: the writer fills a slot, then bumps the record count in
+the header, and readers drop any slot that may have been overwritten
+while they were copying.
+
+File layout (little endian):
+
+    [8s magic][u4 header size][u4 capacity][u4 field count][u4 tick rate][u8 records written]
+    [JSON list of field names, padded to HEADER_SIZE]
+    [capacity x field count float64 records]
+
+Phase durations are in seconds. Each record holds:
+- time: wall clock time of the record.
+- tick: the room's tick.
+- ticks: ticks simulated in this loop iteration.
+- loop: the iteration's total work time.
+- One column per phase (see GameRoom.PHASES and BROADCAST_PHASES).
+- players, npcs, bullets: entity counts.
+- bytes_sent: snapshot bytes handed to the clients.
+- overrun: 1 if the work took longer than the ticks' budget.
+- skipped: ticks the scheduler has dropped so far.
+"""
+import json
+import mmap
+import os
+import struct
+import time
+import numpy as np
+
+METRICS_MAGIC = b'TKMETRC1'
+METRICS_HEADER = struct.Struct('<8sIIIIQ')
+HEADER_SIZE = 4096
+COUNT_OFFSET = 24  # Offset of 'records written' in METRICS_HEADER
+DEFAULT_CAPACITY = 3600  # One minute at 60 ticks/s
+
+COUNTERS = ['players', 'npcs', 'bullets', 'bytes_sent', 'overrun', 'skipped']
+
+# One file per room: tick_metrics.bin for a single-room server,
+# tick_metrics.room<id>.bin for the rooms of a sharded one
+METRICS_FILE = "tick_metrics.bin"
+METRICS_GLOB = "tick_metrics*.bin"
+
+
+def metrics_path(room_id=None, directory=""):
+    if room_id is None:
+        return os.path.join(directory, METRICS_FILE)
+    return os.path.join(directory, f"tick_metrics.room{room_id}.bin")
+
+
+class TickMetrics:
+    """Writes per-phase timings and counters of a GameRoom into a ring buffer file.
+
+    Set add() as the room's phase_timer and call commit() once per game
+    loop iteration. The cost is a couple of perf_counter calls per phase
+    and one row assignment per tick. tick_rate is the room's, published in
+    the header so readers know the per-tick budget.
+    """
+
+    def __init__(self, path, phases, tick_rate, capacity=DEFAULT_CAPACITY, remove_on_close=False):
+        self.path = path
+        self.tick_rate = tick_rate
+        self.fields = ['time', 'tick', 'ticks', 'loop'] + list(phases) + COUNTERS
+        self.columns = {name: i for i, name in enumerate(self.fields)}
+        self.capacity = capacity
+        self.remove_on_close = remove_on_close
+        self.count = 0
+        self.row = [0.0] * len(self.fields)
+        self.last_bytes_sent = 0
+
+        names = json.dumps(self.fields).encode()
+        if METRICS_HEADER.size + len(names) > HEADER_SIZE:
+            raise ValueError("too many metric fields")
+        size = HEADER_SIZE + capacity * len(self.fields) * 8
+        with open(path, 'wb') as f:
+            f.truncate(size)
+        self.file = open(path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), size)
+        METRICS_HEADER.pack_into(self.map, 0, METRICS_MAGIC, HEADER_SIZE, capacity, len(self.fields),
+                                 round(tick_rate), 0)
+        self.map[METRICS_HEADER.size:METRICS_HEADER.size + len(names)] = names
+        self.rows = np.ndarray((capacity, len(self.fields)), dtype='<f8', buffer=self.map, offset=HEADER_SIZE)
+
+    def add(self, name, seconds):
+        """Phase timer: add seconds to the named phase of the current record."""
+        self.row[self.columns[name]] += seconds
+
+    def commit(self, room, ticks, work, scheduler):
+        """Publish the current record and start the next one."""
+        row = self.row
+        columns = self.columns
+        game_state = room.game_state
+        row[0] = time.time()
+        row[1] = room.tick
+        row[2] = ticks
+        row[3] = work
+        row[columns['players']] = len(game_state['players'])
+        row[columns['npcs']] = len(game_state['npcs'])
+        row[columns['bullets']] = game_state['bullets'].count
+        row[columns['bytes_sent']] = room.bytes_sent - self.last_bytes_sent
+        row[columns['overrun']] = work > ticks * scheduler.tick_interval
+        row[columns['skipped']] = scheduler.skipped
+        self.last_bytes_sent = room.bytes_sent
+
+        self.rows[self.count % self.capacity] = row
+        self.count += 1
+        struct.pack_into('<Q', self.map, COUNT_OFFSET, self.count)
+        self.row = [0.0] * len(row)
+
+    def close(self):
+        self.rows = None
+        self.map.close()
+        self.file.close()
+        if self.remove_on_close:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def read_metrics(path, last=None):
+    """The field names, newest records (up to last) and tick rate of a metrics file.
+
+    Returns (fields, records, tick_rate) with records a float64 array,
+    oldest first, and tick_rate None if the writer did not record it, or
+    None if path is not a metrics file.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        if len(data) < HEADER_SIZE:
+            return None
+        magic, header_size, capacity, n_fields, tick_rate, before = METRICS_HEADER.unpack_from(data, 0)
+        if magic != METRICS_MAGIC:
+            return None
+        fields = json.loads(bytes(data[METRICS_HEADER.size:header_size]).rstrip(b'\0'))
+        rows = np.ndarray((capacity, n_fields), dtype='<f8', buffer=data, offset=header_size)
+
+        available = min(before, capacity)
+        if last is not None:
+            available = min(available, last)
+        indices = np.arange(before - available, before) % capacity
+        records = rows[indices].copy()
+        del rows
+
+        # Records up to number after - capacity may have been (or be being)
+        # overwritten by the writer while we were copying
+        after = struct.unpack_from('<Q', data, COUNT_OFFSET)[0]
+        overwritten = after - (before - available) - capacity
+        if overwritten >= 0:
+            records = records[overwritten + 1:]
+        return fields, records, tick_rate or None
+    finally:
+        data.close()
+
+
+def summarize(fields, records, tick_rate=None):
+    """Percentiles per phase and totals over the records, for display."""
+    if len(records) == 0:
+        return {'records': 0, 'tick_rate': tick_rate}
+    column = {name: records[:, i] for i, name in enumerate(fields)}
+    ticks = max(1.0, float(column['ticks'].sum()))
+    span = float(column['time'][-1] - column['time'][0]) if len(records) > 1 else 0.0
+
+    phases = {}
+    timed = [name for name in fields if name not in COUNTERS and name not in ('time', 'tick', 'ticks')]
+    for name in timed:
+        values = column[name] * 1000
+        phases[name] = {
+            'mean_ms': round(float(values.mean()), 3),
+            'p50_ms': round(float(np.percentile(values, 50)), 3),
+            'p99_ms': round(float(np.percentile(values, 99)), 3),
+            'max_ms': round(float(values.max()), 3),
+        }
+
+    return {
+        'records': len(records),
+        'tick': int(column['tick'][-1]),
+        'age_s': round(time.time() - float(column['time'][-1]), 2),
+        'ticks_per_s': round(ticks / span, 1) if span > 0 else None,
+        'tick_rate': tick_rate,
+        'tick_budget_ms': round(1000 / tick_rate, 3) if tick_rate else None,
+        'phases': phases,
+        'players': int(column['players'][-1]),
+        'npcs': int(column['npcs'][-1]),
+        'bullets': int(column['bullets'][-1]),
+        'bytes_per_s': round(float(column['bytes_sent'].sum()) / span) if span > 0 else None,
+        'overruns': int(column['overrun'].sum()),
+        'skipped': int(column['skipped'][-1]),
+    }
@@ -0,0 +1,52 @@
+import time
+
+
+class TickScheduler:
+    """Fixed-timestep pacing for the server's game loop.
+
+    Ticks are scheduled on a monotonic clock (time.perf_counter) against a
+    running deadline, so the rate does not drift with the time spent
+    simulating and is immune to wall-clock jumps. When the loop falls
+    behind, wait() returns several ticks to run back to back; after more
+    than max_catch_up missed ticks the backlog is dropped instead of
+    fast-forwarding the game.
+
+    Snapshots are sent every send_interval ticks (tick_rate / send_rate,
+    rounded to a whole number of ticks).
+    """
+
+    def __init__(self, tick_rate, send_rate, max_catch_up=5,
+                 clock=time.perf_counter, sleep=time.sleep):
+        self.tick_interval = 1 / tick_rate
+        self.send_interval = max(1, round(tick_rate / send_rate))
+        self.max_catch_up = max_catch_up
+        self.clock = clock
+        self.sleep = sleep
+        self.next_tick = None
+        self.next_send = 0
+        self.skipped = 0  # Ticks dropped because the loop fell too far behind
+
+    def wait(self):
+        """Sleep until the next tick is due. Returns how many ticks to run now."""
+        now = self.clock()
+        if self.next_tick is None:
+            self.next_tick = now
+        if now < self.next_tick:
+            self.sleep(self.next_tick - now)
+            now = self.clock()
+
+        due = int((now - self.next_tick) / self.tick_interval) + 1
+        if due > self.max_catch_up:
+            self.skipped += due - self.max_catch_up
+            due = self.max_catch_up
+            self.next_tick = now + self.tick_interval
+        else:
+            self.next_tick += due * self.tick_interval
+        return due
+
+    def snapshot_due(self, tick):
+        """Whether a snapshot should be sent after simulating up to tick."""
+        if tick < self.next_send:
+            return False
+        self.next_send = tick - tick % self.send_interval + self.send_interval
+        return True
@@ -0,0 +1,93 @@
+"""UDP channel for snapshots and input packets.
+
+A client that wants it gets a token in its 'init' message. Once the binary
+protocol is confirmed, the client sends KIND_REGISTER datagrams carrying
+the token until the server answers {'type': 'udp'} over TCP. After that:
+
+- client -> server: [u32 token][input packet payload] (see encode_input)
+- server -> client: a keyframe/delta snapshot payload, without the length
+  prefix. Snapshots larger than MAX_DATAGRAM still go over TCP.
+
+Datagrams can be lost or reordered, so both ends drop anything older than
+what they already have (input seq on the server, snapshot tick on the
+client). Deltas are built against acknowledged baselines, so a lost
+snapshot never breaks the client's view.
+
+LossySocket simulates loss and latency on the sending side, for testing
+over loopback.
+"""
+import heapq
+import random
+import struct
+import threading
+import time
+
+UDP_TOKEN = struct.Struct('<I')
+# Keep datagrams under a typical path MTU so they are never fragmented
+MAX_DATAGRAM = 1200
+
+
+class LossySocket:
+    """Wraps a UDP socket, dropping and delaying outgoing datagrams.
+
+    Each datagram is dropped with probability loss, otherwise delivered
+    after latency plus a uniform random jitter (so datagrams may also be
+    reordered). Everything else is passed through to the wrapped socket.
+    """
+
+    def __init__(self, sock, loss=0.0, latency=0.0, jitter=0.0, seed=None):
+        self.sock = sock
+        self.loss = loss
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.queue = []  # heap of (due time, order, data, address)
+        self.order = 0
+        self.cond = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self._deliver, daemon=True)
+        self.thread.start()
+
+    def sendto(self, data, address):
+        if self.rng.random() < self.loss:
+            return len(data)
+        due = time.perf_counter() + self.latency + self.rng.uniform(0, self.jitter)
+        with self.cond:
+            heapq.heappush(self.queue, (due, self.order, bytes(data), address))
+            self.order += 1
+            self.cond.notify()
+        return len(data)
+
+    def _deliver(self):
+        while True:
+            with self.cond:
+                while not self.closed and not self.queue:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                due, _order, data, address = self.queue[0]
+                wait = due - time.perf_counter()
+                if wait > 0:
+                    self.cond.wait(wait)
+                    continue
+                heapq.heappop(self.queue)
+            try:
+                self.sock.sendto(data, address)
+            except OSError:
+                pass
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.sock.close()
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+def make_udp_socket(sock, loss=0.0, latency=0.0, jitter=0.0):
+    """sock, wrapped in a LossySocket if any loss or latency is requested."""
+    if loss or latency or jitter:
+        return LossySocket(sock, loss=loss, latency=latency, jitter=jitter)
+    return sock
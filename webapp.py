@@ -1,8 +1,12 @@
+import glob
 import json
 import os
 import logging
-from flask import Flask, render_template, request
+import numpy as np
+from flask import Flask, jsonify, render_template, request
 from calcs import convert_request_to_expression
+from patterns import get_trajectory
+from tick_metrics import METRICS_GLOB, read_metrics, summarize
 
 logging.basicConfig(
     filename='app.log',
@@ -13,12 +17,41 @@ logging.basicConfig(
 app = Flask(__name__)
 
 PATTERN_FILE = os.path.join(os.path.dirname(__file__), "pattern.json")
+# The game server publishes tick metrics next to the pattern file, one file per room
+METRICS_DIR = os.path.dirname(__file__)
+METRICS_WINDOW = 600  # Newest records summarized (10 s at 60 ticks/s)
+
+# Size of the trajectory preview on the admin page
+PREVIEW_WIDTH = 600
+PREVIEW_HEIGHT = 200
+PREVIEW_TICKS = 90
+
+
+def trajectory_preview(expression, speed=12):
+    """SVG polyline points for a bullet fired to the right with this pattern.
+
+    Uses the same trajectory table as the server, so the preview matches the
+    in-game path (offsets accumulate perpendicular to travel each tick).
+    """
+    table = get_trajectory(expression)
+    if table is None:
+        return ""
+
+    xs = speed * np.arange(PREVIEW_TICKS + 1)
+    ys = np.cumsum(table[:PREVIEW_TICKS + 1], dtype=np.float64)
+    scale_x = PREVIEW_WIDTH / xs[-1]
+    span_y = max(float(np.abs(ys).max()), 1.0)
+    scale_y = (PREVIEW_HEIGHT / 2 - 5) / span_y
+    return " ".join(
+        f"{x * scale_x:.1f},{PREVIEW_HEIGHT / 2 + y * scale_y:.1f}" for x, y in zip(xs, ys)
+    )
 
 
 @app.route("/admin", methods=["GET", "POST"])
 def admin_page():
     success_message = ""
     generated_expr = ""
+    preview_points = ""
 
     if request.method == "POST":
         pattern = request.form.get("pattern", "").strip()
@@ -30,18 +63,45 @@ def admin_page():
                 "name": pattern,
                 "expression": generated_expr,
             }
-            with open(PATTERN_FILE, "w", encoding="utf-8") as f:
+            # Write then rename, so the game server's watcher never sees a half-written file
+            tmp_file = PATTERN_FILE + ".tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
                 json.dump(pattern_data, f, indent=4)
+            os.replace(tmp_file, PATTERN_FILE)
 
             success_message = f"Pattern '{pattern}' saved successfully!"
+            preview_points = trajectory_preview(generated_expr)
             logging.info(f"Admin set bullet pattern: {pattern} -> {generated_expr}")
 
     return render_template(
         "admin.html",
         success_message=success_message,
         generated_expr=generated_expr,
+        preview_points=preview_points,
+        preview_width=PREVIEW_WIDTH,
+        preview_height=PREVIEW_HEIGHT,
     )
 
 
+def room_metrics():
+    """Summaries of the newest METRICS_WINDOW records of every room, by file name."""
+    rooms = {}
+    for path in sorted(glob.glob(os.path.join(METRICS_DIR, METRICS_GLOB))):
+        result = read_metrics(path, last=METRICS_WINDOW)
+        if result is not None:
+            rooms[os.path.basename(path)] = summarize(*result)
+    return rooms
+
+
+@app.route("/metrics")
+def metrics():
+    return jsonify({"window": METRICS_WINDOW, "rooms": room_metrics()})
+
+
+@app.route("/metrics/live")
+def metrics_page():
+    return render_template("metrics.html", window=METRICS_WINDOW)
+
+
 if __name__ == "__main__":
     app.run(port=5000, debug=True)